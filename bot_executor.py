@@ -1,36 +1,389 @@
+import asyncio
+import importlib.util
+import json
 import logging
-import subprocess
+import py_compile
 import os
-import signal
+import re
+import sys
 import time
-from typing import Dict, Optional, List
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, List, Set, Tuple
 from dataclasses import dataclass
 from datetime import datetime
 from config import config
+from bot_logs import bot_logs
+from bot_state import AdoptedProcess, BotRecord, BotStateStore, process_alive, process_start_time
+from resource_monitor import ResourceMonitor
+import zygote
 
 logger = logging.getLogger(__name__)
 
+# Imports a compiled bot without running its __main__ block and checks it
+# defines a bot class; run in a throwaway interpreter
+IMPORT_CHECK_SCRIPT = """
+import importlib.machinery, importlib.util, sys
+loader = importlib.machinery.SourcelessFileLoader("generated_bot", sys.argv[1])
+spec = importlib.util.spec_from_loader("generated_bot", loader)
+module = importlib.util.module_from_spec(spec)
+loader.exec_module(module)
+if not any(
+    isinstance(value, type) and value.__module__ == "generated_bot" and hasattr(value, "run")
+    for value in vars(module).values()
+):
+    sys.exit("ImportCheckError: no bot class with a run() method")
+"""
+
+# Environment variables the import check may see; it never gets our secrets
+_CHECK_ENV_KEYS = ('PATH', 'PYTHONPATH', 'HOME', 'LANG', 'SYSTEMROOT', 'VIRTUAL_ENV')
+
+HOST_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot_host.py')
+# Longest line read from a bot or bot host's output
+_HOST_LINE_LIMIT = 1024 * 1024
+_BUILD_APPLICATION = re.compile(r'^\s+def build_application\(self', re.MULTILINE)
+
+def compiled_path(bot_code_path: str) -> str:
+    """Where the cached bytecode for a bot file lives"""
+    return importlib.util.cache_from_source(bot_code_path)
+
+def precompile_bot(bot_code_path: str) -> str:
+    """
+    Compile a bot file to cached bytecode
+    
+    Returns:
+        Path to the .pyc file
+    
+    Raises:
+        py_compile.PyCompileError: If the code does not compile
+    """
+    return py_compile.compile(bot_code_path, cfile=compiled_path(bot_code_path), doraise=True)
+
+async def check_bot_imports(pyc_path: str, timeout: float) -> Optional[str]:
+    """
+    Import a compiled bot in a throwaway interpreter
+    
+    Returns:
+        None if the module imports and defines a bot class, else the error
+    """
+    env = {key: os.environ[key] for key in _CHECK_ENV_KEYS if key in os.environ}
+    env['BOT_TOKEN'] = 'import-check'
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, '-c', IMPORT_CHECK_SCRIPT, pyc_path,
+        env=env,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return f"Import took longer than {timeout:.0f}s"
+    
+    if process.returncode == 0:
+        return None
+    lines = stderr.decode('utf-8', errors='replace').strip().splitlines()
+    # The last traceback line names the exception
+    return lines[-1] if lines else f"Import check exited with code {process.returncode}"
+
+def supports_hosting(bot_code_path: str) -> bool:
+    """Whether a bot file can run inside a shared bot host (older bots only have run())"""
+    try:
+        with open(bot_code_path, 'r', encoding='utf-8') as f:
+            return bool(_BUILD_APPLICATION.search(f.read()))
+    except OSError:
+        return False
+
+def _entry_point(bot_code_path: str) -> str:
+    """Cached bytecode when it is up to date, skipping the compile, else the source"""
+    pyc_path = compiled_path(bot_code_path)
+    if os.path.exists(pyc_path) and os.path.getmtime(pyc_path) >= os.path.getmtime(bot_code_path):
+        return pyc_path
+    return bot_code_path
+
+# Starts a program: (script and arguments, environment, whether stdin is a pipe) -> process
+Spawner = Callable[[List[str], Dict[str, str], bool], Awaitable[Any]]
+
+class HostProcess:
+    """Parent-side handle on one bot_host.py worker running many bots"""
+    
+    def __init__(self, index: int, spawn: Spawner):
+        self.index = index
+        self.spawn = spawn
+        self.process: Optional[Any] = None
+        self.reader: Optional[asyncio.Task] = None
+        # bot_id -> future resolved with (exit code, error) when the bot exits
+        self.exits: Dict[str, asyncio.Future] = {}
+        # bot_id -> future resolved once the bot's code is imported and built
+        self.loads: Dict[str, asyncio.Future] = {}
+        self.last_heartbeat = time.monotonic()
+        # Bots whose updater stopped without being asked to
+        self.stalled: Set[str] = set()
+        # Seconds since each bot last got an update, as of the last heartbeat
+        self.idle: Dict[str, float] = {}
+    
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+    
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process else None
+    
+    @property
+    def load(self) -> int:
+        return len(self.exits)
+    
+    def idle_seconds(self, bot_id: str) -> Optional[float]:
+        idle = self.idle.get(bot_id)
+        if idle is None:
+            return None
+        return idle + time.monotonic() - self.last_heartbeat
+    
+    async def start(self):
+        env = os.environ.copy()
+        env['PYTHONUNBUFFERED'] = '1'
+        env['BOT_HEARTBEAT_INTERVAL'] = str(config.BOT_HEARTBEAT_INTERVAL)
+        self.last_heartbeat = time.monotonic()
+        self.process = await self.spawn([HOST_SCRIPT, str(self.index)], env, True)
+        self.reader = asyncio.ensure_future(self._read())
+        logger.info(f"Started bot host {self.index} (PID: {self.process.pid})")
+    
+    async def send(self, **command):
+        try:
+            self.process.stdin.write((json.dumps(command) + "\n").encode("utf-8"))
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            # The reader reports the host's bots as exited
+            logger.warning(f"Bot host {self.index} is gone: {e}")
+    
+    async def start_bot(
+        self,
+        bot_id: str,
+        path: str,
+        token: str,
+        name: str,
+        webhook: Optional[Dict[str, str]] = None
+    ) -> Tuple[asyncio.Future, asyncio.Future]:
+        """
+        Ask the host to run a bot, polling or, given a webhook endpoint, fed by the ingress
+        
+        Returns:
+            Futures for the bot's code being loaded and for its exit
+        """
+        loop = asyncio.get_running_loop()
+        load_future = self.loads[bot_id] = loop.create_future()
+        exit_future = self.exits[bot_id] = loop.create_future()
+        await self.send(op="start", bot_id=bot_id, path=os.path.abspath(path), token=token, name=name, webhook=webhook)
+        return load_future, exit_future
+    
+    async def kill_bot(self, bot_id: str, timeout: float = 5):
+        """Cancel a bot's tasks without waiting for a clean shutdown"""
+        exit_future = self.exits.get(bot_id)
+        if exit_future is None:
+            return
+        await self.send(op="kill", bot_id=bot_id)
+        try:
+            await asyncio.wait_for(asyncio.shield(exit_future), timeout)
+        except asyncio.TimeoutError:
+            self._resolve(bot_id, -9, "Killed (host unresponsive)")
+    
+    def _resolve(self, bot_id: str, code: int, error: Optional[str]):
+        load_future = self.loads.pop(bot_id, None)
+        if load_future is not None and not load_future.done():
+            load_future.cancel()
+        exit_future = self.exits.pop(bot_id, None)
+        if exit_future is not None and not exit_future.done():
+            exit_future.set_result((code, error))
+    
+    async def _read(self):
+        """Dispatch host events until the host exits"""
+        stream = self.process.stdout
+        while True:
+            try:
+                raw = await stream.readline()
+            except ValueError:
+                logger.warning(f"Bot host {self.index} sent an oversized line")
+                continue
+            if not raw:
+                break
+            try:
+                event = json.loads(raw)
+            except ValueError:
+                # Output from before the host took over stdout, e.g. a crash
+                logger.warning(f"Bot host {self.index}: {raw.decode('utf-8', errors='replace').rstrip()}")
+                continue
+            
+            kind = event.get("event")
+            bot_id = event.get("bot_id")
+            if kind == "log":
+                if bot_id is None:
+                    logger.info(f"Bot host {self.index}: {event.get('line', '')}")
+                else:
+                    bot_logs.append(bot_id, event.get("line", ""))
+            elif kind == "loaded":
+                load_future = self.loads.pop(bot_id, None)
+                if load_future is not None and not load_future.done():
+                    load_future.set_result(True)
+            elif kind == "started":
+                logger.info(f"Bot {bot_id} is polling on host {self.index}")
+            elif kind == "heartbeat":
+                self.last_heartbeat = time.monotonic()
+                self.stalled = set(event.get("stalled", ()))
+                self.idle = event.get("idle") or {}
+            elif kind == "exited":
+                self._resolve(bot_id, event.get("code", 1), event.get("error"))
+        
+        code = await self.process.wait()
+        if self.exits:
+            logger.error(f"Bot host {self.index} exited with code {code}, taking {len(self.exits)} bots down")
+        for bot_id in list(self.exits):
+            self._resolve(bot_id, code or 1, f"Bot host exited with code {code}")
+    
+    async def shutdown(self, timeout: float = 10):
+        """Stop every bot on the host and wait for it to exit"""
+        if not self.alive:
+            return
+        await self.send(op="shutdown")
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Killing bot host {self.index}")
+            self.kill()
+            await self.process.wait()
+        if self.reader is not None:
+            await self.reader
+    
+    def kill(self):
+        if self.alive:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+
 @dataclass
 class BotProcess:
     """Represents a running bot process"""
     name: str
     bot_id: str
     token: str
-    process: Optional[subprocess.Popen]
+    # An asyncio subprocess, or a zygote.ForkedProcess with the same interface
+    process: Optional[Any]
     created_at: datetime
     started_at: Optional[datetime] = None
     stopped_at: Optional[datetime] = None
-    status: str = "pending"  # pending, running, stopped, error
+    status: str = "pending"  # pending, running, stopped, hibernating, error
     error_message: Optional[str] = None
+    exit_code: Optional[int] = None
+    stop_requested: bool = False
+    watcher: Optional[asyncio.Task] = None
+    # Set when the bot runs inside a shared bot host instead of its own process
+    host: Optional[HostProcess] = None
+    # File a dedicated bot process touches while its event loop is alive
+    heartbeat_file: Optional[str] = None
+    # Why a liveness check killed the bot; its exit then counts as a failure
+    unhealthy: Optional[str] = None
+    # Executor agent running the bot, when it runs on another node
+    node: Optional[str] = None
+    # Being moved to another node; its exit is not reported
+    migrating: bool = False
+    # File a dedicated bot process touches whenever it gets an update
+    activity_file: Optional[str] = None
+    # Stopped for being idle, to be woken when an update arrives
+    hibernating: bool = False
+    # Gets its updates pushed from the webhook ingress instead of polling
+    webhook: bool = False
+    
+    @property
+    def pid(self) -> Optional[int]:
+        if self.host is not None:
+            return self.host.pid
+        return self.process.pid if self.process else None
+
+# Called once a bot process has exited, for whatever reason
+ExitListener = Callable[[BotProcess], Awaitable[None]]
 
 class BotExecutor:
-    """Manages bot process lifecycle"""
+    """
+    Manages bot lifecycle with non-blocking asyncio subprocesses
+    
+    In shared hosting mode bots are placed on the least loaded of a fixed
+    set of bot_host.py workers, one per CPU by default, each running many
+    bots on one event loop. Bots generated before templates had
+    build_application() still get a process of their own.
+    """
     
     def __init__(self):
         self.bots: Dict[str, BotProcess] = {}
         self.max_bots = config.MAX_CONCURRENT_BOTS
+        self.exit_listeners: List[ExitListener] = []
+        self.host_capacity = config.BOT_HOST_MAX_BOTS
+        self.hosts: List[Optional[HostProcess]] = (
+            [None] * max(1, config.BOT_HOST_WORKERS) if config.BOT_HOSTING == 'shared' else []
+        )
+        self._placement_lock: Optional[asyncio.Lock] = None
+        self.zygote: Optional[zygote.ZygoteClient] = None
+        if config.BOT_ZYGOTE_ENABLED and zygote.available():
+            self.zygote = zygote.ZygoteClient(
+                pool_size=config.BOT_ZYGOTE_POOL_SIZE,
+                preload=tuple(name.strip() for name in config.BOT_ZYGOTE_PRELOAD.split(',') if name.strip())
+            )
+        # Seconds from launch request until the bot's code is loaded
+        self._launch_times: Deque[float] = deque(maxlen=500)
+        # Launched bots and their processes, kept across generator restarts
+        self.state = BotStateStore(config.BOT_STATE_FILE)
+        # Set while cleanup() stops bots; they are recorded to be resumed on the next start
+        self.closing = False
+        # bot_id -> webhook endpoint ({"url", "secret_token"}) for hosted bots to register
+        # instead of polling; set when a webhook ingress routes their updates
+        self.webhook: Optional[Callable[[str], Optional[Dict[str, str]]]] = None
+        self.resources = ResourceMonitor(
+            self,
+            interval=config.BOT_MONITOR_INTERVAL,
+            window=config.BOT_MONITOR_WINDOW,
+            max_rss_mb=config.BOT_MAX_RSS_MB,
+            max_cpu_percent=config.BOT_MAX_CPU_PERCENT,
+            max_open_files=config.BOT_MAX_OPEN_FILES,
+            nice=config.BOT_NICE
+        )
+    
+    @property
+    def capacity(self) -> int:
+        """Bots this node can run at once: bot host slots plus dedicated processes"""
+        return len(self.hosts) * self.host_capacity + self.max_bots
+    
+    def local_bot_count(self) -> int:
+        """Running bots whose processes live on this node"""
+        return sum(1 for bot in self.bots.values() if bot.status == "running" and bot.node is None)
+    
+    async def start(self):
+        """Start resource sampling and warm up the zygote so the first launch doesn't pay for it"""
+        self.resources.start()
+        if self.zygote is None:
+            return
+        try:
+            await self.zygote.ensure_started()
+        except Exception as e:
+            logger.error(f"Zygote unavailable, launching bots cold: {e}")
+    
+    async def _spawn(self, argv: List[str], env: Dict[str, str], stdin_pipe: bool = False) -> Any:
+        """Start a Python program from the zygote, or as a fresh interpreter if that fails"""
+        if self.zygote is not None:
+            try:
+                return await self.zygote.spawn(argv, env, stdin_pipe)
+            except Exception as e:
+                logger.warning(f"Zygote launch failed, starting cold: {e}")
+        return await asyncio.create_subprocess_exec(
+            sys.executable, *argv,
+            env=env,
+            stdin=asyncio.subprocess.PIPE if stdin_pipe else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            limit=_HOST_LINE_LIMIT
+        )
     
-    def launch_bot(
+    async def launch_bot(
         self,
         bot_code_path: str,
         bot_name: str,
@@ -50,29 +403,33 @@ class BotExecutor:
             BotProcess instance
         """
         try:
-            # Check if we're at max capacity
-            running_count = sum(1 for b in self.bots.values() if b.status == "running")
-            if running_count >= self.max_bots:
-                raise Exception(f"Maximum concurrent bots ({self.max_bots}) reached")
-            
             # Check if code file exists
             if not os.path.exists(bot_code_path):
                 raise FileNotFoundError(f"Bot code file not found: {bot_code_path}")
             
+            requested_at = time.monotonic()
+            if self.hosts and supports_hosting(bot_code_path):
+                return await self._launch_hosted(bot_code_path, bot_name, bot_token, bot_id, requested_at)
+            
+            # Check if we're at max capacity
+            running_count = sum(1 for b in self.bots.values() if b.status == "running" and b.host is None)
+            if running_count >= self.max_bots:
+                raise Exception(f"Maximum concurrent bots ({self.max_bots}) reached")
+            
             # Prepare environment
             env = os.environ.copy()
             env['BOT_TOKEN'] = bot_token
             env['BOT_NAME'] = bot_name
             env['PYTHONUNBUFFERED'] = '1'
+            heartbeat_file = self._fresh_run_file(bot_id, 'heartbeat')
+            env['BOT_HEARTBEAT_FILE'] = heartbeat_file
+            env['BOT_HEARTBEAT_INTERVAL'] = str(config.BOT_HEARTBEAT_INTERVAL)
+            activity_file = self._fresh_run_file(bot_id, 'activity')
+            env['BOT_ACTIVITY_FILE'] = activity_file
             
             # Create process
-            process = subprocess.Popen(
-                ['python', bot_code_path],
-                env=env,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
+            process = await self._spawn([_entry_point(bot_code_path)], env)
+            self.resources.prepare(process.pid)
             
             bot_process = BotProcess(
                 name=bot_name,
@@ -81,10 +438,25 @@ class BotExecutor:
                 process=process,
                 created_at=datetime.now(),
                 started_at=datetime.now(),
-                status="running"
+                status="running",
+                heartbeat_file=heartbeat_file,
+                activity_file=activity_file
             )
             
             self.bots[bot_id] = bot_process
+            self.state.put(BotRecord(
+                bot_id=bot_id,
+                name=bot_name,
+                code_path=bot_code_path,
+                token=bot_token,
+                started_at=bot_process.started_at.isoformat(),
+                pid=process.pid,
+                pid_started=process_start_time(process.pid)
+            ))
+            # Templates log before they start polling, so the first output line
+            # marks loaded code; scheduled before the watcher so it subscribes first
+            asyncio.ensure_future(self._time_launch(requested_at, self._first_output(bot_id)))
+            bot_process.watcher = asyncio.ensure_future(self._watch(bot_process))
             logger.info(f"Launched bot: {bot_name} (PID: {process.pid})")
             
             return bot_process
@@ -103,13 +475,381 @@ class BotExecutor:
             self.bots[bot_id] = bot_process
             raise
     
-    def stop_bot(self, bot_id: str, force: bool = False) -> bool:
+    async def _place(self) -> HostProcess:
+        """Pick the least loaded host slot with room, starting its worker if needed"""
+        if self._placement_lock is None:
+            self._placement_lock = asyncio.Lock()
+        async with self._placement_lock:
+            best: Optional[Tuple[int, int]] = None
+            for index, host in enumerate(self.hosts):
+                load = host.load if host is not None and host.alive else 0
+                if load < self.host_capacity and (best is None or load < best[0]):
+                    best = (load, index)
+            if best is None:
+                raise Exception(
+                    f"All {len(self.hosts)} bot hosts are full ({self.host_capacity} bots each)"
+                )
+            
+            index = best[1]
+            host = self.hosts[index]
+            if host is None or not host.alive:
+                host = self.hosts[index] = HostProcess(index, self._spawn)
+                await host.start()
+                self.resources.prepare(host.pid, limit_files=False)
+                self.state.set_host(index, host.pid)
+            return host
+    
+    async def _launch_hosted(
+        self,
+        bot_code_path: str,
+        bot_name: str,
+        bot_token: str,
+        bot_id: str,
+        requested_at: float
+    ) -> BotProcess:
+        """Run a bot inside a shared bot host"""
+        host = await self._place()
+        bot_logs.open_file(bot_id)
+        webhook = self.webhook(bot_id) if self.webhook is not None else None
+        load_future, exit_future = await host.start_bot(
+            bot_id, _entry_point(bot_code_path), bot_token, bot_name, webhook
+        )
+        asyncio.ensure_future(self._time_launch(requested_at, load_future))
+        
+        bot_process = BotProcess(
+            name=bot_name,
+            bot_id=bot_id,
+            token=bot_token,
+            process=None,
+            created_at=datetime.now(),
+            started_at=datetime.now(),
+            status="running",
+            host=host,
+            webhook=webhook is not None
+        )
+        self.bots[bot_id] = bot_process
+        self.state.put(BotRecord(
+            bot_id=bot_id,
+            name=bot_name,
+            code_path=bot_code_path,
+            token=bot_token,
+            started_at=bot_process.started_at.isoformat(),
+            host=host.index
+        ))
+        bot_process.watcher = asyncio.ensure_future(self._watch_hosted(bot_process, exit_future))
+        logger.info(f"Launched bot: {bot_name} on host {host.index} (PID: {host.pid})")
+        return bot_process
+    
+    @staticmethod
+    async def _first_output(bot_id: str):
+        subscription = bot_logs.subscribe(bot_id)
+        try:
+            await subscription.__anext__()
+        finally:
+            await subscription.aclose()
+    
+    async def _time_launch(self, requested_at: float, loaded: Awaitable, timeout: float = 120):
+        """Record how long a bot took from launch request to loaded code"""
+        try:
+            await asyncio.wait_for(loaded, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # Never loaded (crashed or silent); nothing to measure
+            return
+        self._launch_times.append(time.monotonic() - requested_at)
+    
+    async def prepare_bot(self, bot_code_path: str) -> Optional[str]:
+        """
+        Precompile a saved bot and smoke-test its imports
+        
+        Returns:
+            None if the bot is ready to launch, else a description of the problem
+        """
+        try:
+            loop = asyncio.get_running_loop()
+            pyc_path = await loop.run_in_executor(None, precompile_bot, bot_code_path)
+        except py_compile.PyCompileError as e:
+            logger.warning(f"Bot failed to compile: {bot_code_path}: {e.exc_value}")
+            return f"Compile error: {e.exc_value}"
+        except Exception as e:
+            logger.error(f"Error precompiling bot {bot_code_path}: {e}")
+            return f"Compile error: {e}"
+        
+        try:
+            error = await check_bot_imports(pyc_path, config.BOT_IMPORT_CHECK_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Error running import check for {bot_code_path}: {e}")
+            return None
+        
+        if error:
+            logger.warning(f"Bot failed its import check: {bot_code_path}: {error}")
+        return error
+    
+    async def _watch(self, bot: BotProcess):
+        """Record the bot's exit as soon as the child watcher reports it"""
+        process = bot.process
+        if process.stdout is None:
+            # Reattached after a restart, or running on an executor agent
+            exit_code = await process.wait()
+            bot_logs.close_file(bot.bot_id)
+            await self._finish(bot, exit_code, getattr(process, 'error', None))
+            return
+        # Keep reading the bot's output so its pipe never fills up
+        drain = asyncio.ensure_future(bot_logs.pump(bot.bot_id, process.stdout))
+        exit_code = await process.wait()
+        try:
+            # Pick up the final output lines; a leftover grandchild may hold the pipe
+            await asyncio.wait_for(drain, 1)
+        except asyncio.TimeoutError:
+            pass
+        await self._finish(bot, exit_code)
+    
+    async def _watch_hosted(self, bot: BotProcess, exit_future: asyncio.Future):
+        """Record a hosted bot's exit once its host reports it"""
+        exit_code, error = await exit_future
+        bot_logs.close_file(bot.bot_id)
+        await self._finish(bot, exit_code, error)
+    
+    async def _finish(self, bot: BotProcess, exit_code: int, error: Optional[str] = None):
+        """Record how a bot ended and tell the exit listeners"""
+        bot.exit_code = exit_code
+        bot.stopped_at = datetime.now()
+        for path in (bot.heartbeat_file, bot.activity_file):
+            if path:
+                self._remove_run_file(path)
+        if bot.unhealthy:
+            bot.status = "error"
+            bot.error_message = f"Unhealthy: {bot.unhealthy}"
+            logger.warning(f"Bot {bot.bot_id} was killed as unhealthy: {bot.unhealthy}")
+        elif bot.hibernating:
+            bot.status = "hibernating"
+            logger.info(f"Bot hibernated: {bot.name} (ID: {bot.bot_id})")
+        elif bot.stop_requested or exit_code == 0:
+            bot.status = "stopped"
+            logger.info(f"Bot exited: {bot.name} (ID: {bot.bot_id}, code {exit_code})")
+        else:
+            bot.status = "error"
+            reason = error or next(iter(bot_logs.tail(bot.bot_id, 1)), "no output")
+            bot.error_message = f"Exited unexpectedly with code {exit_code}: {reason}"
+            logger.warning(f"Bot {bot.bot_id} exited unexpectedly with code {exit_code}")
+        
+        if bot.migrating:
+            # Relaunched elsewhere; nobody needs to hear about this exit
+            return
+        if bot.status == "hibernating":
+            self.state.hibernated(bot.bot_id)
+        elif bot.stop_requested and not bot.unhealthy and not self.closing:
+            self.state.forget(bot.bot_id)
+        else:
+            # Still wanted: the supervisor may restart it, or the next start resumes it
+            self.state.exited(bot.bot_id)
+        await self._notify_exit(bot)
+    
+    async def _notify_exit(self, bot: BotProcess):
+        for listener in self.exit_listeners:
+            try:
+                await listener(bot)
+            except Exception as e:
+                logger.error(f"Error in exit listener for bot {bot.bot_id}: {e}")
+    
+    @staticmethod
+    def _run_file(bot_id: str, kind: str) -> str:
+        return os.path.abspath(os.path.join(config.GENERATED_BOTS_DIR, 'run', f'bot_{bot_id}.{kind}'))
+    
+    @staticmethod
+    def _fresh_run_file(bot_id: str, kind: str) -> str:
+        """Fresh heartbeat or activity file location for a dedicated bot process"""
+        path = BotExecutor._run_file(bot_id, kind)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        BotExecutor._remove_run_file(path)
+        return path
+    
+    @staticmethod
+    def _remove_run_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove {path}: {e}")
+    
+    async def check_liveness(self, timeout: float) -> int:
+        """
+        Kill bots that stopped responding, so their exit is recorded as a failure
+        
+        A bot host that sent no heartbeat for ``timeout`` seconds has a blocked
+        event loop and is killed with all its bots. Hosted bots whose updater
+        stopped on its own, and bot processes whose heartbeat file went stale,
+        are killed individually. Bots from before heartbeats never create the
+        file and are only watched for exiting.
+        
+        Returns:
+            Number of bots killed
+        """
+        now = time.monotonic()
+        victims = []
+        for host in self.hosts:
+            if host is None or not host.alive:
+                continue
+            silent = now - host.last_heartbeat
+            if silent > timeout:
+                logger.error(f"Bot host {host.index} sent no heartbeat for {silent:.0f}s; killing it")
+                for bot in self.bots.values():
+                    if bot.host is host and bot.status == "running":
+                        bot.unhealthy = f"Bot host unresponsive for {silent:.0f}s"
+                host.kill()
+        
+        for bot in self.bots.values():
+            if bot.status != "running" or bot.unhealthy:
+                continue
+            if bot.host is not None:
+                if bot.bot_id in bot.host.stalled:
+                    bot.unhealthy = "Stopped polling for updates"
+                    victims.append(bot.bot_id)
+            elif bot.heartbeat_file:
+                try:
+                    age = time.time() - os.path.getmtime(bot.heartbeat_file)
+                except OSError:
+                    continue
+                if age > timeout:
+                    bot.unhealthy = f"No heartbeat for {age:.0f}s"
+                    victims.append(bot.bot_id)
+        
+        if victims:
+            await asyncio.gather(*(self.kill_bot(bot_id) for bot_id in victims), return_exceptions=True)
+        return len(victims)
+    
+    def idle_seconds(self, bot_id: str) -> Optional[float]:
+        """
+        Seconds since a running bot last got an update, or since it started
+    
+        Returns:
+            None if the bot doesn't report its activity, e.g. code generated
+            before activity tracking
+        """
+        bot = self.bots.get(bot_id)
+        if bot is None or bot.status != "running":
+            return None
+        if bot.host is not None:
+            return bot.host.idle_seconds(bot_id)
+        if bot.activity_file:
+            try:
+                return time.time() - os.path.getmtime(bot.activity_file)
+            except OSError:
+                return None
+        return None
+    
+    async def deliver_updates(self, bot_id: str, updates: List[Dict[str, Any]]) -> bool:
+        """
+        Hand webhook updates to a running bot
+        
+        Returns:
+            False if the bot isn't running in webhook mode, e.g. while hibernated
+        """
+        bot = self.bots.get(bot_id)
+        if bot is None or bot.status != "running" or not bot.webhook or bot.host is None or not bot.host.alive:
+            return False
+        await bot.host.send(op="updates", bot_id=bot_id, updates=updates)
+        return True
+    
+    async def hibernate_bot(self, bot_id: str) -> bool:
+        """Stop an idle bot, keeping it recorded as hibernating instead of stopped"""
+        bot = self.bots.get(bot_id)
+        if bot is None or bot.status != "running":
+            return False
+        bot.hibernating = True
+        stopped = await self.stop_bot(bot_id, force=True)
+        if not stopped:
+            bot.hibernating = False
+        return stopped
+    
+    def forget(self, bot_id: str):
+        """Stop resuming a bot on startup; for bots that ended for good"""
+        self.state.forget(bot_id)
+    
+    async def recover(self, host_timeout: float = 15) -> Tuple[List[BotRecord], List[BotRecord]]:
+        """
+        Reconcile the recorded bots with the processes still running
+        
+        Bot processes that outlived the previous generator are reattached.
+        Bot hosts exit once the generator feeding them is gone; any still
+        shutting down are given ``host_timeout`` seconds and then killed, so
+        their bots never poll twice. Every recorded bot without a live
+        process is returned for relaunching.
+        
+        Returns:
+            Records of the reattached bots, and of the bots to launch again
+        """
+        stale_hosts = [
+            AdoptedProcess(pid, started, poll_interval=0.2)
+            for pid, started in self.state.hosts.values() if process_alive(pid, started)
+        ]
+        if stale_hosts:
+            logger.info(f"Waiting for {len(stale_hosts)} bot hosts from the previous run to exit")
+            waits = [asyncio.ensure_future(host.wait()) for host in stale_hosts]
+            _, pending = await asyncio.wait(waits, timeout=host_timeout)
+            for host in stale_hosts:
+                try:
+                    host.kill()
+                    logger.warning(f"Killed bot host PID {host.pid} left by the previous run")
+                except ProcessLookupError:
+                    pass
+            if pending:
+                await asyncio.wait(pending)
+        self.state.hosts.clear()
+        
+        reattached, relaunch = [], []
+        for record in list(self.state.records.values()):
+            if record.bot_id in self.bots:
+                continue
+            if record.pid is not None and process_alive(record.pid, record.pid_started):
+                self._reattach(record)
+                reattached.append(record)
+            else:
+                record.pid = record.pid_started = record.host = None
+                relaunch.append(record)
+        self.state.save()
+        
+        if reattached or relaunch:
+            logger.info(f"Recovered bots: {len(reattached)} reattached, {len(relaunch)} to relaunch")
+        return reattached, relaunch
+    
+    def _reattach(self, record: BotRecord) -> BotProcess:
+        """Manage a bot process started by a previous generator"""
+        heartbeat_file = self._run_file(record.bot_id, 'heartbeat')
+        activity_file = self._run_file(record.bot_id, 'activity')
+        try:
+            started_at = datetime.fromisoformat(record.started_at)
+        except (TypeError, ValueError):
+            started_at = datetime.now()
+        bot_process = BotProcess(
+            name=record.name,
+            bot_id=record.bot_id,
+            token=record.token,
+            process=AdoptedProcess(record.pid, record.pid_started),
+            created_at=datetime.now(),
+            started_at=started_at,
+            status="running",
+            heartbeat_file=heartbeat_file if os.path.exists(heartbeat_file) else None,
+            activity_file=activity_file if os.path.exists(activity_file) else None
+        )
+        self.bots[record.bot_id] = bot_process
+        bot_logs.open_file(record.bot_id)
+        bot_logs.append(
+            record.bot_id,
+            f"--- reattached to PID {record.pid} after a generator restart; its output is no longer captured ---"
+        )
+        bot_process.watcher = asyncio.ensure_future(self._watch(bot_process))
+        logger.info(f"Reattached to bot: {record.name} (PID: {record.pid})")
+        return bot_process
+    
+    async def stop_bot(self, bot_id: str, force: bool = False, timeout: float = 5) -> bool:
         """
         Stop a running bot
         
         Args:
             bot_id: Bot identifier
-            force: Use SIGKILL instead of SIGTERM
+            force: Kill the bot if it ignores SIGTERM for ``timeout`` seconds
+            timeout: Seconds to wait for a graceful exit
         
         Returns:
             True if successful
@@ -121,7 +861,7 @@ class BotExecutor:
             
             bot = self.bots[bot_id]
             
-            if bot.process is None:
+            if bot.process is None and bot.host is None:
                 logger.warning(f"Bot process is None: {bot_id}")
                 return False
             
@@ -130,27 +870,45 @@ class BotExecutor:
                 return False
             
             # Try graceful shutdown
+            bot.stop_requested = True
             try:
-                bot.process.terminate()
-                bot.process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                if force:
-                    bot.process.kill()
-                    bot.process.wait()
+                if bot.host is not None:
+                    await bot.host.send(op="stop", bot_id=bot_id)
                 else:
+                    bot.process.terminate()
+                await asyncio.wait_for(asyncio.shield(bot.watcher), timeout)
+            except ProcessLookupError:
+                pass
+            except asyncio.TimeoutError:
+                if not force:
                     logger.warning(f"Bot {bot_id} did not terminate gracefully")
                     return False
+                return await self.kill_bot(bot_id)
             
-            bot.status = "stopped"
-            bot.stopped_at = datetime.now()
             logger.info(f"Stopped bot: {bot.name} (ID: {bot_id})")
-            
             return True
         
         except Exception as e:
             logger.error(f"Error stopping bot: {e}")
             return False
     
+    async def kill_bot(self, bot_id: str) -> bool:
+        """Kill a bot with SIGKILL and wait for it to be reaped"""
+        bot = self.bots.get(bot_id)
+        if bot is None or (bot.process is None and bot.host is None):
+            return False
+        bot.stop_requested = True
+        if bot.host is not None:
+            await bot.host.kill_bot(bot_id)
+        else:
+            try:
+                bot.process.kill()
+            except ProcessLookupError:
+                pass
+        await asyncio.shield(bot.watcher)
+        logger.info(f"Killed bot: {bot.name} (ID: {bot_id})")
+        return True
+    
     def get_bot_status(self, bot_id: str) -> Dict:
         """
         Get detailed status of a bot
@@ -163,15 +921,9 @@ class BotExecutor:
         
         bot = self.bots[bot_id]
         
-        # Check if process is still alive
-        if bot.process and bot.status == "running":
-            if bot.process.poll() is not None:
-                bot.status = "stopped"
-                bot.stopped_at = datetime.now()
-        
         uptime = None
         if bot.started_at:
-            uptime = (datetime.now() - bot.started_at).total_seconds()
+            uptime = ((bot.stopped_at or datetime.now()) - bot.started_at).total_seconds()
         
         return {
             "name": bot.name,
@@ -180,6 +932,11 @@ class BotExecutor:
             "created_at": bot.created_at.isoformat() if bot.created_at else None,
             "started_at": bot.started_at.isoformat() if bot.started_at else None,
             "uptime_seconds": uptime,
+            "pid": bot.pid,
+            "host": bot.host.index if bot.host else None,
+            "node": bot.node,
+            "resources": self.resources.usage(bot_id) if bot.status == "running" else None,
+            "exit_code": bot.exit_code,
             "error_message": bot.error_message
         }
     
@@ -201,21 +958,80 @@ class BotExecutor:
         """
         return [status for status in self.list_bots() if status.get("status") == "running"]
     
-    def cleanup(self):
+    def launch_metrics(self) -> Dict[str, Any]:
+        """Launch latency percentiles in milliseconds"""
+        times = sorted(self._launch_times)
+        
+        def percentile(fraction: float) -> Optional[float]:
+            if not times:
+                return None
+            return round(times[min(len(times) - 1, int(fraction * len(times)))] * 1000, 1)
+        
+        return {
+            "launches": len(times),
+            "zygote": self.zygote is not None and self.zygote.alive,
+            "p50_ms": percentile(0.5),
+            "p90_ms": percentile(0.9),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(times[-1] * 1000, 1) if times else None
+        }
+    
+    def host_stats(self) -> List[Dict]:
+        """Load of each started bot host"""
+        return [
+            {"index": host.index, "pid": host.pid, "alive": host.alive, "bots": host.load}
+            for host in self.hosts if host is not None
+        ]
+    
+    async def cleanup(self, timeout: float = 10):
         """
-        Cleanup: stop all running bots
+        Cleanup: stop all running bots in parallel within one deadline
+        
+        Bots still running when ``timeout`` expires are killed, then the
+        bot hosts are shut down. The stopped bots stay in the saved state
+        and are relaunched by the next recover().
         """
-        logger.info("Cleaning up all bots...")
-        for bot_id in list(self.bots.keys()):
-            try:
-                self.stop_bot(bot_id, force=False)
-            except Exception as e:
-                logger.error(f"Error cleaning up bot {bot_id}: {e}")
-                try:
-                    self.stop_bot(bot_id, force=True)
-                except Exception as e2:
-                    logger.error(f"Force cleanup failed for {bot_id}: {e2}")
+        self.closing = True
+        await self.resources.close()
+        running = [bot_id for bot_id, bot in self.bots.items() if bot.status == "running"]
+        if running:
+            await self._stop_all(running, timeout)
+        hosts = [host for host in self.hosts if host is not None]
+        if hosts:
+            await asyncio.gather(*(host.shutdown(timeout) for host in hosts), return_exceptions=True)
+            for host in hosts:
+                self.state.set_host(host.index, None)
+        if self.zygote is not None:
+            await self.zygote.close()
+    
+    async def _stop_all(self, running: List[str], timeout: float):
+        logger.info(f"Cleaning up {len(running)} bots...")
+        stops = [asyncio.ensure_future(self.stop_bot(bot_id, timeout=timeout)) for bot_id in running]
+        await asyncio.wait(stops, timeout=timeout)
+        
+        stragglers = [bot_id for bot_id in running if self.bots[bot_id].status == "running"]
+        for stop in stops:
+            stop.cancel()
+        if stragglers:
+            logger.warning(f"Killing {len(stragglers)} bots that ignored SIGTERM")
+            await asyncio.gather(*(self.kill_bot(bot_id) for bot_id in stragglers), return_exceptions=True)
     
     def __del__(self):
-        """Ensure cleanup on deletion"""
-        self.cleanup()
+        """Last-resort kill of bots that cleanup() never stopped"""
+        for bot in self.bots.values():
+            if bot.process is not None and bot.process.returncode is None:
+                try:
+                    bot.process.kill()
+                except Exception:
+                    pass
+        for host in self.hosts:
+            if host is not None:
+                try:
+                    host.kill()
+                except Exception:
+                    pass
+        if self.zygote is not None and self.zygote.alive:
+            try:
+                self.zygote.process.kill()
+            except Exception:
+                pass
@@ -1,27 +1,60 @@
+import asyncio
+import json
 import logging
+import os
 import re
-import ast
 from datetime import datetime
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Callable, Awaitable, Dict, Any, List, Set
 from onlysq_client import OnlySqClient
-from bot_templates import get_template
+from offline_generator import OfflineGenerator
+from code_analysis import CodeAnalyzer, CodeReport, analyze_custom_logic, derive_handlers, syntax_error
+from similarity_index import SimilarityIndex
+from bot_templates import get_compiled_template, render_handler_registrations, is_catch_all, HANDLER_TYPES
 from config import config
 from database import db
 
 logger = logging.getLogger(__name__)
 
+# Receives the partial LLM output; returning False aborts the generation
+ProgressCallback = Callable[[str], Awaitable[Optional[bool]]]
+
+# Receives (bot_code, bot_class_name, bot_name) from an LLM run that missed its budget
+UpgradeCallback = Callable[[Tuple[str, str, str]], Awaitable[None]]
+
+# Why the offline result was returned: the LLM missed its budget, or failed outright
+FALLBACK_TIMEOUT = "timeout"
+FALLBACK_FAILED = "failed"
+# Receives one of the reasons above when the offline result is returned
+FallbackCallback = Callable[[str], None]
+
+class GenerationCancelled(Exception):
+    """Raised when a streamed generation is aborted before completion"""
+
 class BotGenerator:
     """AI-powered bot code generator using OnlySq API"""
     
     def __init__(self):
         self.client = OnlySqClient()
+        self.offline = OfflineGenerator()
+        self.analyzer = CodeAnalyzer(workers=config.CODE_ANALYSIS_WORKERS)
+        self.similar = SimilarityIndex(config.SIMILARITY_INDEX_FILE or None)
+        # bot_id -> owning user_id for indexed bots, so lookups skip other users' bots
+        # without reading the database
+        self._owners: Dict[str, int] = {}
+        self._background: Set[asyncio.Task] = set()
     
     async def generate_bot(
         self,
         description: str,
         bot_name: Optional[str] = None,
         user_id: Optional[int] = None,
-        enhanced: bool = True
+        enhanced: bool = True,
+        on_progress: Optional[ProgressCallback] = None,
+        structured: bool = True,
+        budget: Optional[float] = None,
+        on_upgrade: Optional[UpgradeCallback] = None,
+        use_cache: bool = True,
+        on_fallback: Optional[FallbackCallback] = None
     ) -> Tuple[str, str, str]:
         """
         Generate bot code from description
@@ -31,38 +64,119 @@ class BotGenerator:
             bot_name: Optional custom bot name
             user_id: User ID for database tracking
             enhanced: Use enhanced template
+            on_progress: Optional callback that streams partial custom logic;
+                returning False cancels the generation
+            structured: Fetch name, methods and handler registrations in one
+                JSON completion, falling back to two concurrent calls
+            budget: Seconds to wait for the LLM before returning the instant
+                offline result (defaults to BOT_GENERATION_TIMEOUT)
+            on_upgrade: Called with the LLM result if it arrives after the
+                offline result was returned; without it the LLM call is cancelled
+            use_cache: Set to False to bypass cached completions (regenerations)
+            on_fallback: Called with FALLBACK_TIMEOUT or FALLBACK_FAILED when
+                the offline result is returned; only a timeout with on_upgrade
+                set leaves an upgrade pending
         
         Returns:
             Tuple of (bot_code, bot_class_name, bot_name)
         """
+        budget = config.BOT_GENERATION_TIMEOUT if budget is None else budget
+        llm_task = asyncio.ensure_future(self._generate_with_llm(
+            description, bot_name, enhanced, on_progress, structured, use_cache
+        ))
+        
         try:
-            # Generate bot class name from description
-            if not bot_name:
-                bot_name = await self._generate_bot_name(description)
-            
-            bot_class_name = self._sanitize_class_name(bot_name)
+            return await asyncio.wait_for(asyncio.shield(llm_task), timeout=budget)
+        
+        except asyncio.TimeoutError:
+            logger.warning(f"LLM generation missed its {budget}s budget, using offline result")
+            if on_upgrade is None:
+                llm_task.cancel()
+            else:
+                self._track(self._deliver_upgrade(llm_task, on_upgrade))
+            if on_fallback is not None:
+                on_fallback(FALLBACK_TIMEOUT)
+            return self.generate_offline(description, bot_name, enhanced)
+        
+        except GenerationCancelled:
+            raise
+        except asyncio.CancelledError:
+            llm_task.cancel()
+            raise
+        except Exception as e:
+            logger.warning(f"LLM generation failed ({e}), using offline result")
+            if on_fallback is not None:
+                on_fallback(FALLBACK_FAILED)
+            return self.generate_offline(description, bot_name, enhanced)
+    
+    def generate_offline(
+        self,
+        description: str,
+        bot_name: Optional[str] = None,
+        enhanced: bool = True
+    ) -> Tuple[str, str, str]:
+        """
+        Generate a bot from built-in recipes without calling the LLM
+        
+        Returns:
+            Tuple of (bot_code, bot_class_name, bot_name)
+        """
+        result = self.offline.generate(description, bot_name)
+        # Recipes are small and trusted, analyze them inline
+        return self._assemble(
+            description, result["name"], analyze_custom_logic(result["methods"]),
+            result["handlers"], enhanced
+        )
+    
+    async def _generate_with_llm(
+        self,
+        description: str,
+        bot_name: Optional[str],
+        enhanced: bool,
+        on_progress: Optional[ProgressCallback],
+        structured: bool,
+        use_cache: bool = True
+    ) -> Tuple[str, str, str]:
+        """Generate bot code from LLM output"""
+        try:
+            result = None
+            if structured:
+                result = await self._generate_structured(
+                    description, on_progress=on_progress, use_cache=use_cache
+                )
             
-            # Generate custom bot code/logic
-            custom_code = await self._generate_custom_logic(description, bot_class_name)
+            if result is not None:
+                bot_name = bot_name or result["name"]
+                custom_code = result["methods"]
+                handlers = result["handlers"]
+            else:
+                # Name and logic don't depend on each other, fetch them together
+                custom_task = self._generate_custom_logic(
+                    description, on_progress=on_progress, use_cache=use_cache
+                )
+                if bot_name:
+                    custom_code = await custom_task
+                else:
+                    bot_name, custom_code = await asyncio.gather(
+                        self._generate_bot_name(description, use_cache=use_cache), custom_task
+                    )
+                handlers = []
             
-            # Get template
-            template = get_template(enhanced=enhanced)
+            # Parse the LLM output once, off the event loop
+            analysis = None
+            if custom_code and len(custom_code) > 20:
+                analysis = await self.analyzer.run(analyze_custom_logic, custom_code)
+                if analysis.error:
+                    raise ValueError(f"Generated code is unusable: {analysis.error}")
+                for problem in analysis.discarded:
+                    logger.warning(f"Dropped part of generated code: {problem}")
             
-            # Format template with bot info
-            bot_code = template.format(
-                bot_class_name=bot_class_name,
-                bot_name=bot_name,
-                bot_token="YOUR_BOT_TOKEN_HERE",
-                creation_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                bot_description=description[:100]
+            bot_code, bot_class_name, bot_name = self._assemble(
+                description, bot_name, analysis, handlers, enhanced
             )
             
-            # Merge custom logic if generated
-            if custom_code and len(custom_code) > 20:
-                bot_code = self._merge_custom_logic(bot_code, custom_code, bot_class_name)
-            
             # Validate generated code
-            await self._validate_code(bot_code)
+            await self._validate_code(bot_code, analysis)
             
             logger.info(f"Successfully generated bot: {bot_name}")
             return bot_code, bot_class_name, bot_name
@@ -71,105 +185,308 @@ class BotGenerator:
             logger.error(f"Error generating bot: {e}")
             raise
     
-    async def _generate_bot_name(self, description: str) -> str:
-        """Generate bot name from description using AI"""
-        try:
-            prompt = f"""Based on this bot description, generate a short, catchy bot name (2-3 words max).
-            Description: {description}
-            
-            Return ONLY the bot name, nothing else.
-            Example: WeatherBot, MusicHelper, CodeReviewer"""
+    def _assemble(
+        self,
+        description: str,
+        bot_name: str,
+        analysis: Optional[CodeReport],
+        handlers: List[Dict[str, str]],
+        enhanced: bool
+    ) -> Tuple[str, str, str]:
+        """Render the template with analyzed custom logic in its slots"""
+        bot_class_name = self._sanitize_class_name(bot_name)
+        
+        # Get template
+        template = get_compiled_template("enhanced" if enhanced else "base")
+        
+        # Custom logic and its handler registrations fill the template's slots
+        custom_module_code = custom_methods = custom_handlers = custom_fallback_handlers = ""
+        if analysis is not None and analysis.class_body:
+            defined = {method.name for method in analysis.methods}
+            handlers = [handler for handler in handlers or [] if handler.get("method") in defined]
+            # Register every remaining handler method, otherwise it is dead code
+            registered = template.handler_methods | {handler["method"] for handler in handlers}
+            derived = derive_handlers(analysis.methods, registered)
+            if derived:
+                logger.info(f"Derived handler registrations: {[h['method'] for h in derived]}")
+            handlers += derived
             
-            response = await self.client.generate_text(
-                prompt=prompt,
-                temperature=0.7,
-                max_tokens=50
+            custom_module_code = analysis.module_code
+            custom_methods = analysis.class_body
+            # Catch-all handlers go after the template's specific ones so they don't shadow them
+            custom_handlers = render_handler_registrations(
+                [handler for handler in handlers if not is_catch_all(handler)]
+            )
+            custom_fallback_handlers = render_handler_registrations(
+                [handler for handler in handlers if is_catch_all(handler)]
             )
-            
-            name = response.strip().split('\n')[0][:30]
-            return name or "GeneratedBot"
         
-        except Exception as e:
-            logger.warning(f"Failed to generate bot name: {e}")
-            return "GeneratedBot"
+        bot_code = template.render(
+            bot_class_name=bot_class_name,
+            bot_name=bot_name,
+            bot_token="YOUR_BOT_TOKEN_HERE",
+            creation_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            bot_description=description[:100],
+            custom_module_code=custom_module_code,
+            custom_methods=custom_methods,
+            custom_handlers=custom_handlers,
+            custom_fallback_handlers=custom_fallback_handlers
+        )
+        
+        return bot_code, bot_class_name, bot_name
     
-    async def _generate_custom_logic(self, description: str, class_name: str) -> str:
-        """Generate custom bot logic from description"""
+    async def _deliver_upgrade(self, llm_task: asyncio.Future, on_upgrade: UpgradeCallback):
+        """Hand a late LLM result to the caller once it arrives"""
         try:
-            system_prompt = """You are an expert Python developer specializing in Telegram bots.
-            Generate ONLY Python code for custom async methods that can be added to a Telegram bot class.
-            Use python-telegram-bot library patterns.
-            Return only the method definitions, no explanations.
-            Methods should be async and use the pattern: async def method_name(self, update: Update, context: ContextTypes.DEFAULT_TYPE)
-            """
-            
-            prompt = f"""Generate 1-2 custom handler methods for a Telegram bot with this description:
-            {description}
-            
-            Requirements:
-            - Use async/await patterns
-            - Include proper error handling
-            - Add logging statements
-            - Return exactly what would go in the class (method definitions only)
-            - Use realistic Telegram API calls
-            
-            Example format:
-            async def handle_weather(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-                # Implementation here
-                pass
-            """
-            
+            result = await llm_task
+        except (Exception, asyncio.CancelledError) as e:
+            logger.info(f"Late LLM generation did not produce an upgrade: {e!r}")
+            return
+        
+        try:
+            await on_upgrade(result)
+        except Exception as e:
+            logger.error(f"Error delivering generation upgrade: {e}")
+    
+    def _track(self, coro):
+        """Run a background coroutine, keeping a reference until it finishes"""
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+    
+    async def _generate_bot_name(self, description: str, use_cache: bool = True) -> str:
+        """Generate bot name from description using AI; upstream errors propagate"""
+        prompt = f"""Based on this bot description, generate a short, catchy bot name (2-3 words max).
+        Description: {description}
+        
+        Return ONLY the bot name, nothing else.
+        Example: WeatherBot, MusicHelper, CodeReviewer"""
+        
+        # Latency-sensitive and cheap, so race a backup model if slow
+        response = await self.client.generate_text(
+            prompt=prompt,
+            temperature=0.7,
+            max_tokens=50,
+            hedge=True,
+            use_cache=use_cache,
+            fallback=False
+        )
+        
+        name = response.strip().split('\n')[0][:30]
+        return name or "GeneratedBot"
+    
+    async def _generate_structured(
+        self,
+        description: str,
+        on_progress: Optional[ProgressCallback] = None,
+        use_cache: bool = True
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Generate name, handler methods and registrations in one completion
+        
+        Returns None when the response can't be parsed, so the caller can
+        fall back to separate calls. Upstream errors propagate: retrying
+        with two more calls to the same API wouldn't help.
+        """
+        system_prompt = """You are an expert Python developer specializing in Telegram bots.
+        You answer with a single JSON object and nothing else - no markdown, no explanations.
+        Methods use python-telegram-bot patterns and the signature:
+        async def method_name(self, update: Update, context: ContextTypes.DEFAULT_TYPE)
+        """
+        
+        prompt = f"""Design a Telegram bot with this description:
+        {description}
+        
+        Return a JSON object with exactly these keys:
+        - "name": short, catchy bot name (2-3 words max), e.g. "WeatherBot"
+        - "methods": Python source of 1-2 async handler methods (method definitions only,
+          with error handling and logging)
+        - "handlers": list of registrations for those methods, each one of
+          {{"type": "command", "command": "<name without slash>", "method": "<method name>"}}
+          {{"type": "callback", "pattern": "<regex or empty>", "method": "<method name>"}}
+          {{"type": "message", "filter": "text|photo|document|voice|location|sticker", "method": "<method name>"}}
+        """
+        
+        if on_progress is not None:
+            response = await self._stream_with_progress(
+                prompt, system_prompt, on_progress,
+                temperature=0.6, max_tokens=1500, use_cache=use_cache
+            )
+        else:
             response = await self.client.generate_text(
                 prompt=prompt,
                 system_prompt=system_prompt,
                 temperature=0.6,
-                max_tokens=1000
+                max_tokens=1500,
+                use_cache=use_cache,
+                fallback=False
             )
-            
-            return response.strip()
         
-        except Exception as e:
-            logger.warning(f"Failed to generate custom logic: {e}")
-            return ""
+        result = self._parse_structured_response(response)
+        if result is None:
+            logger.warning("Structured generation returned malformed output, falling back")
+        return result
+    
+    @staticmethod
+    def _parse_structured_response(text: str) -> Optional[Dict[str, Any]]:
+        """
+        Extract and validate the JSON object from a structured completion
+        
+        Tolerates markdown fences and prose around the object. Handler
+        entries that don't reference a generated method are dropped.
+        """
+        if not text:
+            return None
+        
+        decoder = json.JSONDecoder()
+        data = None
+        start = text.find('{')
+        while start != -1:
+            try:
+                candidate, _ = decoder.raw_decode(text, start)
+                if isinstance(candidate, dict) and "methods" in candidate:
+                    data = candidate
+                    break
+            except ValueError:
+                pass
+            start = text.find('{', start + 1)
+        
+        if data is None:
+            return None
+        
+        name = data.get("name")
+        methods = data.get("methods")
+        if isinstance(methods, list):
+            methods = "\n\n".join(m for m in methods if isinstance(m, str))
+        if not isinstance(name, str) or not name.strip():
+            return None
+        if not isinstance(methods, str) or "def " not in methods:
+            return None
+        
+        methods = methods.strip()
+        defined = set(re.findall(r'def\s+([A-Za-z_][A-Za-z0-9_]*)\s*\(', methods))
+        handlers: List[Dict[str, str]] = []
+        for entry in data.get("handlers") or []:
+            if not isinstance(entry, dict):
+                continue
+            if entry.get("type") not in HANDLER_TYPES or entry.get("method") not in defined:
+                continue
+            handlers.append({k: str(v) for k, v in entry.items() if v is not None})
+        
+        return {
+            "name": name.strip().split('\n')[0][:30],
+            "methods": methods,
+            "handlers": handlers
+        }
     
-    def _merge_custom_logic(self, template_code: str, custom_logic: str, class_name: str) -> str:
-        """Merge custom logic into bot template"""
+    async def _generate_custom_logic(
+        self,
+        description: str,
+        class_name: Optional[str] = None,
+        on_progress: Optional[ProgressCallback] = None,
+        use_cache: bool = True
+    ) -> str:
+        """Generate custom bot logic from description; upstream errors propagate"""
+        system_prompt = """You are an expert Python developer specializing in Telegram bots.
+        Generate ONLY Python code for custom async methods that can be added to a Telegram bot class.
+        Use python-telegram-bot library patterns.
+        Return only the method definitions, no explanations.
+        Methods should be async and use the pattern: async def method_name(self, update: Update, context: ContextTypes.DEFAULT_TYPE)
+        """
+        
+        prompt = f"""Generate 1-2 custom handler methods for a Telegram bot with this description:
+        {description}
+        
+        Requirements:
+        - Use async/await patterns
+        - Include proper error handling
+        - Add logging statements
+        - Return exactly what would go in the class (method definitions only)
+        - Use realistic Telegram API calls
+        - Name command handlers <command>_command and inline button handlers <name>_callback
+        
+        Example format:
+        async def handle_weather(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+            # Implementation here
+            pass
+        """
+        
+        if on_progress is not None:
+            return await self._stream_with_progress(
+                prompt, system_prompt, on_progress, use_cache=use_cache
+            )
+        
+        response = await self.client.generate_text(
+            prompt=prompt,
+            system_prompt=system_prompt,
+            temperature=0.6,
+            max_tokens=1000,
+            use_cache=use_cache,
+            fallback=False
+        )
+        
+        return response.strip()
+    
+    async def _stream_with_progress(
+        self,
+        prompt: str,
+        system_prompt: str,
+        on_progress: ProgressCallback,
+        temperature: float = 0.6,
+        max_tokens: int = 1000,
+        use_cache: bool = True
+    ) -> str:
+        """Stream a completion, reporting partial output as it arrives"""
+        chunks = []
+        length = 0
+        stream = self.client.stream_text(
+            prompt=prompt,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            use_cache=use_cache,
+            fallback=False
+        )
+        
         try:
-            # Find the insertion point (after __init__)
-            insert_point = template_code.find("    def run(self):")
-            
-            if insert_point > 0:
-                # Insert custom methods before run()
-                merged = template_code[:insert_point] + custom_logic + "\n\n    " + template_code[insert_point:]
-                return merged
-            
-            return template_code
+            async for delta in stream:
+                chunks.append(delta)
+                length += len(delta)
+                
+                # Runaway output can never pass validation, stop paying for it
+                if length > config.MAX_BOT_CODE_LENGTH:
+                    raise ValueError("Generated code exceeds maximum length")
+                
+                if await on_progress(''.join(chunks)) is False:
+                    raise GenerationCancelled("Generation cancelled by user")
+        finally:
+            await stream.aclose()
         
-        except Exception as e:
-            logger.warning(f"Failed to merge custom logic: {e}")
-            return template_code
+        return ''.join(chunks).strip()
     
-    async def _validate_code(self, code: str) -> bool:
+    async def _validate_code(self, code: str, analysis: Optional[CodeReport] = None) -> bool:
         """Validate generated Python code"""
         try:
-            # Try to parse the code as valid Python
-            ast.parse(code)
-            
             # Check code length
             if len(code) > config.MAX_BOT_CODE_LENGTH:
                 raise ValueError("Generated code exceeds maximum length")
             
-            # Check for dangerous imports
-            dangerous_imports = ['os.system', 'exec', 'eval', '__import__']
-            for dangerous in dangerous_imports:
-                if dangerous in code:
-                    logger.warning(f"Potential security issue: {dangerous} found in generated code")
+            # Try to parse the code as valid Python
+            error = await self.analyzer.run(syntax_error, code)
+            if error:
+                logger.error(f"Syntax error in generated code: {error}")
+                raise ValueError(f"Generated code has syntax errors: {error}")
+            
+            # Security findings come from the analyzer's resolved imports and calls
+            for finding in analysis.findings if analysis else []:
+                logger.warning(
+                    f"Potential security issue ({finding.severity}): {finding.message} "
+                    f"at line {finding.line} of generated logic"
+                )
             
             return True
         
-        except SyntaxError as e:
-            logger.error(f"Syntax error in generated code: {e}")
-            raise ValueError(f"Generated code has syntax errors: {e}")
         except Exception as e:
             logger.error(f"Code validation error: {e}")
             raise
@@ -188,6 +505,74 @@ class BotGenerator:
         # Convert to proper class name format
         return ''.join(word.capitalize() for word in name.split('_'))
     
-    def close(self):
-        """Close the client"""
-        self.client.close()
+    def index_existing_bots(self):
+        """Bring the similarity index in line with the bots database"""
+        if not config.SIMILARITY_ENABLED:
+            return
+        try:
+            bots = {bot_id: bot for bot_id, bot in db.get_all_bots().items() if self._is_reusable(bot)}
+            self.similar.sync((bot_id, bot["description"]) for bot_id, bot in bots.items())
+            self._owners = {bot_id: bot.get("user_id") for bot_id, bot in bots.items()}
+        except Exception as e:
+            logger.error(f"Error indexing existing bots: {e}")
+    
+    def remember_bot(self, bot_id: str, description: str, user_id: int):
+        """Add a freshly generated bot to the similarity index"""
+        if config.SIMILARITY_ENABLED:
+            self.similar.add(bot_id, description)
+            self._owners[bot_id] = user_id
+    
+    def find_similar_bots(self, description: str, user_id: int, limit: int = 3) -> List[Dict[str, Any]]:
+        """
+        Find the user's stored bots whose description is a near-duplicate of this one
+        
+        Other users' bots are never offered: their names, descriptions and
+        code are theirs.
+        
+        Returns:
+            Bot records with a "similarity" score, best match first
+        """
+        if not config.SIMILARITY_ENABLED:
+            return []
+        
+        # Only the user's own near-duplicates are looked up in the database
+        records: Dict[str, Dict[str, Any]] = {}
+        deleted: List[str] = []
+        
+        def usable(bot_id: str) -> bool:
+            if self._owners.get(bot_id) != user_id:
+                return False
+            bot = db.get_bot(bot_id)
+            if bot is None:
+                deleted.append(bot_id)
+                return False
+            # Failing bots stay indexed; they may be reusable again later
+            if not self._is_reusable(bot) or not os.path.exists(bot["code_file"]):
+                return False
+            records[bot_id] = bot
+            return True
+        
+        hits = self.similar.query(
+            description, threshold=config.SIMILARITY_THRESHOLD, limit=limit, accept=usable
+        )
+        for bot_id in deleted:
+            # Deleted since it was indexed
+            self.similar.remove(bot_id)
+            self._owners.pop(bot_id, None)
+        return [{**records[bot_id], "bot_id": bot_id, "similarity": similarity} for bot_id, similarity in hits]
+    
+    @staticmethod
+    def _is_reusable(bot: Dict[str, Any]) -> bool:
+        """Only LLM-generated code that saved successfully is worth reusing"""
+        return (
+            bool(bot.get("description")) and bool(bot.get("code_file"))
+            and bot.get("status") != "error" and not bot.get("import_error")
+            and (not bot.get("offline") or bot.get("upgraded", False))
+        )
+    
+    async def close(self):
+        """Cancel pending upgrades and close the client"""
+        for task in list(self._background):
+            task.cancel()
+        self.analyzer.close()
+        await self.client.close()
@@ -0,0 +1,311 @@
+"""
+Worker process that runs many generated bots on one event loop
+
+The parent talks to a host over JSON lines: commands arrive on stdin and
+events (bot output, loads, starts and exits) leave on stdout. Each bot
+runs in its own task with a context variable naming it, so its printed
+output and log records are tagged with its id and the tasks it spawns
+can be cancelled together when it stops.
+
+Usage: python bot_host.py [cpu]
+"""
+
+import asyncio
+import contextvars
+import importlib.machinery
+import importlib.util
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+# Bot whose code is running in the current task
+current_bot: contextvars.ContextVar = contextvars.ContextVar("current_bot", default=None)
+
+# Seconds a bot gets to shut its Application down before its tasks are cancelled
+STOP_TIMEOUT = 10
+# Seconds between heartbeat events; a silent host is presumed hung
+HEARTBEAT_INTERVAL = float(os.getenv("BOT_HEARTBEAT_INTERVAL", 10))
+# Handler group of the activity tracker, ahead of any group a bot uses
+ACTIVITY_GROUP = -1000
+
+logger = logging.getLogger("bot_host")
+
+class EventWriter:
+    """Serializes protocol events onto the real stdout"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._lock = threading.Lock()
+
+    def send(self, event: str, **fields: Any):
+        fields["event"] = event
+        data = json.dumps(fields, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._stream.write(data)
+            self._stream.flush()
+
+class TaggedOutput:
+    """Stand-in for sys.stdout/sys.stderr that turns writes into per-bot log events"""
+
+    def __init__(self, events: EventWriter):
+        self._events = events
+        self._pending: Dict[Optional[str], str] = {}
+
+    def write(self, text: str) -> int:
+        bot_id = current_bot.get()
+        pending = self._pending.get(bot_id, "") + text
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            self._events.send("log", bot_id=bot_id, line=line.rstrip("\r"))
+        if pending:
+            self._pending[bot_id] = pending
+        else:
+            self._pending.pop(bot_id, None)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self) -> bool:
+        return False
+
+class HostedBot:
+    """One generated bot running inside the host"""
+
+    def __init__(self, bot_id: str, name: str):
+        self.bot_id = bot_id
+        self.name = name
+        self.stop_event = asyncio.Event()
+        self.tasks: Set[asyncio.Task] = set()
+        self.runner: Optional[asyncio.Task] = None
+        self.application = None
+        self.started = False
+        # Monotonic time of the last update, or of the start
+        self.last_update = time.monotonic()
+        # Endpoint registered with setWebhook instead of polling, when the parent runs an ingress
+        self.webhook: Optional[Dict[str, str]] = None
+        # Webhook updates that arrived before the Application was started
+        self.backlog: List[Dict[str, Any]] = []
+
+    @property
+    def stalled(self) -> bool:
+        """Started polling once, but its updater has since stopped on its own"""
+        updater = self.application.updater if self.application is not None else None
+        return (
+            self.started and self.webhook is None and not self.stop_event.is_set()
+            and updater is not None and not updater.running
+        )
+
+    async def deliver(self, updates: List[Dict[str, Any]]):
+        """Queue webhook updates for the bot's Application, in order"""
+        if not self.started:
+            self.backlog.extend(updates)
+            return
+        from telegram import Update
+        for data in updates:
+            await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+
+def load_bot_class(module_name: str, path: str) -> type:
+    """Import a generated bot file and return its bot class"""
+    if path.endswith(".pyc"):
+        loader = importlib.machinery.SourcelessFileLoader(module_name, path)
+    else:
+        loader = importlib.machinery.SourceFileLoader(module_name, path)
+    spec = importlib.util.spec_from_loader(module_name, loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        loader.exec_module(module)
+    except BaseException:
+        sys.modules.pop(module_name, None)
+        raise
+    for value in vars(module).values():
+        if isinstance(value, type) and value.__module__ == module_name and hasattr(value, "build_application"):
+            return value
+    sys.modules.pop(module_name, None)
+    raise RuntimeError("no bot class with a build_application() method")
+
+class BotHost:
+    """Runs bots on request and reports on them"""
+
+    def __init__(self, events: EventWriter):
+        self.events = events
+        self.bots: Dict[str, HostedBot] = {}
+        self._closing = asyncio.Event()
+
+    def task_factory(self, loop, coro, **kwargs):
+        """Create tasks as usual, remembering which bot each one belongs to"""
+        task = asyncio.Task(coro, loop=loop, **kwargs)
+        bot = self.bots.get(current_bot.get())
+        if bot is not None:
+            bot.tasks.add(task)
+            task.add_done_callback(bot.tasks.discard)
+        return task
+
+    async def handle(self, command: Dict[str, Any]):
+        op = command.get("op")
+        bot_id = command.get("bot_id")
+        if op == "start":
+            if bot_id in self.bots:
+                self.events.send("exited", bot_id=bot_id, code=1, error="Bot is already running on this host")
+                return
+            bot = self.bots[bot_id] = HostedBot(bot_id, command.get("name", bot_id))
+            bot.webhook = command.get("webhook")
+            bot.runner = asyncio.ensure_future(self._run(bot, command["path"], command["token"]))
+        elif op == "stop":
+            bot = self.bots.get(bot_id)
+            if bot is not None:
+                bot.stop_event.set()
+        elif op == "updates":
+            bot = self.bots.get(bot_id)
+            if bot is not None:
+                await bot.deliver(command.get("updates") or [])
+        elif op == "kill":
+            bot = self.bots.get(bot_id)
+            if bot is not None and bot.runner is not None:
+                bot.runner.cancel()
+        elif op == "shutdown":
+            self._closing.set()
+        else:
+            logger.warning(f"Unknown host command: {op}")
+
+    async def _run(self, bot: HostedBot, path: str, token: str):
+        """Start a bot's Application, keep it polling until stopped, then shut it down"""
+        current_bot.set(bot.bot_id)
+        module_name = f"generated_bot_{bot.bot_id}"
+        application = None
+        code, error = 0, None
+        try:
+            bot_class = load_bot_class(module_name, path)
+            application = bot.application = bot_class(token).build_application()
+            self._track_updates(bot, application)
+            self.events.send("loaded", bot_id=bot.bot_id)
+            await application.initialize()
+            await application.start()
+            if bot.webhook is not None:
+                # Telegram keeps updates queued across the switch from polling
+                await application.bot.set_webhook(url=bot.webhook["url"], secret_token=bot.webhook["secret_token"])
+            else:
+                await application.updater.start_polling()
+            bot.started = True
+            bot.last_update = time.monotonic()
+            backlog, bot.backlog = bot.backlog, []
+            await bot.deliver(backlog)
+            self.events.send("started", bot_id=bot.bot_id)
+            logger.info(f"Bot {bot.name} started")
+            await bot.stop_event.wait()
+        except asyncio.CancelledError:
+            code, error = -9, "Killed"
+        except BaseException as e:
+            # SystemExit from a bot ends that bot, not the host
+            code, error = 1, f"{type(e).__name__}: {e}"
+            logger.error(f"Bot {bot.name} failed: {error}")
+
+        if application is not None and code != -9:
+            try:
+                await asyncio.wait_for(self._shutdown(application), STOP_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Bot {bot.name} did not shut down cleanly: {e}")
+
+        for task in list(bot.tasks):
+            task.cancel()
+        if bot.tasks:
+            await asyncio.gather(*bot.tasks, return_exceptions=True)
+        sys.modules.pop(module_name, None)
+        self.bots.pop(bot.bot_id, None)
+        self.events.send("exited", bot_id=bot.bot_id, code=code, error=error)
+
+    @staticmethod
+    def _track_updates(bot: HostedBot, application):
+        """Note when each update arrives, so the parent can hibernate idle bots"""
+        from telegram.ext import TypeHandler
+
+        async def touch(update, context):
+            bot.last_update = time.monotonic()
+
+        application.add_handler(TypeHandler(object, touch), group=ACTIVITY_GROUP)
+
+    @staticmethod
+    async def _shutdown(application):
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+
+    async def heartbeat(self):
+        """Prove the event loop is responsive and report bots that stopped polling or sit idle"""
+        while True:
+            now = time.monotonic()
+            self.events.send(
+                "heartbeat",
+                stalled=[bot.bot_id for bot in self.bots.values() if bot.stalled],
+                idle={bot.bot_id: round(now - bot.last_update, 1) for bot in self.bots.values() if bot.started}
+            )
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        loop.set_task_factory(self.task_factory)
+        heartbeat = asyncio.ensure_future(self.heartbeat())
+        commands: asyncio.Queue = asyncio.Queue()
+
+        def read_commands():
+            # A thread keeps stdin reading portable across event loop types
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(commands.put_nowait, line)
+            loop.call_soon_threadsafe(commands.put_nowait, None)
+
+        threading.Thread(target=read_commands, name="host-commands", daemon=True).start()
+        self.events.send("ready", pid=os.getpid())
+
+        while not self._closing.is_set():
+            line = await commands.get()
+            if line is None:
+                # The parent went away
+                break
+            try:
+                await self.handle(json.loads(line))
+            except Exception as e:
+                logger.error(f"Bad host command {line.strip()[:200]!r}: {e}")
+
+        for bot in self.bots.values():
+            bot.stop_event.set()
+        runners = [bot.runner for bot in self.bots.values() if bot.runner is not None]
+        if runners:
+            await asyncio.gather(*runners, return_exceptions=True)
+        heartbeat.cancel()
+
+def main():
+    events = EventWriter(sys.stdout)
+    sys.stdout = sys.stderr = TaggedOutput(events)
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO,
+        stream=sys.stderr,
+        force=True
+    )
+
+    if len(sys.argv) > 1 and hasattr(os, "sched_setaffinity"):
+        # Shard hosts across cores instead of letting them all migrate
+        try:
+            cpus = sorted(os.sched_getaffinity(0))
+            os.sched_setaffinity(0, {cpus[int(sys.argv[1]) % len(cpus)]})
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not pin host to CPU {sys.argv[1]}: {e}")
+
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(BotHost(events).serve())
+    finally:
+        loop.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""Capture of generated bot output in memory and in rotating log files"""
+
+import asyncio
+import logging
+import mmap
+import os
+import re
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, BinaryIO, Deque, Dict, List, Optional, Set
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Longer lines are truncated so one runaway print can't evict the whole buffer
+MAX_LINE_LENGTH = 4096
+_READ_CHUNK = 64 * 1024
+
+class LogBuffer:
+    """Ring buffer of output lines, bounded by line count and total bytes"""
+
+    def __init__(self, max_lines: int, max_bytes: int):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.lines: Deque[str] = deque()
+        self.size = 0
+        self.total_lines = 0
+        self.dropped = 0
+        self.subscribers: Set[asyncio.Queue] = set()
+
+    def append(self, line: str):
+        if len(line) > MAX_LINE_LENGTH:
+            line = line[:MAX_LINE_LENGTH] + "... [truncated]"
+        self.lines.append(line)
+        self.size += len(line) + 1
+        self.total_lines += 1
+        while self.lines and (len(self.lines) > self.max_lines or self.size > self.max_bytes):
+            self.size -= len(self.lines.popleft()) + 1
+            self.dropped += 1
+
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(line)
+            except asyncio.QueueFull:
+                # A slow subscriber loses lines rather than stalling the pump
+                pass
+
+    def tail(self, count: int) -> List[str]:
+        if count <= 0:
+            return []
+        start = max(0, len(self.lines) - count)
+        return [self.lines[i] for i in range(start, len(self.lines))]
+
+class RotatingLogFile:
+    """Append-only log file rolled over to numbered backups by size"""
+
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file: Optional[BinaryIO] = None
+        self._size = 0
+
+    def write(self, data: bytes):
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = open(self.path, "ab")
+                self._size = self._file.tell()
+            if self._size and self._size + len(data) > self.max_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+        except OSError as e:
+            logger.error(f"Error writing log file {self.path}: {e}")
+            self.close()
+
+    def _rotate(self):
+        """bot.log -> bot.log.1 -> ... -> bot.log.<backups>, dropping the oldest"""
+        self._file.close()
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                source = f"{self.path}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+            self._file = open(self.path, "ab")
+        else:
+            self._file = open(self.path, "wb")
+        self._size = 0
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+def _decode(raw: bytes) -> str:
+    line = raw.decode("utf-8", errors="replace").rstrip("\r")
+    if len(line) > MAX_LINE_LENGTH:
+        line = line[:MAX_LINE_LENGTH] + "... [truncated]"
+    return line
+
+def _map(f: BinaryIO) -> Optional[mmap.mmap]:
+    # Empty files can't be mapped
+    if os.fstat(f.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def tail_file(path: str, count: int) -> List[str]:
+    """Last lines of a file, read backwards through a memory map"""
+    if count <= 0:
+        return []
+    with open(path, "rb") as f:
+        data = _map(f)
+        if data is None:
+            return []
+        with data:
+            end = len(data)
+            if data[end - 1:end] == b"\n":
+                end -= 1
+            lines = []
+            while len(lines) < count:
+                start = data.rfind(b"\n", 0, end) + 1
+                lines.append(_decode(data[start:end]))
+                if start == 0:
+                    break
+                end = start - 1
+    lines.reverse()
+    return lines
+
+def grep_file(path: str, pattern: "re.Pattern", limit: int) -> List[str]:
+    """Last `limit` lines of a file matching a bytes pattern, scanned through a memory map"""
+    matches: Deque[str] = deque(maxlen=limit)
+    with open(path, "rb") as f:
+        data = _map(f)
+        if data is None:
+            return []
+        with data:
+            position = 0
+            while True:
+                match = pattern.search(data, position)
+                if match is None:
+                    break
+                start = data.rfind(b"\n", 0, match.start()) + 1
+                end = data.find(b"\n", match.end())
+                if end == -1:
+                    end = len(data)
+                matches.append(_decode(data[start:end]))
+                # One hit per line; carry on after it
+                position = end + 1
+    return list(matches)
+
+class BotLogs:
+    """Per-bot log buffers fed by asynchronous pumps, mirrored to rotating files"""
+
+    def __init__(
+        self,
+        max_lines: int = 1000,
+        max_bytes: int = 256 * 1024,
+        log_dir: Optional[str] = None,
+        file_max_bytes: int = 10 * 1024 * 1024,
+        file_backups: int = 5
+    ):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.log_dir = log_dir
+        self.file_max_bytes = file_max_bytes
+        self.file_backups = file_backups
+        self._buffers: Dict[str, LogBuffer] = {}
+        self._files: Dict[str, RotatingLogFile] = {}
+
+    def buffer(self, bot_id: str) -> LogBuffer:
+        buffer = self._buffers.get(bot_id)
+        if buffer is None:
+            buffer = self._buffers[bot_id] = LogBuffer(self.max_lines, self.max_bytes)
+        return buffer
+
+    def tail(self, bot_id: str, count: int = 20) -> List[str]:
+        """Last lines captured for a bot"""
+        buffer = self._buffers.get(bot_id)
+        return buffer.tail(count) if buffer else []
+
+    def has_logs(self, bot_id: str) -> bool:
+        return bot_id in self._buffers
+
+    def log_path(self, bot_id: str) -> Optional[str]:
+        """Current log file of a bot, if logs are persisted"""
+        if not self.log_dir:
+            return None
+        return os.path.join(self.log_dir, f"bot_{bot_id}.log")
+
+    def log_files(self, bot_id: str) -> List[str]:
+        """Existing log files of a bot, newest first"""
+        path = self.log_path(bot_id)
+        if not path:
+            return []
+        candidates = [path] + [f"{path}.{index}" for index in range(1, self.file_backups + 1)]
+        return [candidate for candidate in candidates if os.path.exists(candidate)]
+
+    def open_file(self, bot_id: str) -> Optional[RotatingLogFile]:
+        """Start a bot's log file session, marked with the start time"""
+        path = self.log_path(bot_id)
+        if not path:
+            return None
+        self.close_file(bot_id)
+        log_file = self._files[bot_id] = RotatingLogFile(path, self.file_max_bytes, self.file_backups)
+        log_file.write(f"--- started {datetime.now().isoformat(timespec='seconds')} ---\n".encode())
+        return log_file
+
+    def close_file(self, bot_id: str):
+        log_file = self._files.pop(bot_id, None)
+        if log_file:
+            log_file.close()
+
+    def append(self, bot_id: str, line: str):
+        """Record one output line that arrived outside a pump"""
+        self.buffer(bot_id).append(line)
+        log_file = self._files.get(bot_id)
+        if log_file:
+            log_file.write(line.encode("utf-8", errors="replace") + b"\n")
+
+    async def pump(self, bot_id: str, stream: asyncio.StreamReader):
+        """Drain a process stream into the bot's buffer and log file until EOF"""
+        buffer = self.buffer(bot_id)
+        log_file = self.open_file(bot_id)
+        pending = b""
+        try:
+            while True:
+                chunk = await stream.read(_READ_CHUNK)
+                if not chunk:
+                    break
+                pending += chunk
+                cut = pending.rfind(b"\n") + 1
+                if cut:
+                    complete, pending = pending[:cut], pending[cut:]
+                    if log_file:
+                        log_file.write(complete)
+                    for raw_line in complete[:-1].split(b"\n"):
+                        buffer.append(raw_line.decode("utf-8", errors="replace").rstrip("\r"))
+                if len(pending) > MAX_LINE_LENGTH:
+                    # No newline in sight; flush what we have as a line
+                    if log_file:
+                        log_file.write(pending + b"\n")
+                    buffer.append(pending.decode("utf-8", errors="replace"))
+                    pending = b""
+        except Exception as e:
+            logger.debug(f"Log stream of bot {bot_id} closed: {e}")
+        finally:
+            if pending:
+                buffer.append(pending.decode("utf-8", errors="replace").rstrip("\r"))
+            if log_file:
+                if pending:
+                    log_file.write(pending + b"\n")
+                log_file.close()
+                if self._files.get(bot_id) is log_file:
+                    del self._files[bot_id]
+
+    def tail_files(self, bot_id: str, count: int = 20) -> List[str]:
+        """Last lines of a bot's log files, walking back through rotated files"""
+        lines: List[str] = []
+        for path in self.log_files(bot_id):
+            try:
+                lines = tail_file(path, count - len(lines)) + lines
+            except (OSError, ValueError) as e:
+                logger.error(f"Error reading log file {path}: {e}")
+            if len(lines) >= count:
+                break
+        return lines
+
+    def search(self, bot_id: str, text: str, limit: int = 20) -> List[str]:
+        """Latest log lines containing text (case-insensitive), oldest first"""
+        pattern = re.compile(re.escape(text.encode("utf-8")), re.IGNORECASE)
+        lines: List[str] = []
+        for path in self.log_files(bot_id):
+            try:
+                lines = grep_file(path, pattern, limit - len(lines)) + lines
+            except (OSError, ValueError) as e:
+                logger.error(f"Error searching log file {path}: {e}")
+            if len(lines) >= limit:
+                break
+        return lines
+
+    async def subscribe(self, bot_id: str, max_pending: int = 1000) -> AsyncIterator[str]:
+        """Yield each new output line of a bot as it is captured"""
+        buffer = self.buffer(bot_id)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        buffer.subscribers.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            buffer.subscribers.discard(queue)
+
+    def discard(self, bot_id: str):
+        """Forget a bot's captured output"""
+        self._buffers.pop(bot_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "bots": len(self._buffers),
+            "lines": sum(len(buffer.lines) for buffer in self._buffers.values()),
+            "bytes": sum(buffer.size for buffer in self._buffers.values()),
+            "dropped": sum(buffer.dropped for buffer in self._buffers.values())
+        }
+
+# Global log capture instance
+bot_logs = BotLogs(
+    max_lines=config.BOT_LOG_MAX_LINES,
+    max_bytes=config.BOT_LOG_MAX_BYTES,
+    log_dir=os.path.join(config.GENERATED_BOTS_DIR, "logs"),
+    file_max_bytes=config.BOT_LOG_FILE_MAX_BYTES,
+    file_backups=config.BOT_LOG_FILE_BACKUPS
+)
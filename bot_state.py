@@ -0,0 +1,179 @@
+"""
+Durable record of launched bots, so a restarted generator can find them again
+
+The executor writes one record per bot it was asked to run: how to launch
+it again and, while it runs in a process of its own, that process's PID
+and start time. Records outlive clean shutdowns and crashes alike; only a
+deliberate stop or a supervisor giving up on a bot removes one.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+from dataclasses import asdict, dataclass, fields
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class BotRecord:
+    """What the executor needs to reattach to a bot or launch it again"""
+    bot_id: str
+    name: str
+    code_path: str
+    token: str
+    started_at: str
+    # Dedicated bot process, if any; hosted bots die with their host
+    pid: Optional[int] = None
+    # Kernel start time of ``pid``, so a reused PID is never mistaken for the bot
+    pid_started: Optional[int] = None
+    host: Optional[int] = None
+    # Stopped for being idle; woken rather than relaunched
+    hibernated: bool = False
+
+def process_start_time(pid: int) -> Optional[int]:
+    """Start time of a live process in clock ticks since boot, where /proc has it"""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name may contain spaces and parentheses; fields resume after the last ")"
+    try:
+        values = stat[stat.rindex(b")") + 2:].split()
+        if values[0] in (b"Z", b"X"):
+            # Exited; a zombie only waits to be reaped
+            return None
+        return int(values[19])
+    except (ValueError, IndexError):
+        return None
+
+def process_alive(pid: Optional[int], started: Optional[int]) -> bool:
+    """Whether ``pid`` still names the process that was recorded"""
+    if not pid or os.name != "posix":
+        # os.kill() on Windows terminates rather than probes
+        return False
+    if started is not None:
+        return process_start_time(pid) == started
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class AdoptedProcess:
+    """
+    A bot process left running by a previous generator
+
+    It is not our child, so its exit status can't be collected and its
+    exit is noticed by polling. Its output went to a pipe that closed with
+    the old generator and is lost.
+    """
+
+    stdin = None
+    stdout = None
+
+    def __init__(self, pid: int, started: Optional[int], poll_interval: float = 1):
+        self.pid = pid
+        self.started = started
+        self.poll_interval = poll_interval
+        self.returncode: Optional[int] = None
+
+    async def wait(self) -> int:
+        while self.returncode is None:
+            if not process_alive(self.pid, self.started):
+                self.returncode = -1
+                break
+            await asyncio.sleep(self.poll_interval)
+        return self.returncode
+
+    def send_signal(self, signum: int):
+        if self.returncode is not None or not process_alive(self.pid, self.started):
+            raise ProcessLookupError(self.pid)
+        os.kill(self.pid, signum)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(getattr(signal, "SIGKILL", signal.SIGTERM))
+
+class BotStateStore:
+    """Bot records and bot host PIDs in a JSON file, rewritten atomically on every change"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: Dict[str, BotRecord] = {}
+        # Host index -> (pid, start time) of the bot hosts last started
+        self.hosts: Dict[int, Tuple[Optional[int], Optional[int]]] = {}
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            known = {field.name for field in fields(BotRecord)}
+            for bot_id, record in data.get("bots", {}).items():
+                self.records[bot_id] = BotRecord(**{key: value for key, value in record.items() if key in known})
+            for index, host in data.get("hosts", {}).items():
+                self.hosts[int(index)] = (host.get("pid"), host.get("pid_started"))
+        except Exception as e:
+            logger.error(f"Could not read executor state {self.path}: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        data = {
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+            "bots": {bot_id: asdict(record) for bot_id, record in self.records.items()},
+            "hosts": {str(index): {"pid": pid, "pid_started": started} for index, (pid, started) in self.hosts.items()}
+        }
+        temp_path = f"{self.path}.tmp"
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Records hold bot tokens
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error writing executor state: {e}")
+
+    def put(self, record: BotRecord):
+        self.records[record.bot_id] = record
+        self.save()
+
+    def exited(self, bot_id: str):
+        """Keep the bot's launch spec, but forget the process that ran it"""
+        record = self.records.get(bot_id)
+        if record is not None and (record.pid is not None or record.host is not None):
+            record.pid = record.pid_started = record.host = None
+            self.save()
+
+    def hibernated(self, bot_id: str):
+        """Keep the launch spec of a bot stopped for being idle"""
+        record = self.records.get(bot_id)
+        if record is not None:
+            record.pid = record.pid_started = record.host = None
+            record.hibernated = True
+            self.save()
+
+    def forget(self, bot_id: str):
+        if self.records.pop(bot_id, None) is not None:
+            self.save()
+
+    def set_host(self, index: int, pid: Optional[int]):
+        if pid is None:
+            self.hosts.pop(index, None)
+        else:
+            self.hosts[index] = (pid, process_start_time(pid))
+        self.save()
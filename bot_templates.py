@@ -1,17 +1,22 @@
 """Base templates for generated bots"""
 
+import re
+import string
+from typing import Dict, List, Optional, Any
+
 BASE_BOT_TEMPLATE = '''"""Auto-generated Telegram bot"""
+import asyncio
 import logging
 import os
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
-
+{custom_module_code}
 class {bot_class_name}:
     """Generated bot class"""
     
@@ -53,16 +58,47 @@ class {bot_class_name}:
             "Custom logic can be added here."
         )
     
-    def run(self):
-        """Run the bot"""
+{custom_methods}    def build_application(self) -> Application:
+        """Create the Application with every handler registered"""
         self.application = Application.builder().token(self.token).build()
         
         # Add handlers
-        self.application.add_handler(CommandHandler("start", self.start))
+{custom_handlers}        self.application.add_handler(CommandHandler("start", self.start))
         self.application.add_handler(CommandHandler("help", self.help_command))
         self.application.add_handler(CommandHandler("info", self.info_command))
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+{custom_fallback_handlers}        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
         
+        return self.application
+    
+    async def _heartbeat(self, path: str, interval: float):
+        """Touch a file while the event loop is responsive, for the supervisor"""
+        while True:
+            with open(path, "a"):
+                os.utime(path, None)
+            await asyncio.sleep(interval)
+    
+    async def _record_activity(self, update: object, context: ContextTypes.DEFAULT_TYPE):
+        """Touch the activity file on every update, so idle bots can be hibernated"""
+        with open(self._activity_file, "a"):
+            os.utime(self._activity_file, None)
+    
+    def run(self):
+        """Run the bot"""
+        self.build_application()
+        heartbeat_file = os.getenv("BOT_HEARTBEAT_FILE")
+        if heartbeat_file:
+            interval = float(os.getenv("BOT_HEARTBEAT_INTERVAL", "10"))
+            
+            async def start_heartbeat(application):
+                self._heartbeat_task = asyncio.ensure_future(self._heartbeat(heartbeat_file, interval))
+            
+            self.application.post_init = start_heartbeat
+        activity_file = os.getenv("BOT_ACTIVITY_FILE")
+        if activity_file:
+            self._activity_file = activity_file
+            with open(activity_file, "a"):
+                os.utime(activity_file, None)
+            self.application.add_handler(TypeHandler(object, self._record_activity), group=-1000)
         logger.info("Starting bot...")
         self.application.run_polling()
 
@@ -80,7 +116,7 @@ from datetime import datetime
 from typing import Optional
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, filters,
+    Application, CommandHandler, MessageHandler, TypeHandler, filters,
     ContextTypes, ConversationHandler, CallbackQueryHandler
 )
 
@@ -89,7 +125,7 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
-
+{custom_module_code}
 # Conversation states
 STATE_MAIN, STATE_INPUT = range(2)
 
@@ -136,7 +172,7 @@ class {bot_class_name}:
         user_id = update.effective_user.id
         
         if user_id not in self.users_data:
-            self.users_data[user_id] = {"messages": 0}
+            self.users_data[user_id] = {{"messages": 0}}
         
         self.users_data[user_id]["messages"] += 1
         
@@ -163,16 +199,47 @@ class {bot_class_name}:
         minutes, seconds = divmod(remainder, 60)
         return f"{{hours}}h {{minutes}}m {{seconds}}s"
     
-    def run(self):
-        """Run the bot"""
+{custom_methods}    def build_application(self) -> Application:
+        """Create the Application with every handler registered"""
         self.application = Application.builder().token(self.token).build()
         
         # Add handlers
-        self.application.add_handler(CommandHandler("start", self.start))
+{custom_handlers}        self.application.add_handler(CommandHandler("start", self.start))
         self.application.add_handler(CommandHandler("status", self.status_command))
-        self.application.add_handler(CallbackQueryHandler(self.button_callback))
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+        self.application.add_handler(CallbackQueryHandler(self.button_callback, pattern="^(about|help)$"))
+{custom_fallback_handlers}        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
         
+        return self.application
+    
+    async def _heartbeat(self, path: str, interval: float):
+        """Touch a file while the event loop is responsive, for the supervisor"""
+        while True:
+            with open(path, "a"):
+                os.utime(path, None)
+            await asyncio.sleep(interval)
+    
+    async def _record_activity(self, update: object, context: ContextTypes.DEFAULT_TYPE):
+        """Touch the activity file on every update, so idle bots can be hibernated"""
+        with open(self._activity_file, "a"):
+            os.utime(self._activity_file, None)
+    
+    def run(self):
+        """Run the bot"""
+        self.build_application()
+        heartbeat_file = os.getenv("BOT_HEARTBEAT_FILE")
+        if heartbeat_file:
+            interval = float(os.getenv("BOT_HEARTBEAT_INTERVAL", "10"))
+            
+            async def start_heartbeat(application):
+                self._heartbeat_task = asyncio.ensure_future(self._heartbeat(heartbeat_file, interval))
+            
+            self.application.post_init = start_heartbeat
+        activity_file = os.getenv("BOT_ACTIVITY_FILE")
+        if activity_file:
+            self._activity_file = activity_file
+            with open(activity_file, "a"):
+                os.utime(activity_file, None)
+            self.application.add_handler(TypeHandler(object, self._record_activity), group=-1000)
         logger.info(f"Starting bot: {{self.get_bot_name()}}")
         self.application.run_polling()
 
@@ -182,6 +249,160 @@ if __name__ == "__main__":
     bot.run()
 '''
 
+# Filters a generated message handler may ask for
+MESSAGE_FILTERS = {
+    'text': 'filters.TEXT & ~filters.COMMAND',
+    'photo': 'filters.PHOTO',
+    'document': 'filters.Document.ALL',
+    'voice': 'filters.VOICE',
+    'location': 'filters.LOCATION',
+    'sticker': 'filters.Sticker.ALL'
+}
+
+HANDLER_TYPES = ('command', 'callback', 'message')
+
+def is_catch_all(handler: dict) -> bool:
+    """Whether a handler spec matches every callback query or text message"""
+    if handler.get('type') == 'callback':
+        return not handler.get('pattern')
+    if handler.get('type') == 'message':
+        return handler.get('filter', 'text') not in MESSAGE_FILTERS or handler.get('filter', 'text') == 'text'
+    return False
+
+def render_handler_registrations(handlers: list, indent: str = "        ") -> str:
+    """Render add_handler() lines for generated handler specs"""
+    lines = []
+    for handler in handlers:
+        method = handler.get('method', '')
+        if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', method):
+            continue
+        
+        kind = handler.get('type')
+        if kind == 'command':
+            command = re.sub(r'[^a-z0-9_]', '', handler.get('command', '').lower().lstrip('/'))[:32]
+            if not command:
+                continue
+            call = f'CommandHandler("{command}", self.{method})'
+        elif kind == 'callback':
+            pattern = handler.get('pattern')
+            try:
+                re.compile(pattern or '')
+            except re.error:
+                pattern = None
+            if pattern:
+                call = f'CallbackQueryHandler(self.{method}, pattern={pattern!r})'
+            else:
+                call = f'CallbackQueryHandler(self.{method})'
+        elif kind == 'message':
+            message_filter = MESSAGE_FILTERS.get(handler.get('filter', 'text'), MESSAGE_FILTERS['text'])
+            call = f'MessageHandler({message_filter}, self.{method})'
+        else:
+            continue
+        
+        lines.append(f"{indent}self.application.add_handler({call})\n")
+    
+    return "".join(lines)
+
+# Slots every template may leave out of render() calls
+OPTIONAL_SLOTS = {
+    'custom_module_code': '',
+    'custom_methods': '',
+    'custom_handlers': '',
+    'custom_fallback_handlers': ''
+}
+
+class CompiledTemplate:
+    """
+    A template pre-parsed into literal segments and named slots
+
+    Parsing happens once at registration; render() fills the slot
+    positions of a copied part list and joins it, so the template text is
+    never rescanned or copied per bot.
+    """
+
+    def __init__(self, name: str, version: int, source: str, description: str = ""):
+        self.name = name
+        self.version = version
+        self.source = source
+        self.description = description
+        self._parts: List[str] = []
+        # (index into _parts, slot name)
+        self._slot_positions: List[tuple] = []
+
+        for literal, field, format_spec, conversion in string.Formatter().parse(source):
+            if literal:
+                self._parts.append(literal)
+            if field is None:
+                continue
+            if not field.isidentifier() or format_spec or conversion:
+                raise ValueError(f"Template {name} v{version}: unsupported placeholder {{{field}}}")
+            self._slot_positions.append((len(self._parts), field))
+            self._parts.append("")
+
+        self.slots = sorted({field for _, field in self._slot_positions})
+        # Methods the template registers itself
+        self.handler_methods = set(re.findall(r'add_handler\([^\n]*?self\.(\w+)', source))
+
+    def render(self, **values: str) -> str:
+        """Fill every slot; missing required slots raise KeyError"""
+        parts = list(self._parts)
+        for index, field in self._slot_positions:
+            value = values.get(field)
+            if value is None:
+                value = OPTIONAL_SLOTS[field]
+            parts[index] = value
+        return "".join(parts)
+
+    def partial(self, **values: str) -> str:
+        """Fill the given slots and leave the rest as placeholders for str.format()"""
+        escape = lambda text: text.replace("{", "{{").replace("}", "}}")
+        parts = [escape(part) for part in self._parts]
+        for index, field in self._slot_positions:
+            parts[index] = escape(values[field]) if field in values else f"{{{field}}}"
+        return "".join(parts)
+
+# name -> version -> compiled template
+_TEMPLATES: Dict[str, Dict[int, CompiledTemplate]] = {}
+
+def register_template(name: str, source: str, version: int = 1, description: str = "") -> CompiledTemplate:
+    """Compile and register a template variant; re-registering a version replaces it"""
+    template = CompiledTemplate(name, version, source, description)
+    _TEMPLATES.setdefault(name, {})[version] = template
+    return template
+
+def get_compiled_template(name: str = "enhanced", version: Optional[int] = None) -> CompiledTemplate:
+    """Get a registered template, by default its latest version"""
+    versions = _TEMPLATES.get(name)
+    if not versions:
+        raise KeyError(f"Unknown template: {name}")
+    if version is None:
+        version = max(versions)
+    if version not in versions:
+        raise KeyError(f"Unknown version {version} of template {name}")
+    return versions[version]
+
+def list_templates() -> List[Dict[str, Any]]:
+    """Describe every registered template version"""
+    return [
+        {
+            "name": name,
+            "version": version,
+            "description": template.description,
+            "slots": template.slots
+        }
+        for name, versions in sorted(_TEMPLATES.items())
+        for version, template in sorted(versions.items())
+    ]
+
+register_template("base", BASE_BOT_TEMPLATE, 1, "Commands /start, /help and /info with a plain text reply")
+register_template("enhanced", ENHANCED_BOT_TEMPLATE, 1, "Inline keyboard, /status, uptime and per-user message counts")
+
 def get_template(enhanced: bool = False) -> str:
-    """Get appropriate template"""
-    return ENHANCED_BOT_TEMPLATE if enhanced else BASE_BOT_TEMPLATE
+    """
+    Get appropriate template, for str.format() with the original slots
+
+    The optional slots later versions added are filled with their defaults;
+    new code should render get_compiled_template() instead.
+    """
+    template = get_compiled_template("enhanced" if enhanced else "base", 1)
+    return template.partial(**OPTIONAL_SLOTS)
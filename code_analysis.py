@@ -0,0 +1,474 @@
+"""Single-pass analysis of generated bot code"""
+
+import ast
+import asyncio
+import io
+import logging
+import re
+import textwrap
+import tokenize
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Resolved call name -> (severity, reason); a trailing * matches any suffix
+DANGEROUS_CALLS: Dict[str, Tuple[str, str]] = {
+    'eval': ('high', 'dynamic code execution'),
+    'exec': ('high', 'dynamic code execution'),
+    'compile': ('high', 'dynamic code execution'),
+    '__import__': ('high', 'dynamic import'),
+    'importlib.import_module': ('high', 'dynamic import'),
+    'os.system': ('high', 'shell command execution'),
+    'os.popen': ('high', 'shell command execution'),
+    'os.exec*': ('high', 'process execution'),
+    'os.spawn*': ('high', 'process execution'),
+    'os.fork': ('high', 'process execution'),
+    'subprocess.*': ('high', 'process execution'),
+    'shutil.rmtree': ('medium', 'recursive file deletion'),
+    'os.remove': ('medium', 'file deletion'),
+    'os.unlink': ('medium', 'file deletion'),
+    'os.rmdir': ('medium', 'file deletion'),
+    'pickle.load*': ('medium', 'unsafe deserialization'),
+    'marshal.load*': ('medium', 'unsafe deserialization'),
+}
+
+RISKY_IMPORTS: Dict[str, str] = {
+    'ctypes': 'native memory access',
+    'subprocess': 'process execution',
+    'pty': 'terminal spawning',
+    'multiprocessing': 'process spawning',
+}
+
+_BLOCK_START = re.compile(r'(?:async\s+def|def|class|import|from)\b|@')
+
+# update.message attribute -> MESSAGE_FILTERS key in bot_templates
+_MESSAGE_ATTRIBUTE_FILTERS = {
+    'photo': 'photo',
+    'document': 'document',
+    'voice': 'voice',
+    'location': 'location',
+    'sticker': 'sticker',
+}
+_HANDLER_AFFIXES = re.compile(r'^(?:handle_|on_|cmd_)|(?:_command|_cmd|_handler|_callback)$')
+
+@dataclass
+class ImportInfo:
+    module: str
+    name: Optional[str]
+    alias: str
+    line: int
+
+@dataclass
+class CallInfo:
+    name: str
+    line: int
+
+@dataclass
+class MethodInfo:
+    name: str
+    line: int
+    is_async: bool
+    params: List[str]
+    # Takes (update, context) like a python-telegram-bot handler
+    is_handler: bool
+    docstring: Optional[str] = None
+    # Attribute chains read from update/context, e.g. "update.message.photo"
+    uses: List[str] = field(default_factory=list)
+    # String literals compared with, or prefix-matched against, callback data
+    callback_data: List[str] = field(default_factory=list)
+    callback_prefixes: List[str] = field(default_factory=list)
+
+@dataclass
+class Finding:
+    severity: str
+    message: str
+    line: int
+
+@dataclass
+class CodeReport:
+    """Everything learned from one pass over generated code"""
+    methods: List[MethodInfo] = field(default_factory=list)
+    imports: List[ImportInfo] = field(default_factory=list)
+    calls: List[CallInfo] = field(default_factory=list)
+    findings: List[Finding] = field(default_factory=list)
+    # Methods re-indented for the class body, and module-level code they need
+    class_body: str = ""
+    module_code: str = ""
+    # Statements or blocks that could not be kept, with the reason
+    discarded: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def handler_names(self) -> List[str]:
+        return [method.name for method in self.methods if method.is_handler]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "methods": [method.name for method in self.methods],
+            "handlers": self.handler_names,
+            "imports": sorted({imp.module for imp in self.imports}),
+            "findings": [f"{f.severity}: {f.message} (line {f.line})" for f in self.findings],
+            "discarded": len(self.discarded)
+        }
+
+class _ReportVisitor(ast.NodeVisitor):
+    """Collects imports, calls, methods and findings in one traversal"""
+
+    def __init__(self, report: CodeReport, line_offset: int = 0):
+        self.report = report
+        self.line_offset = line_offset
+        # Local name -> fully qualified name, from import statements
+        self.aliases: Dict[str, str] = {}
+        self.function_depth = 0
+        self.method: Optional[MethodInfo] = None
+
+    def _line(self, node: ast.AST) -> int:
+        return getattr(node, 'lineno', 0) + self.line_offset
+
+    def visit_Import(self, node: ast.Import):
+        for alias in node.names:
+            local = alias.asname or alias.name.split('.')[0]
+            self.aliases[local] = alias.name if alias.asname else local
+            self.report.imports.append(ImportInfo(alias.name, None, local, self._line(node)))
+            self._check_import(alias.name, node)
+
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        module = node.module or ''
+        for alias in node.names:
+            local = alias.asname or alias.name
+            if alias.name != '*':
+                self.aliases[local] = f"{module}.{alias.name}" if module else alias.name
+            self.report.imports.append(ImportInfo(module, alias.name, local, self._line(node)))
+            self._check_import(module, node)
+            self._check_call_name(f"{module}.{alias.name}", node, imported=True)
+
+    def visit_Call(self, node: ast.Call):
+        name = self._resolve(node.func)
+        if name:
+            self.report.calls.append(CallInfo(name, self._line(node)))
+            self._check_call_name(name, node)
+        if self.method is not None and isinstance(node.func, ast.Attribute) \
+                and node.func.attr == 'startswith' and self._is_callback_data(node.func.value):
+            # query.data.startswith("page_")
+            for arg in node.args:
+                self.method.callback_prefixes.extend(self._string_constants(arg))
+        self.generic_visit(node)
+
+    def visit_Compare(self, node: ast.Compare):
+        if self.method is not None:
+            operands = [node.left] + node.comparators
+            if any(self._is_callback_data(operand) for operand in operands):
+                for operand in operands:
+                    self.method.callback_data.extend(self._string_constants(operand))
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node: ast.Attribute):
+        name = self._dotted(node)
+        if name is None:
+            self.generic_visit(node)
+        elif self.method is not None and name.split('.')[0] in ('update', 'context'):
+            if name not in self.method.uses:
+                self.method.uses.append(name)
+
+    def visit_FunctionDef(self, node):
+        outer = self.method
+        if self.function_depth == 0:
+            params = [arg.arg for arg in node.args.posonlyargs + node.args.args]
+            handler_params = params[1:] if params[:1] == ['self'] else params
+            self.method = MethodInfo(
+                name=node.name,
+                line=self._line(node),
+                is_async=isinstance(node, ast.AsyncFunctionDef),
+                params=params,
+                is_handler=len(handler_params) >= 2 and handler_params[0] == 'update',
+                docstring=(ast.get_docstring(node) or '').split('\n')[0] or None
+            )
+            self.report.methods.append(self.method)
+        self.function_depth += 1
+        self.generic_visit(node)
+        self.function_depth -= 1
+        self.method = outer
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    @staticmethod
+    def _dotted(node: ast.AST) -> Optional[str]:
+        """Dotted source name of a Name/Attribute chain"""
+        parts = []
+        while isinstance(node, ast.Attribute):
+            parts.append(node.attr)
+            node = node.value
+        if not isinstance(node, ast.Name):
+            return None
+        parts.append(node.id)
+        return '.'.join(reversed(parts))
+
+    def _resolve(self, node: ast.AST) -> Optional[str]:
+        """Dotted name of a call target, with import aliases expanded"""
+        name = self._dotted(node)
+        if name is None:
+            return None
+        root, _, rest = name.partition('.')
+        name = self.aliases.get(root, root) + ('.' + rest if rest else '')
+        return name[len('builtins.'):] if name.startswith('builtins.') else name
+
+    @staticmethod
+    def _is_callback_data(node: ast.AST) -> bool:
+        return isinstance(node, ast.Attribute) and node.attr == 'data'
+
+    @staticmethod
+    def _string_constants(node: ast.AST) -> List[str]:
+        """String literals in a constant or a tuple/list/set of constants"""
+        items = node.elts if isinstance(node, (ast.Tuple, ast.List, ast.Set)) else [node]
+        return [
+            item.value for item in items
+            if isinstance(item, ast.Constant) and isinstance(item.value, str) and item.value
+        ]
+
+    def _check_import(self, module: str, node: ast.AST):
+        root = module.split('.')[0]
+        if root in RISKY_IMPORTS:
+            self.report.findings.append(
+                Finding('medium', f"imports {module} ({RISKY_IMPORTS[root]})", self._line(node))
+            )
+
+    def _check_call_name(self, name: str, node: ast.AST, imported: bool = False):
+        for pattern, (severity, reason) in DANGEROUS_CALLS.items():
+            if name == pattern or (pattern.endswith('*') and name.startswith(pattern[:-1])):
+                verb = "imports" if imported else "calls"
+                self.report.findings.append(Finding(severity, f"{verb} {name} ({reason})", self._line(node)))
+                return
+
+def _strip_fences(source: str) -> str:
+    """Keep only the contents of markdown code fences, if there are any"""
+    if '```' not in source:
+        return source
+    blocks = re.findall(r'```[A-Za-z0-9_+-]*\n(.*?)(?:```|\Z)', source, re.DOTALL)
+    return '\n'.join(blocks) if blocks else source.replace('```', '')
+
+def _string_continuation_lines(source: str) -> Set[int]:
+    """Line numbers that lie inside multi-line string literals"""
+    lines: Set[int] = set()
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(source).readline):
+            if token.type == tokenize.STRING and token.end[0] > token.start[0]:
+                lines.update(range(token.start[0] + 1, token.end[0] + 1))
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        pass
+    return lines
+
+def _split_blocks(source: str) -> List[Tuple[int, str]]:
+    """Split source at top-level statements so valid parts survive a broken one"""
+    blocks: List[Tuple[int, str]] = []
+    start = 0
+    lines = source.split('\n')
+    for index, line in enumerate(lines):
+        # Decorators start a block; the def right below them belongs to it
+        after_decorator = index > 0 and lines[index - 1].startswith('@')
+        if index > start and _BLOCK_START.match(line) and not after_decorator:
+            blocks.append((start, '\n'.join(lines[start:index])))
+            start = index
+    blocks.append((start, '\n'.join(lines[start:])))
+    return blocks
+
+def _reindent(lines: List[str], first: int, last: int, col: int, strings: Set[int], indent: str) -> str:
+    """Move source lines first..last (1-based) from column col to indent"""
+    result = []
+    for number in range(first, last + 1):
+        line = lines[number - 1]
+        if number in strings or not line.strip():
+            # String contents must stay byte-identical; blank lines stay empty
+            result.append(line if number in strings else '')
+        else:
+            result.append(indent + (line[col:] if line[:col].isspace() or col == 0 else line.lstrip()))
+    return '\n'.join(result)
+
+def _collect_segments(
+    tree: ast.Module,
+    source: str,
+    report: CodeReport,
+    methods: List[str],
+    module_code: List[str],
+    line_offset: int
+):
+    """Route top-level statements to the class body or the module scope"""
+    lines = source.split('\n')
+    strings = _string_continuation_lines(source)
+    # Docstring indentation is insignificant, so docstrings move with their code
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.body:
+            first = node.body[0]
+            if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) \
+                    and isinstance(first.value.value, str):
+                strings.difference_update(range(first.lineno, first.end_lineno + 1))
+
+    def method_segment(node, col: int) -> str:
+        first = min([node.lineno] + [d.lineno for d in node.decorator_list])
+        # Comments right above a method belong to it
+        while first > 1 and lines[first - 2].strip().startswith('#'):
+            first -= 1
+        segment = _reindent(lines, first, node.end_lineno, col, strings, "    ")
+        params = [arg.arg for arg in node.args.posonlyargs + node.args.args]
+        decorators = {getattr(d, 'id', None) for d in node.decorator_list}
+        if params[:1] != ['self'] and not decorators & {'staticmethod', 'classmethod'}:
+            # A plain function: make it callable as self.<name>(update, context)
+            def_line = next(
+                i for i, line in enumerate(segment.split('\n'))
+                if line.lstrip().startswith(('def ', 'async def ', '@'))
+            )
+            parts = segment.split('\n')
+            parts.insert(def_line, "    @staticmethod")
+            segment = '\n'.join(parts)
+        return segment
+
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            methods.append(method_segment(node, node.col_offset))
+        elif isinstance(node, ast.ClassDef):
+            # Whole class returned instead of bare methods: keep its methods
+            for item in node.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)) and item.name != '__init__':
+                    methods.append(method_segment(item, item.col_offset))
+                elif not isinstance(item, (ast.Expr, ast.Pass, ast.FunctionDef, ast.AsyncFunctionDef)):
+                    report.discarded.append(f"line {item.lineno + line_offset}: class-level statement")
+        elif isinstance(node, (ast.Import, ast.ImportFrom, ast.Assign, ast.AnnAssign)):
+            module_code.append(_reindent(lines, node.lineno, node.end_lineno, 0, strings, ""))
+        elif isinstance(node, ast.Pass) or (
+            isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)
+        ):
+            continue
+        else:
+            report.discarded.append(
+                f"line {node.lineno + line_offset}: top-level {type(node).__name__} statement"
+            )
+
+def analyze_custom_logic(source: str) -> CodeReport:
+    """
+    Parse LLM-generated methods once and prepare them for the bot template
+
+    Methods (including ones wrapped in a class) are re-indented for the
+    class body; imports and constants go to module scope. If the code does
+    not parse as a whole, each top-level block is tried on its own and only
+    the broken ones are dropped.
+    """
+    report = CodeReport()
+    source = textwrap.dedent(_strip_fences(source)).strip('\n')
+    if not source.strip():
+        return report
+
+    try:
+        parsed = [(0, source, ast.parse(source))]
+    except SyntaxError as e:
+        logger.info(f"Generated code does not parse ({e.msg}, line {e.lineno}), salvaging blocks")
+        parsed = []
+        for offset, block in _split_blocks(source):
+            block = textwrap.dedent(block).strip('\n')
+            if not block.strip():
+                continue
+            try:
+                parsed.append((offset, block, ast.parse(block)))
+            except SyntaxError as block_error:
+                report.discarded.append(f"line {offset + (block_error.lineno or 1)}: {block_error.msg}")
+
+    methods: List[str] = []
+    module_code: List[str] = []
+    for offset, block, tree in parsed:
+        _ReportVisitor(report, offset).visit(tree)
+        _collect_segments(tree, block, report, methods, module_code, offset)
+
+    if not methods and report.discarded:
+        report.error = "no usable methods in generated code: " + "; ".join(report.discarded[:3])
+    report.class_body = "\n\n".join(methods) + "\n    \n" if methods else ""
+    report.module_code = "\n" + "\n".join(module_code) + "\n" if module_code else ""
+    return report
+
+def derive_handlers(methods: List[MethodInfo], registered: Set[str]) -> List[Dict[str, str]]:
+    """
+    Infer handler registrations for analyzed methods nobody registered
+
+    Methods reading callback queries become callback handlers (with a
+    pattern built from the callback data they compare against); methods
+    named like commands or reading context.args become commands; methods
+    reading a media attribute get that message filter; other text-reading
+    handle_/on_ methods become text handlers. Anything else is exposed as
+    a command named after the method.
+    """
+    handlers: List[Dict[str, str]] = []
+    for method in methods:
+        if not method.is_handler or method.name in registered or method.name.startswith('_'):
+            continue
+        uses = method.uses
+        base_name = _HANDLER_AFFIXES.sub('', method.name) or method.name
+
+        def reads(*attributes: str) -> bool:
+            return any(
+                use == attr or use.startswith(attr + '.')
+                for use in uses for attr in attributes
+            )
+
+        if reads('update.callback_query') or method.name.endswith('_callback') \
+                or method.callback_data or method.callback_prefixes:
+            handler = {"type": "callback", "method": method.name}
+            alternatives = [re.escape(value) + '$' for value in dict.fromkeys(method.callback_data)]
+            alternatives += [re.escape(prefix) for prefix in dict.fromkeys(method.callback_prefixes)]
+            if alternatives:
+                handler["pattern"] = f"^(?:{'|'.join(alternatives)})"
+            handlers.append(handler)
+            continue
+
+        if method.name.endswith(('_command', '_cmd')) or method.name.startswith('cmd_') \
+                or reads('context.args'):
+            handlers.append({"type": "command", "command": base_name, "method": method.name})
+            continue
+
+        media = next(
+            (
+                message_filter for attr, message_filter in _MESSAGE_ATTRIBUTE_FILTERS.items()
+                if reads(f"update.message.{attr}", f"update.effective_message.{attr}")
+            ),
+            None
+        )
+        if media:
+            handlers.append({"type": "message", "filter": media, "method": method.name})
+        elif method.name.startswith(('handle_', 'on_')) \
+                and reads('update.message.text', 'update.effective_message.text'):
+            handlers.append({"type": "message", "filter": "text", "method": method.name})
+        else:
+            handlers.append({"type": "command", "command": base_name, "method": method.name})
+    return handlers
+
+def syntax_error(code: str) -> Optional[str]:
+    """Describe the first syntax error in code, or None if it compiles"""
+    try:
+        ast.parse(code)
+        return None
+    except SyntaxError as e:
+        return f"{e.msg} (line {e.lineno})"
+
+class CodeAnalyzer:
+    """Runs the CPU-heavy analysis functions in a process pool"""
+
+    def __init__(self, workers: int = 2):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run a module-level function off the event loop (inline if workers is 0)"""
+        if self.workers <= 0:
+            return fn(*args)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        except BrokenProcessPool:
+            logger.error("Code analysis pool died, restarting it")
+            self._pool = None
+            return fn(*args)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
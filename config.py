@@ -14,9 +14,55 @@ class Config:
     ONLYSQ_BASE_URL: str = os.getenv('ONLYSQ_BASE_URL', 'https://api.onlysq.ru/v1')
     ONLYSQ_MODEL: str = os.getenv('ONLYSQ_MODEL', 'gpt-4o-mini')
     
+    # OnlySq connection pool and timeouts (seconds)
+    ONLYSQ_MAX_CONNECTIONS: int = int(os.getenv('ONLYSQ_MAX_CONNECTIONS', 50))
+    ONLYSQ_MAX_KEEPALIVE: int = int(os.getenv('ONLYSQ_MAX_KEEPALIVE', 20))
+    ONLYSQ_KEEPALIVE_EXPIRY: float = float(os.getenv('ONLYSQ_KEEPALIVE_EXPIRY', 30))
+    ONLYSQ_CONNECT_TIMEOUT: float = float(os.getenv('ONLYSQ_CONNECT_TIMEOUT', 5))
+    ONLYSQ_READ_TIMEOUT: float = float(os.getenv('ONLYSQ_READ_TIMEOUT', 30))
+    ONLYSQ_TOTAL_TIMEOUT: float = float(os.getenv('ONLYSQ_TOTAL_TIMEOUT', 45))
+    ONLYSQ_MAX_CONCURRENT_REQUESTS: int = int(os.getenv('ONLYSQ_MAX_CONCURRENT_REQUESTS', 8))
+    
+    # OnlySq rate limiting, retries and circuit breaker
+    ONLYSQ_RATE_LIMIT: float = float(os.getenv('ONLYSQ_RATE_LIMIT', 5))
+    ONLYSQ_RATE_BURST: int = int(os.getenv('ONLYSQ_RATE_BURST', 10))
+    ONLYSQ_MAX_RETRIES: int = int(os.getenv('ONLYSQ_MAX_RETRIES', 2))
+    ONLYSQ_RETRY_BASE_DELAY: float = float(os.getenv('ONLYSQ_RETRY_BASE_DELAY', 0.5))
+    ONLYSQ_RETRY_MAX_DELAY: float = float(os.getenv('ONLYSQ_RETRY_MAX_DELAY', 8))
+    ONLYSQ_BREAKER_THRESHOLD: int = int(os.getenv('ONLYSQ_BREAKER_THRESHOLD', 5))
+    ONLYSQ_BREAKER_RESET: float = float(os.getenv('ONLYSQ_BREAKER_RESET', 30))
+    
+    # Hedged requests: backup models (defaults to list_models()) and deadline
+    ONLYSQ_HEDGE_MODELS: str = os.getenv('ONLYSQ_HEDGE_MODELS', '')
+    ONLYSQ_HEDGE_PERCENTILE: float = float(os.getenv('ONLYSQ_HEDGE_PERCENTILE', 0.9))
+    ONLYSQ_HEDGE_MIN_DELAY: float = float(os.getenv('ONLYSQ_HEDGE_MIN_DELAY', 0.5))
+    ONLYSQ_HEDGE_DEFAULT_DELAY: float = float(os.getenv('ONLYSQ_HEDGE_DEFAULT_DELAY', 3))
+    
+    # LLM response cache (leave LLM_CACHE_DIR empty for memory only)
+    LLM_CACHE_ENABLED: bool = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+    LLM_CACHE_MAX_ENTRIES: int = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 512))
+    LLM_CACHE_TTL: float = float(os.getenv('LLM_CACHE_TTL', 86400))
+    LLM_CACHE_DIR: str = os.getenv('LLM_CACHE_DIR', '.llm_cache')
+    LLM_CACHE_MAX_DISK_MB: int = int(os.getenv('LLM_CACHE_MAX_DISK_MB', 50))
+    
+    # Near-duplicate description reuse (empty SIMILARITY_INDEX_FILE keeps it in memory)
+    SIMILARITY_ENABLED: bool = os.getenv('SIMILARITY_ENABLED', 'true').lower() == 'true'
+    SIMILARITY_INDEX_FILE: str = os.getenv('SIMILARITY_INDEX_FILE', 'similarity_index.bin')
+    SIMILARITY_THRESHOLD: float = float(os.getenv('SIMILARITY_THRESHOLD', 0.5))
+    
     # Bot Execution
     BOT_PORT: int = int(os.getenv('BOT_PORT', 8000))
     BOT_WEBHOOK_URL: Optional[str] = os.getenv('BOT_WEBHOOK_URL')
+    # With BOT_WEBHOOK_URL set (public https base), one server on BOT_WEBHOOK_LISTEN:BOT_PORT
+    # receives the updates of every hosted bot instead of each bot polling
+    BOT_WEBHOOK_LISTEN: str = os.getenv('BOT_WEBHOOK_LISTEN', '0.0.0.0')
+    # Key for the per-bot secret paths (defaults to MAIN_BOT_TOKEN); changing it orphans set webhooks
+    BOT_WEBHOOK_SECRET: str = os.getenv('BOT_WEBHOOK_SECRET', '')
+    # Updates queued per bot before the ingress answers 429, most handed over at once,
+    # and seconds updates wait for a bot that isn't running before they are dropped
+    BOT_WEBHOOK_QUEUE_SIZE: int = int(os.getenv('BOT_WEBHOOK_QUEUE_SIZE', 100))
+    BOT_WEBHOOK_BATCH_SIZE: int = int(os.getenv('BOT_WEBHOOK_BATCH_SIZE', 20))
+    BOT_WEBHOOK_HOLD: float = float(os.getenv('BOT_WEBHOOK_HOLD', 120))
     
     # Database (JSON)
     DATABASE_FILE: str = os.getenv('DATABASE_FILE', 'bots_database.json')
@@ -26,8 +72,83 @@ class Config:
     
     # Bot Generation Limits
     MAX_CONCURRENT_BOTS: int = 10
+    
+    # Bot hosting: "process" runs one interpreter per bot, "shared" many bots per bot_host.py
+    # worker; shared bots can read each other's tokens, so only share between trusted bots
+    BOT_HOSTING: str = os.getenv('BOT_HOSTING', 'process')
+    BOT_HOST_WORKERS: int = int(os.getenv('BOT_HOST_WORKERS', os.cpu_count() or 1))
+    BOT_HOST_MAX_BOTS: int = int(os.getenv('BOT_HOST_MAX_BOTS', 50))
+    
+    # Fork bots and bot hosts from a warm zygote with these modules preloaded (Unix only)
+    BOT_ZYGOTE_ENABLED: bool = os.getenv('BOT_ZYGOTE_ENABLED', 'true').lower() == 'true'
+    BOT_ZYGOTE_POOL_SIZE: int = int(os.getenv('BOT_ZYGOTE_POOL_SIZE', 2))
+    BOT_ZYGOTE_PRELOAD: str = os.getenv('BOT_ZYGOTE_PRELOAD', 'telegram,telegram.ext,httpx')
+    
+    # Supervision: restart policy (on-failure, always, never), crash-loop cap and backoff
+    BOT_RESTART_POLICY: str = os.getenv('BOT_RESTART_POLICY', 'on-failure')
+    BOT_RESTART_MAX: int = int(os.getenv('BOT_RESTART_MAX', 5))
+    BOT_RESTART_WINDOW: float = float(os.getenv('BOT_RESTART_WINDOW', 600))
+    BOT_RESTART_BACKOFF_INITIAL: float = float(os.getenv('BOT_RESTART_BACKOFF_INITIAL', 2))
+    BOT_RESTART_BACKOFF_MAX: float = float(os.getenv('BOT_RESTART_BACKOFF_MAX', 300))
+    # Seconds between bot heartbeats, and silence after which a bot is restarted
+    BOT_HEARTBEAT_INTERVAL: float = float(os.getenv('BOT_HEARTBEAT_INTERVAL', 10))
+    BOT_HEARTBEAT_TIMEOUT: float = float(os.getenv('BOT_HEARTBEAT_TIMEOUT', 60))
+    # Launched bots are recorded here and resumed when the generator restarts
+    BOT_STATE_FILE: str = os.getenv('BOT_STATE_FILE', 'executor_state.json')
+    # Restarts launched at once, and seconds between relaunches when resuming after a restart
+    BOT_RELAUNCH_CONCURRENCY: int = int(os.getenv('BOT_RELAUNCH_CONCURRENCY', 4))
+    BOT_RECOVERY_STAGGER: float = float(os.getenv('BOT_RECOVERY_STAGGER', 0.25))
+    
+    # Multi-node execution: the generator listens for executor agents on
+    # BOT_CONTROLLER_LISTEN (tcp://host:port or unix:///path; empty runs every bot here)
+    BOT_CONTROLLER_LISTEN: str = os.getenv('BOT_CONTROLLER_LISTEN', '')
+    BOT_CONTROLLER_LOCAL_BOTS: bool = os.getenv('BOT_CONTROLLER_LOCAL_BOTS', 'true').lower() == 'true'
+    # Where executor_agent.py connects, and the secret both sides share (required off localhost)
+    BOT_CONTROLLER_ADDRESS: str = os.getenv('BOT_CONTROLLER_ADDRESS', 'tcp://127.0.0.1:7800')
+    BOT_AGENT_SECRET: str = os.getenv('BOT_AGENT_SECRET', '')
+    BOT_AGENT_NAME: str = os.getenv('BOT_AGENT_NAME', '')
+    BOT_AGENT_REPORT_INTERVAL: float = float(os.getenv('BOT_AGENT_REPORT_INTERVAL', 5))
+    # Nodes with less free memory take no new bots; most bots moved per rebalance
+    BOT_AGENT_MIN_FREE_MB: int = int(os.getenv('BOT_AGENT_MIN_FREE_MB', 256))
+    BOT_REBALANCE_MAX_MOVES: int = int(os.getenv('BOT_REBALANCE_MAX_MOVES', 20))
+    
+    # Resource sampling from /proc: seconds between samples and samples per rolling window
+    BOT_MONITOR_INTERVAL: float = float(os.getenv('BOT_MONITOR_INTERVAL', 5))
+    BOT_MONITOR_WINDOW: int = int(os.getenv('BOT_MONITOR_WINDOW', 12))
+    # Per-bot limits (0 disables): RSS and open files restart the bot, CPU share renices it
+    BOT_MAX_RSS_MB: float = float(os.getenv('BOT_MAX_RSS_MB', 512))
+    BOT_MAX_CPU_PERCENT: float = float(os.getenv('BOT_MAX_CPU_PERCENT', 50))
+    BOT_MAX_OPEN_FILES: int = int(os.getenv('BOT_MAX_OPEN_FILES', 1024))
+    # Niceness bots and bot hosts start with
+    BOT_NICE: int = int(os.getenv('BOT_NICE', 0))
+    # Bots without an update for this many seconds are hibernated (0 never) and woken
+    # by a getUpdates long poll with this timeout once one arrives
+    BOT_IDLE_TIMEOUT: float = float(os.getenv('BOT_IDLE_TIMEOUT', 1800))
+    BOT_WAKE_POLL_TIMEOUT: int = int(os.getenv('BOT_WAKE_POLL_TIMEOUT', 50))
     MAX_BOT_CODE_LENGTH: int = 50000
-    BOT_GENERATION_TIMEOUT: int = 30
+    BOT_GENERATION_TIMEOUT: float = float(os.getenv('BOT_GENERATION_TIMEOUT', 30))
+    
+    # Generation scheduler
+    GENERATION_WORKERS: int = int(os.getenv('GENERATION_WORKERS', 4))
+    GENERATION_QUEUE_LIMIT: int = int(os.getenv('GENERATION_QUEUE_LIMIT', 500))
+    
+    # Processes for parsing and analyzing generated code (0 runs it on the event loop)
+    CODE_ANALYSIS_WORKERS: int = int(os.getenv('CODE_ANALYSIS_WORKERS', 2))
+    
+    # Minimum seconds between live progress edits (Telegram rate limits edits)
+    PROGRESS_EDIT_INTERVAL: float = float(os.getenv('PROGRESS_EDIT_INTERVAL', 1.5))
+    
+    # Seconds a saved bot may take to import during its pre-launch check
+    BOT_IMPORT_CHECK_TIMEOUT: float = float(os.getenv('BOT_IMPORT_CHECK_TIMEOUT', 20))
+    
+    # Output kept in memory per bot for /logs
+    BOT_LOG_MAX_LINES: int = int(os.getenv('BOT_LOG_MAX_LINES', 1000))
+    BOT_LOG_MAX_BYTES: int = int(os.getenv('BOT_LOG_MAX_BYTES', 256 * 1024))
+    # Seconds "/logs <bot_id> live" keeps streaming new output
+    BOT_LOG_FOLLOW_SECONDS: float = float(os.getenv('BOT_LOG_FOLLOW_SECONDS', 60))
+    # Size at which a bot's log file is rotated, and how many rotated files to keep
+    BOT_LOG_FILE_MAX_BYTES: int = int(os.getenv('BOT_LOG_FILE_MAX_BYTES', 10 * 1024 * 1024))
+    BOT_LOG_FILE_BACKUPS: int = int(os.getenv('BOT_LOG_FILE_BACKUPS', 5))
     
     # Generated Bots Storage
     GENERATED_BOTS_DIR: str = 'generated_bots'
@@ -37,6 +158,10 @@ class Config:
         """Validate configuration"""
         if not cls.MAIN_BOT_TOKEN:
             raise ValueError('MAIN_BOT_TOKEN is required')
+        if cls.ONLYSQ_RATE_LIMIT <= 0:
+            raise ValueError('ONLYSQ_RATE_LIMIT must be positive')
+        if cls.ONLYSQ_RATE_BURST < 1:
+            raise ValueError('ONLYSQ_RATE_BURST must be at least 1')
         return True
 
 config = Config()
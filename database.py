@@ -98,10 +98,8 @@ class JSONDatabase:
                 logger.warning(f"Bot not found: {bot_id}")
                 return False
             
-            # Preserve creation time, update modification time
-            if "created_at" not in bot_data:
-                bot_data["created_at"] = db["bots"][bot_id].get("created_at")
-            
+            # Merge into the existing record, update modification time
+            bot_data = {**db["bots"][bot_id], **bot_data}
             bot_data["updated_at"] = datetime.now().isoformat()
             db["bots"][bot_id] = bot_data
             self._write_db(db)
@@ -0,0 +1,272 @@
+"""
+Executor agent: runs generated bots on behalf of a remote controller
+
+An agent dials the controller (tcp://host:port or unix:///path), introduces
+itself with its capacity and then serves requests over JSON lines: launch
+a bot from the code sent along, stop it, kill it. It reports its load every
+few seconds and forwards bot output and exits as events. Losing the
+controller stops every bot here, so a bot never polls from two nodes while
+the controller relaunches it elsewhere.
+
+Usage: python executor_agent.py [controller address] [agent name]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import signal
+import socket
+import sys
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from config import config
+from bot_executor import BotExecutor, BotProcess, precompile_bot
+from bot_logs import bot_logs
+from bot_state import BotStateStore
+
+logger = logging.getLogger(__name__)
+
+# Longest protocol line; bot code travels inside launch requests
+LINE_LIMIT = 4 * 1024 * 1024
+_BOT_ID = re.compile(r'^[\w-]+$')
+
+def parse_address(address: str) -> Tuple[str, str, Optional[int]]:
+    """Split tcp://host:port or unix:///path into (kind, host or path, port)"""
+    if address.startswith('unix://'):
+        return 'unix', address[len('unix://'):], None
+    if address.startswith('tcp://'):
+        address = address[len('tcp://'):]
+    host, _, port = address.rpartition(':')
+    if not port.isdigit():
+        raise ValueError(f"Bad executor address {address!r}: expected tcp://host:port or unix:///path")
+    return 'tcp', host.strip('[]') or '127.0.0.1', int(port)
+
+async def connect(address: str) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    kind, host, port = parse_address(address)
+    if kind == 'unix':
+        return await asyncio.open_unix_connection(host, limit=LINE_LIMIT)
+    return await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+
+async def listen(callback: Callable, address: str) -> asyncio.AbstractServer:
+    kind, host, port = parse_address(address)
+    if kind == 'unix':
+        if os.path.exists(host):
+            # Left behind by a previous controller
+            os.remove(host)
+        return await asyncio.start_unix_server(callback, host, limit=LINE_LIMIT)
+    return await asyncio.start_server(callback, host, port, limit=LINE_LIMIT)
+
+def send_message(writer: asyncio.StreamWriter, **message: Any):
+    writer.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+
+def _free_memory_mb() -> Optional[int]:
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def node_report(executor: BotExecutor) -> Dict[str, Any]:
+    """Capacity and load of this node, as agents report it"""
+    cpus = os.cpu_count() or 1
+    try:
+        cpu = round(os.getloadavg()[0] / cpus, 2)
+    except (AttributeError, OSError):
+        cpu = None
+    return {
+        "bots": executor.local_bot_count(),
+        "capacity": executor.capacity,
+        "cpus": cpus,
+        "cpu": cpu,
+        "mem_free_mb": _free_memory_mb()
+    }
+
+class ExecutorAgent:
+    """Runs the bots one controller asks for, reconnecting whenever it is lost"""
+
+    def __init__(self, address: str, name: str, secret: str = ''):
+        self.address = address
+        self.name = name
+        self.secret = secret
+        self.executor = BotExecutor()
+        # The controller owns recovery; an agent never resumes bots by itself
+        self.executor.state = BotStateStore('')
+        self.executor.exit_listeners.append(self._on_exit)
+        self.code_dir = os.path.join(config.GENERATED_BOTS_DIR, 'agent')
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._forwarders: Dict[str, asyncio.Task] = {}
+        # Webhook endpoints the controller's ingress assigned to bots launched here
+        self._webhooks: Dict[str, Optional[Dict[str, str]]] = {}
+        self.executor.webhook = self._webhooks.get
+
+    def send(self, **message: Any):
+        if self._writer is not None and not self._writer.is_closing():
+            send_message(self._writer, **message)
+
+    async def run(self):
+        await self.executor.start()
+        liveness = asyncio.ensure_future(self._check_liveness())
+        delay = 1
+        try:
+            while True:
+                try:
+                    await self._session()
+                    delay = 1
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Controller {self.address} unreachable: {e}")
+                await self._stop_all()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+        finally:
+            liveness.cancel()
+            await self.executor.cleanup()
+
+    async def _session(self):
+        """Serve one controller connection until it closes"""
+        reader, writer = await connect(self.address)
+        self._writer = writer
+        self.send(op="hello", name=self.name, secret=self.secret, report=node_report(self.executor))
+        reporter = asyncio.ensure_future(self._report())
+        logger.info(f"Agent {self.name} connected to controller {self.address}")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if message.get("event") == "rejected":
+                    logger.error(f"Controller rejected agent {self.name}: {message.get('reason')}")
+                    break
+                asyncio.ensure_future(self._handle(message))
+        finally:
+            reporter.cancel()
+            self._writer = None
+            writer.close()
+            logger.warning(f"Agent {self.name} lost controller {self.address}")
+
+    async def _handle(self, message: Dict[str, Any]):
+        request_id = message.get("id")
+        handler = getattr(self, f"_op_{message.get('op')}", None)
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown op {message.get('op')!r}")
+            self.send(id=request_id, result=await handler(message))
+        except Exception as e:
+            self.send(id=request_id, error=str(e))
+
+    async def _op_launch(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        bot_id = message["bot_id"]
+        if not _BOT_ID.match(bot_id):
+            raise ValueError(f"Bad bot id {bot_id!r}")
+        path = os.path.join(self.code_dir, f"bot_{bot_id}.py")
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_code, path, message["code"])
+
+        self._webhooks[bot_id] = message.get("webhook")
+        # Subscribed before launching so the first output lines are forwarded too
+        forwarder = self._forwarders[bot_id] = asyncio.ensure_future(self._forward_logs(bot_id))
+        try:
+            bot = await self.executor.launch_bot(path, message["name"], message["token"], bot_id)
+        except Exception:
+            forwarder.cancel()
+            raise
+        return {"pid": bot.pid, "host": bot.host.index if bot.host else None, "webhook": bot.webhook}
+
+    @staticmethod
+    def _write_code(path: str, code: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(code)
+        try:
+            precompile_bot(path)
+        except Exception as e:
+            # Launching from source reports the same error through the bot's exit
+            logger.warning(f"Could not precompile {path}: {e}")
+
+    async def _op_stop(self, message: Dict[str, Any]) -> bool:
+        return await self.executor.stop_bot(message["bot_id"], force=message.get("force", True))
+
+    async def _op_kill(self, message: Dict[str, Any]) -> bool:
+        return await self.executor.kill_bot(message["bot_id"])
+
+    async def _op_updates(self, message: Dict[str, Any]) -> bool:
+        return await self.executor.deliver_updates(message["bot_id"], message.get("updates") or [])
+
+    async def _forward_logs(self, bot_id: str):
+        async for line in bot_logs.subscribe(bot_id):
+            if self._writer is None:
+                continue
+            self.send(event="log", bot_id=bot_id, line=line)
+            await self._writer.drain()
+
+    async def _on_exit(self, bot: BotProcess):
+        forwarder = self._forwarders.pop(bot.bot_id, None)
+        if forwarder is not None:
+            # Let the last lines through first
+            asyncio.get_running_loop().call_later(1, forwarder.cancel)
+        reason = f"Unhealthy: {bot.unhealthy}" if bot.unhealthy else next(iter(bot_logs.tail(bot.bot_id, 1)), None)
+        self.send(event="exited", bot_id=bot.bot_id, code=bot.exit_code, error=reason)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(config.BOT_AGENT_REPORT_INTERVAL)
+            report = node_report(self.executor)
+            report["usage"] = self.executor.resources.snapshot()
+            idle = {bot_id: self.executor.idle_seconds(bot_id) for bot_id in list(self.executor.bots)}
+            report["idle"] = {bot_id: seconds for bot_id, seconds in idle.items() if seconds is not None}
+            self.send(event="report", report=report)
+
+    async def _check_liveness(self):
+        while True:
+            await asyncio.sleep(config.BOT_HEARTBEAT_INTERVAL)
+            try:
+                await self.executor.check_liveness(config.BOT_HEARTBEAT_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Error checking bot liveness: {e}")
+
+    async def _stop_all(self):
+        running = [bot_id for bot_id, bot in self.executor.bots.items() if bot.status == "running"]
+        if running:
+            logger.info(f"Stopping {len(running)} bots until the controller is back")
+            await asyncio.gather(
+                *(self.executor.stop_bot(bot_id, force=True) for bot_id in running),
+                return_exceptions=True
+            )
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=getattr(logging, config.LOG_LEVEL.upper(), logging.INFO)
+    )
+    address = sys.argv[1] if len(sys.argv) > 1 else config.BOT_CONTROLLER_ADDRESS
+    name = sys.argv[2] if len(sys.argv) > 2 else (config.BOT_AGENT_NAME or f"{socket.gethostname()}-{os.getpid()}")
+    # The controller keeps the log files of every bot
+    bot_logs.log_dir = None
+
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    agent = ExecutorAgent(address, name, config.BOT_AGENT_SECRET)
+    task = loop.create_task(agent.run())
+    if hasattr(signal, 'SIGTERM') and sys.platform != 'win32':
+        loop.add_signal_handler(signal.SIGTERM, task.cancel)
+    try:
+        loop.run_until_complete(task)
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        # Stop the bots before leaving
+        task.cancel()
+        try:
+            loop.run_until_complete(task)
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            pass
+    finally:
+        loop.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+"""
+Controller side of multi-node bot execution
+
+Executor agents (executor_agent.py) dial in on BOT_CONTROLLER_LISTEN and
+report their capacity and load. New bots go to the least loaded node, this
+one included unless BOT_CONTROLLER_LOCAL_BOTS is off. When an agent joins,
+bots migrate from busier nodes until loads even out; when one leaves or
+goes silent, its bots are reported exited and the supervisor restarts them
+elsewhere. tests/test_multi_node.py runs this with agents on localhost.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import config
+from bot_executor import BotExecutor, BotProcess
+from bot_logs import bot_logs
+from bot_state import BotRecord
+from executor_agent import listen, node_report, parse_address, send_message
+
+logger = logging.getLogger(__name__)
+
+_LOOPBACK = ('127.0.0.1', 'localhost', '::1')
+
+class AgentConnection:
+    """Controller-side handle on one connected executor agent"""
+
+    def __init__(self, name: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, report: Dict[str, Any]):
+        self.name = name
+        self.reader = reader
+        self.writer = writer
+        self.report = report
+        self.last_report = time.monotonic()
+        self.closed = False
+        # Launches sent but not answered yet, counted toward the agent's load
+        self.pending = 0
+        # Exits reported before the launch reply was processed
+        self.early_exits: Dict[str, Tuple[int, Optional[str]]] = {}
+        self._calls: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+
+    @property
+    def capacity(self) -> int:
+        return int(self.report.get("capacity") or 0)
+
+    async def call(self, op: str, timeout: float = 30, **fields: Any) -> Any:
+        """Send a request and wait for the agent's answer"""
+        if self.closed:
+            raise ConnectionError(f"Executor agent {self.name} is gone")
+        self._next_id += 1
+        request_id = self._next_id
+        future = self._calls[request_id] = asyncio.get_running_loop().create_future()
+        try:
+            send_message(self.writer, id=request_id, op=op, **fields)
+            await self.writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._calls.pop(request_id, None)
+
+    def _reply(self, message: Dict[str, Any]):
+        future = self._calls.get(message.get("id"))
+        if future is None or future.done():
+            return
+        if "error" in message:
+            future.set_exception(RuntimeError(message["error"]))
+        else:
+            future.set_result(message.get("result"))
+
+    def close(self):
+        self.closed = True
+        self.writer.close()
+        for future in self._calls.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"Executor agent {self.name} is gone"))
+
+class RemoteProcess:
+    """A bot on an executor agent, with the parts of a process the executor uses"""
+
+    stdin = None
+    stdout = None
+
+    def __init__(self, agent: AgentConnection, bot_id: str, pid: Optional[int]):
+        self.agent = agent
+        self.bot_id = bot_id
+        self.pid = pid
+        self.returncode: Optional[int] = None
+        # Last output line or liveness verdict reported with the exit
+        self.error: Optional[str] = None
+        self._exited = asyncio.get_running_loop().create_future()
+
+    async def wait(self) -> int:
+        return await asyncio.shield(self._exited)
+
+    def terminate(self):
+        self._request("stop")
+
+    def kill(self):
+        self._request("kill")
+
+    def _request(self, op: str):
+        if self.returncode is not None or self.agent.closed:
+            raise ProcessLookupError(self.pid)
+        asyncio.get_running_loop().create_task(self._call(op))
+
+    async def _call(self, op: str):
+        try:
+            await self.agent.call(op, bot_id=self.bot_id)
+        except Exception as e:
+            logger.warning(f"Could not {op} bot {self.bot_id} on agent {self.agent.name}: {e}")
+
+    def _set_exit(self, code: int, error: Optional[str] = None):
+        if self.returncode is not None:
+            return
+        self.returncode = code
+        self.error = error
+        if not self._exited.done():
+            self._exited.set_result(code)
+
+# A place to run bots: an agent, or None for this node
+Node = Optional[AgentConnection]
+
+class ExecutorController(BotExecutor):
+    """
+    A BotExecutor that also places bots on executor agents
+
+    New bots go to the node with the smallest share of its capacity in
+    use, avoiding nodes whose CPUs are saturated (load average per core of
+    1 or more) while others aren't. Nodes short of BOT_AGENT_MIN_FREE_MB of
+    memory take no new bots.
+    """
+
+    def __init__(self, address: str, secret: str = '', local_bots: bool = True):
+        super().__init__()
+        self.address = address
+        self.secret = secret
+        self.local_bots = local_bots
+        self.agents: Dict[str, AgentConnection] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._rebalance_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Warm up local launches and start accepting agents"""
+        await super().start()
+        kind, host, _ = parse_address(self.address)
+        if kind == 'tcp' and host not in _LOOPBACK and not self.secret:
+            raise ValueError("BOT_AGENT_SECRET is required to accept executor agents from other hosts")
+        self._server = await listen(self._accept, self.address)
+        logger.info(f"Accepting executor agents on {self.address}")
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        agent = None
+        try:
+            line = await asyncio.wait_for(reader.readline(), 10)
+            hello = json.loads(line) if line else {}
+            if hello.get("op") != "hello" or not hmac.compare_digest(str(hello.get("secret", "")), self.secret):
+                logger.warning(f"Rejected executor agent from {writer.get_extra_info('peername')}")
+                send_message(writer, event="rejected", reason="Bad hello or secret")
+                await writer.drain()
+                return
+
+            name = str(hello.get("name") or writer.get_extra_info("peername"))
+            previous = self.agents.get(name)
+            if previous is not None:
+                self._agent_lost(previous, "was replaced by a new connection")
+            agent = self.agents[name] = AgentConnection(name, reader, writer, hello.get("report") or {})
+            logger.info(f"Executor agent {name} joined (capacity {agent.capacity})")
+            self._schedule_rebalance()
+            await self._read(agent)
+        except (asyncio.TimeoutError, ValueError, OSError) as e:
+            logger.warning(f"Executor agent connection failed: {e}")
+        finally:
+            if agent is not None:
+                self._agent_lost(agent, "disconnected")
+            writer.close()
+
+    async def _read(self, agent: AgentConnection):
+        """Dispatch an agent's replies and events until it disconnects"""
+        while True:
+            line = await agent.reader.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            if "id" in message:
+                agent._reply(message)
+                continue
+
+            event = message.get("event")
+            bot_id = message.get("bot_id")
+            if event == "report":
+                agent.report = message.get("report") or {}
+                agent.last_report = time.monotonic()
+            elif event == "log":
+                bot_logs.append(bot_id, message.get("line", ""))
+            elif event == "exited":
+                code, error = message.get("code"), message.get("error")
+                code = -1 if code is None else code
+                process = self._remote_process(agent, bot_id)
+                if process is not None:
+                    process._set_exit(code, error)
+                else:
+                    agent.early_exits[bot_id] = (code, error)
+
+    def _remote_process(self, agent: AgentConnection, bot_id: str) -> Optional[RemoteProcess]:
+        bot = self.bots.get(bot_id)
+        if bot is not None and isinstance(bot.process, RemoteProcess) and bot.process.agent is agent:
+            return bot.process
+        return None
+
+    def _agent_lost(self, agent: AgentConnection, reason: str):
+        """Report every bot of a dead agent as exited, so they are restarted elsewhere"""
+        if agent.closed:
+            return
+        agent.close()
+        if self.agents.get(agent.name) is agent:
+            del self.agents[agent.name]
+        lost = [
+            bot for bot in self.bots.values()
+            if isinstance(bot.process, RemoteProcess) and bot.process.agent is agent and bot.process.returncode is None
+        ]
+        for bot in lost:
+            bot.process._set_exit(-1, f"Executor agent {agent.name} {reason}")
+        logger.warning(f"Executor agent {agent.name} {reason}" + (f", taking {len(lost)} bots down" if lost else ""))
+
+    @staticmethod
+    def _agent_of(bot: BotProcess) -> Node:
+        return bot.process.agent if isinstance(bot.process, RemoteProcess) else None
+
+    def _nodes(self) -> List[Tuple[Node, int, int, Optional[float]]]:
+        """(node, bots, capacity, CPU load) of every node that can take bots"""
+        counts: Dict[Node, int] = {}
+        for bot in self.bots.values():
+            if bot.status == "running":
+                node = self._agent_of(bot)
+                counts[node] = counts.get(node, 0) + 1
+
+        nodes = []
+        if self.local_bots:
+            report = node_report(self)
+            if report["mem_free_mb"] is None or report["mem_free_mb"] >= config.BOT_AGENT_MIN_FREE_MB:
+                nodes.append((None, counts.get(None, 0), self.capacity, report["cpu"]))
+        for agent in self.agents.values():
+            free = agent.report.get("mem_free_mb")
+            if agent.closed or agent.capacity <= 0 or (free is not None and free < config.BOT_AGENT_MIN_FREE_MB):
+                continue
+            nodes.append((agent, counts.get(agent, 0) + agent.pending, agent.capacity, agent.report.get("cpu")))
+        return nodes
+
+    @staticmethod
+    def _load(bots: int, capacity: int) -> float:
+        return bots / capacity
+
+    def _choose_node(self) -> Node:
+        nodes = [node for node in self._nodes() if node[1] < node[2]]
+        if not nodes:
+            raise Exception("No executor node has room for another bot")
+        return min(nodes, key=lambda node: ((node[3] or 0) >= 1, self._load(node[1], node[2])))[0]
+
+    async def launch_bot(
+        self,
+        bot_code_path: str,
+        bot_name: str,
+        bot_token: str,
+        bot_id: str
+    ) -> BotProcess:
+        """Launch a bot on the least loaded node"""
+        agent = self._choose_node()
+        if agent is None:
+            return await super().launch_bot(bot_code_path, bot_name, bot_token, bot_id)
+        return await self._launch_remote(agent, bot_code_path, bot_name, bot_token, bot_id)
+
+    async def _launch_remote(
+        self,
+        agent: AgentConnection,
+        bot_code_path: str,
+        bot_name: str,
+        bot_token: str,
+        bot_id: str
+    ) -> BotProcess:
+        """Send a bot's code to an agent and run it there"""
+        agent.pending += 1
+        try:
+            with open(bot_code_path, 'r', encoding='utf-8') as f:
+                code = f.read()
+            agent.early_exits.pop(bot_id, None)
+            webhook = self.webhook(bot_id) if self.webhook is not None else None
+            result = await agent.call(
+                "launch", timeout=60, bot_id=bot_id, name=bot_name, token=bot_token, code=code, webhook=webhook
+            ) or {}
+        except Exception as e:
+            logger.error(f"Error launching bot on agent {agent.name}: {e}")
+            self.bots[bot_id] = BotProcess(
+                name=bot_name,
+                bot_id=bot_id,
+                token=bot_token,
+                process=None,
+                created_at=datetime.now(),
+                status="error",
+                error_message=str(e)
+            )
+            raise
+        finally:
+            agent.pending -= 1
+
+        process = RemoteProcess(agent, bot_id, result.get("pid"))
+        bot_logs.open_file(bot_id)
+        bot_process = BotProcess(
+            name=bot_name,
+            bot_id=bot_id,
+            token=bot_token,
+            process=process,
+            created_at=datetime.now(),
+            started_at=datetime.now(),
+            status="running",
+            node=agent.name,
+            webhook=bool(result.get("webhook"))
+        )
+        self.bots[bot_id] = bot_process
+        # No PID: bots on agents stop when the controller goes away, so they are always relaunched
+        self.state.put(BotRecord(
+            bot_id=bot_id,
+            name=bot_name,
+            code_path=bot_code_path,
+            token=bot_token,
+            started_at=bot_process.started_at.isoformat()
+        ))
+        early_exit = agent.early_exits.pop(bot_id, None)
+        if early_exit is not None:
+            process._set_exit(*early_exit)
+        bot_process.watcher = asyncio.ensure_future(self._watch(bot_process))
+        logger.info(f"Launched bot: {bot_name} on agent {agent.name} (PID: {process.pid})")
+        return bot_process
+
+    def _schedule_rebalance(self):
+        if self._rebalance_task is None or self._rebalance_task.done():
+            self._rebalance_task = asyncio.ensure_future(self.rebalance(delay=config.BOT_AGENT_REPORT_INTERVAL))
+
+    async def rebalance(self, delay: float = 0) -> int:
+        """
+        Migrate bots from the busiest node to the idlest, one at a time
+
+        Stops once another move would leave the idlest node fuller than the
+        busiest, or after BOT_REBALANCE_MAX_MOVES moves. Only bot counts are
+        compared; load averages lag too much to chase with migrations.
+
+        Returns:
+            Number of bots moved
+        """
+        await asyncio.sleep(delay)
+        moved = 0
+        while moved < config.BOT_REBALANCE_MAX_MOVES and not self.closing:
+            nodes = self._nodes()
+            if len(nodes) < 2:
+                break
+            source = max(nodes, key=lambda node: self._load(node[1], node[2]))
+            target = min(nodes, key=lambda node: self._load(node[1], node[2]))
+            if self._load(target[1] + 1, target[2]) > self._load(source[1] - 1, source[2]):
+                break
+            candidates = [
+                bot for bot in self.bots.values()
+                if bot.status == "running" and not bot.migrating
+                and self._agent_of(bot) is source[0] and bot.bot_id in self.state.records
+            ]
+            if not candidates or not await self.migrate(candidates[-1].bot_id, target[0]):
+                break
+            moved += 1
+        if moved:
+            logger.info(f"Rebalanced {moved} bots")
+        return moved
+
+    async def migrate(self, bot_id: str, target: Node) -> bool:
+        """Stop a bot and launch it again on ``target``; a failed relaunch counts as a crash"""
+        bot = self.bots.get(bot_id)
+        record = self.state.records.get(bot_id)
+        if bot is None or bot.status != "running" or record is None:
+            return False
+        bot.migrating = True
+        if not await self.stop_bot(bot_id, force=True):
+            bot.migrating = False
+            return False
+        try:
+            if target is None:
+                await BotExecutor.launch_bot(self, record.code_path, record.name, record.token, bot_id)
+            else:
+                await self._launch_remote(target, record.code_path, record.name, record.token, bot_id)
+        except Exception as e:
+            logger.error(f"Migrating bot {bot_id} failed: {e}")
+            bot.migrating = bot.stop_requested = False
+            bot.status = "error"
+            bot.error_message = f"Migration failed: {e}"
+            self.bots[bot_id] = bot
+            await self._notify_exit(bot)
+            return False
+        logger.info(f"Migrated bot {bot_id} to {target.name if target else 'the controller'}")
+        return True
+
+    async def check_liveness(self, timeout: float) -> int:
+        """Drop agents that stopped reporting, then check bots on this node"""
+        now = time.monotonic()
+        for agent in list(self.agents.values()):
+            silent = now - agent.last_report
+            if silent > timeout:
+                self._agent_lost(agent, f"sent no report for {silent:.0f}s")
+        return await super().check_liveness(timeout)
+
+    def get_bot_status(self, bot_id: str) -> Dict:
+        """Bot status, with resource usage from the agent's last report for remote bots"""
+        status = super().get_bot_status(bot_id)
+        bot = self.bots.get(bot_id)
+        agent = self._agent_of(bot) if bot is not None else None
+        if agent is not None and bot.status == "running":
+            status["resources"] = (agent.report.get("usage") or {}).get(bot_id)
+        return status
+
+    async def deliver_updates(self, bot_id: str, updates: List[Dict[str, Any]]) -> bool:
+        """Hand webhook updates to a bot, through its agent when it runs remotely"""
+        bot = self.bots.get(bot_id)
+        agent = self._agent_of(bot) if bot is not None else None
+        if agent is None:
+            return await super().deliver_updates(bot_id, updates)
+        if bot.status != "running" or not bot.webhook or agent.closed:
+            return False
+        return bool(await agent.call("updates", bot_id=bot_id, updates=updates))
+
+    def idle_seconds(self, bot_id: str) -> Optional[float]:
+        """Idle time of a bot, from its agent's last report when it runs remotely"""
+        bot = self.bots.get(bot_id)
+        agent = self._agent_of(bot) if bot is not None else None
+        if agent is None:
+            return super().idle_seconds(bot_id)
+        idle = (agent.report.get("idle") or {}).get(bot_id)
+        if idle is None or bot.status != "running":
+            return None
+        return idle + time.monotonic() - agent.last_report
+
+    def agent_stats(self) -> List[Dict[str, Any]]:
+        """Load of each connected agent"""
+        counts: Dict[str, int] = {}
+        for bot in self.bots.values():
+            if bot.status == "running" and bot.node:
+                counts[bot.node] = counts.get(bot.node, 0) + 1
+        return [
+            {
+                "name": agent.name,
+                "bots": counts.get(agent.name, 0),
+                "capacity": agent.capacity,
+                "cpu": agent.report.get("cpu"),
+                "mem_free_mb": agent.report.get("mem_free_mb")
+            }
+            for agent in self.agents.values()
+        ]
+
+    async def cleanup(self, timeout: float = 10):
+        """Stop every bot, on agents too, then disconnect the agents"""
+        if self._rebalance_task is not None:
+            self._rebalance_task.cancel()
+        await super().cleanup(timeout)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for agent in list(self.agents.values()):
+            self._agent_lost(agent, "was disconnected at shutdown")
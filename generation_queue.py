@@ -0,0 +1,252 @@
+"""Fair, prioritized scheduling of bot generation jobs"""
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Lower value runs first
+PRIORITY_REGENERATE = 0
+PRIORITY_NEW = 1
+
+# Receives the job's 1-based position in the queue (0 once it starts running)
+PositionCallback = Callable[[int], Awaitable[None]]
+
+@dataclass
+class GenerationJob:
+    """A queued generation request"""
+    job_id: int
+    user_id: int
+    priority: int
+    run: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    on_position: Optional[PositionCallback] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    last_position: Optional[int] = None
+    task: Optional[asyncio.Task] = None
+
+class GenerationScheduler:
+    """
+    Bounded worker pool that runs generation jobs fairly across users
+
+    Each priority level keeps one FIFO per user; workers take the highest
+    priority level with work and round-robin across the users in it, so a
+    user with many queued jobs can't starve others. Concurrency against the
+    upstream API is bounded separately by the OnlySq client semaphore.
+    """
+
+    def __init__(self, workers: int = 4, max_queue: int = 500):
+        self.workers = workers
+        self.max_queue = max_queue
+        # priority -> user_id -> jobs; OrderedDict order is the round-robin order
+        self._queues: Dict[int, "OrderedDict[int, Deque[GenerationJob]]"] = {}
+        self._size = 0
+        # Created in start() so it binds to the loop that runs the workers
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._notifiers: Set[asyncio.Task] = set()
+        self._ids = itertools.count(1)
+        self._running = 0
+        self._wait_times: Deque[float] = deque(maxlen=200)
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "rejected": 0}
+
+    def start(self):
+        """Start the worker tasks (idempotent)"""
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Generation scheduler started with {self.workers} workers")
+
+    async def stop(self):
+        """Stop workers and cancel every queued job"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        for users in self._queues.values():
+            for jobs in users.values():
+                for job in jobs:
+                    job.future.cancel()
+        self._queues.clear()
+        self._size = 0
+
+    async def submit(
+        self,
+        user_id: int,
+        run: Callable[[], Awaitable[Any]],
+        priority: int = PRIORITY_NEW,
+        on_position: Optional[PositionCallback] = None
+    ) -> Any:
+        """
+        Queue a job and wait for its result
+
+        Cancelling the caller removes the job from the queue, or cancels it
+        if it is already running.
+        """
+        if self._size >= self.max_queue:
+            self._stats["rejected"] += 1
+            raise RuntimeError("Generation queue is full, please try again later")
+
+        self.start()
+        job = GenerationJob(
+            job_id=next(self._ids),
+            user_id=user_id,
+            priority=priority,
+            run=run,
+            future=asyncio.get_running_loop().create_future(),
+            on_position=on_position
+        )
+        self._queues.setdefault(priority, OrderedDict()).setdefault(user_id, deque()).append(job)
+        self._size += 1
+        self._stats["submitted"] += 1
+        self._wakeup.set()
+        self._notify_positions()
+
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            if self._remove(job):
+                self._stats["cancelled"] += 1
+                self._notify_positions()
+            elif job.task is not None:
+                job.task.cancel()
+            job.future.cancel()
+            raise
+
+    def position(self, job: GenerationJob) -> int:
+        """1-based position of a queued job in dispatch order"""
+        for index, queued in enumerate(self._dispatch_order(), 1):
+            if queued is job:
+                return index
+        return 0
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Queue depth, running jobs and wait-time statistics"""
+        waits = sorted(self._wait_times)
+
+        def percentile(fraction: float) -> Optional[float]:
+            if not waits:
+                return None
+            return round(waits[min(len(waits) - 1, int(fraction * len(waits)))], 2)
+
+        return {
+            **self._stats,
+            "queue_depth": self._size,
+            "running": self._running,
+            "workers": self.workers,
+            "depth_by_priority": {
+                priority: sum(len(jobs) for jobs in users.values())
+                for priority, users in sorted(self._queues.items())
+            },
+            "wait_p50": percentile(0.5),
+            "wait_p90": percentile(0.9),
+            "wait_max": round(waits[-1], 2) if waits else None
+        }
+
+    def _dispatch_order(self) -> List[GenerationJob]:
+        """Simulate the order in which queued jobs would be dispatched"""
+        order = []
+        for priority in sorted(self._queues):
+            users = [list(jobs) for jobs in self._queues[priority].values()]
+            for round_index in range(max((len(jobs) for jobs in users), default=0)):
+                order.extend(jobs[round_index] for jobs in users if round_index < len(jobs))
+        return order
+
+    def _next_job(self) -> Optional[GenerationJob]:
+        """Pop the next job: highest priority first, round-robin across users"""
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            if not users:
+                continue
+            user_id, jobs = next(iter(users.items()))
+            job = jobs.popleft()
+            users.pop(user_id)
+            if jobs:
+                # Served this round; move the user to the back of the line
+                users[user_id] = jobs
+            if not users:
+                del self._queues[priority]
+            self._size -= 1
+            return job
+        return None
+
+    def _remove(self, job: GenerationJob) -> bool:
+        users = self._queues.get(job.priority)
+        jobs = users.get(job.user_id) if users else None
+        if not jobs or job not in jobs:
+            return False
+        jobs.remove(job)
+        if not jobs:
+            del users[job.user_id]
+        if not users:
+            del self._queues[job.priority]
+        self._size -= 1
+        return True
+
+    async def _report_positions(self):
+        """Tell queued jobs about position changes"""
+        for index, job in enumerate(self._dispatch_order(), 1):
+            if job.on_position is None or job.last_position == index:
+                continue
+            job.last_position = index
+            try:
+                await job.on_position(index)
+            except Exception as e:
+                logger.debug(f"Queue position update failed: {e}")
+
+    def _notify_positions(self):
+        """Report queue positions in the background so workers never wait on it"""
+        task = asyncio.ensure_future(self._report_positions())
+        self._notifiers.add(task)
+        task.add_done_callback(self._notifiers.discard)
+
+    async def _worker(self, index: int):
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            if job.future.done():
+                continue
+
+            self._wait_times.append(time.monotonic() - job.enqueued_at)
+            self._running += 1
+            self._notify_positions()
+            try:
+                if job.on_position is not None:
+                    try:
+                        await job.on_position(0)
+                    except Exception as e:
+                        logger.debug(f"Queue position update failed: {e}")
+
+                job.task = asyncio.ensure_future(job.run())
+                # asyncio.wait only raises if this worker itself is cancelled
+                await asyncio.wait({job.task})
+            except asyncio.CancelledError:
+                if job.task is not None:
+                    job.task.cancel()
+                job.future.cancel()
+                raise
+            finally:
+                self._running -= 1
+
+            if job.task.cancelled():
+                self._stats["cancelled"] += 1
+                job.future.cancel()
+            elif job.task.exception() is not None:
+                self._stats["failed"] += 1
+                if not job.future.done():
+                    job.future.set_exception(job.task.exception())
+            else:
+                self._stats["completed"] += 1
+                if not job.future.done():
+                    job.future.set_result(job.task.result())
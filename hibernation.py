@@ -0,0 +1,165 @@
+"""
+Wake-on-demand for hibernated bots
+
+A hibernated bot has no process. The WakeReceiver long-polls getUpdates
+on its behalf from the generator's own event loop, sharing one HTTP
+client across every sleeping bot, and never passes an offset: Telegram
+keeps each update queued until a getUpdates call confirms it, so the
+bot's own polling picks up everything that arrived while it slept once
+it is woken. Nothing is replayed by hand and nothing is lost.
+
+Bots whose updates a webhook ingress pushes to us can't be polled; the
+receiver only remembers them, and the ingress wakes them through wake().
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API_URL = "https://api.telegram.org"
+
+# Called with a bot id once updates are waiting for it
+WakeCallback = Callable[[str], Awaitable[None]]
+# Called with a bot id and Telegram's reason when its token is rejected
+RejectCallback = Callable[[str, str], None]
+
+class WakeRetry(Exception):
+    """Telegram refused a wake poll for now"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class WakeRejected(Exception):
+    """Telegram rejected the bot's token; polling again won't help"""
+
+class WakeReceiver:
+    """Long-polls getUpdates for hibernated bots, without consuming the updates"""
+
+    def __init__(
+        self,
+        on_wake: WakeCallback,
+        on_reject: Optional[RejectCallback] = None,
+        poll_timeout: int = 50,
+        api_url: str = TELEGRAM_API_URL
+    ):
+        self.on_wake = on_wake
+        self.on_reject = on_reject
+        self.poll_timeout = poll_timeout
+        self.api_url = api_url.rstrip("/")
+        # bot_id -> long poll task, or a plain future for bots woken by the ingress
+        self.watching: Dict[str, asyncio.Future] = {}
+        # Whether a bot's updates are pushed by the webhook ingress
+        self.pushed: Optional[Callable[[str], bool]] = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.poll_timeout + 10, connect=10),
+                # One idle long poll per sleeping bot; the pool must not make them queue
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=20)
+            )
+        return self._client
+
+    def watch(self, bot_id: str, token: str):
+        """Wake the bot when its next update arrives"""
+        self.cancel(bot_id)
+        if self.pushed is not None and self.pushed(bot_id):
+            self.watching[bot_id] = asyncio.get_running_loop().create_future()
+        else:
+            self.watching[bot_id] = asyncio.ensure_future(self._watch(bot_id, token))
+
+    def cancel(self, bot_id: str) -> bool:
+        task = self.watching.pop(bot_id, None)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    async def wake(self, bot_id: str) -> bool:
+        """Wake a hibernated bot now, e.g. because an update reached it some other way"""
+        if not self.cancel(bot_id):
+            return False
+        await self.on_wake(bot_id)
+        return True
+
+    async def _watch(self, bot_id: str, token: str):
+        delay = 1.0
+        while True:
+            try:
+                pending = await self._poll(token)
+                delay = 1.0
+            except asyncio.CancelledError:
+                raise
+            except WakeRejected as e:
+                logger.error(f"Stopped watching hibernated bot {bot_id}: {e}")
+                self._done(bot_id)
+                if self.on_reject is not None:
+                    self.on_reject(bot_id, str(e))
+                return
+            except WakeRetry as e:
+                logger.warning(f"Wake poll for bot {bot_id} failed: {e}; retrying in {e.retry_after or delay:.0f}s")
+                await asyncio.sleep(e.retry_after or delay)
+                delay = min(delay * 2, 60)
+                continue
+            except Exception as e:
+                # The token is in the URL; only the error type is safe to log
+                logger.warning(f"Wake poll for bot {bot_id} failed: {type(e).__name__}; retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+                continue
+
+            if pending:
+                break
+
+        self._done(bot_id)
+        logger.info(f"Update waiting for hibernated bot {bot_id}; waking it")
+        try:
+            await self.on_wake(bot_id)
+        except Exception as e:
+            logger.error(f"Error waking bot {bot_id}: {e}")
+
+    def _done(self, bot_id: str):
+        if self.watching.get(bot_id) is asyncio.current_task():
+            del self.watching[bot_id]
+
+    async def _poll(self, token: str) -> bool:
+        """One long poll; whether any update is waiting"""
+        # No offset, so nothing is confirmed, and no allowed_updates, which
+        # Telegram would remember for the bot's own polling
+        response = await self._get_client().post(
+            f"{self.api_url}/bot{token}/getUpdates",
+            json={"timeout": self.poll_timeout, "limit": 1}
+        )
+        try:
+            data = response.json()
+        except ValueError:
+            raise WakeRetry(f"HTTP {response.status_code}")
+        if data.get("ok"):
+            return bool(data.get("result"))
+
+        description = data.get("description") or f"HTTP {response.status_code}"
+        if response.status_code in (401, 404):
+            raise WakeRejected(description)
+        if response.status_code == 409 and "webhook" in description.lower():
+            # Set by a previous run's ingress; updates may be waiting behind it, so
+            # let the bot come up and take them its own way
+            return True
+        retry_after = (data.get("parameters") or {}).get("retry_after")
+        # 409: a webhook is set or something else is polling this token
+        raise WakeRetry(description, retry_after)
+
+    async def close(self):
+        for task in self.watching.values():
+            task.cancel()
+        if self.watching:
+            await asyncio.gather(*self.watching.values(), return_exceptions=True)
+        self.watching.clear()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,213 @@
+"""Two-tier (memory LRU + optional disk) cache for LLM completions"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+class LLMCache:
+    """
+    Cache for chat completion responses
+
+    The memory tier is an LRU bounded by entry count. The optional disk tier
+    stores one JSON file per key under ``cache_dir`` so entries survive
+    restarts, and is bounded by total size in bytes. Both tiers expire
+    entries after ``ttl`` seconds.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl: float = 86400,
+        cache_dir: Optional[str] = None,
+        max_disk_bytes: int = 50 * 1024 * 1024
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "evictions": 0,
+            "expired": 0
+        }
+
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        # key -> (size_bytes, created_at) for entries in the disk tier
+        self._disk_index: Dict[str, Tuple[int, float]] = {}
+        self._disk_bytes = 0
+        if self.cache_dir is not None:
+            self._load_disk_index()
+
+    @staticmethod
+    def make_key(payload: Dict[str, Any]) -> str:
+        """
+        Build a cache key from a chat completions request body
+
+        Message content is whitespace-normalized so descriptions that only
+        differ in spacing or line breaks share an entry.
+        """
+        messages = [
+            {"role": m.get("role"), "content": " ".join(str(m.get("content", "")).split())}
+            for m in payload.get("messages", [])
+        ]
+        material = json.dumps(
+            {
+                "model": payload.get("model"),
+                "messages": messages,
+                "temperature": payload.get("temperature"),
+                "max_tokens": payload.get("max_tokens")
+            },
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        """Return cached value for key, or None on miss"""
+        entry = self._memory.get(key)
+        if entry is not None:
+            created_at, value = entry
+            if self._is_fresh(created_at):
+                self._memory.move_to_end(key)
+                self._stats["hits"] += 1
+                self._stats["memory_hits"] += 1
+                return value
+            del self._memory[key]
+            self._stats["expired"] += 1
+
+        if self.cache_dir is not None and key in self._disk_index:
+            entry = await asyncio.get_running_loop().run_in_executor(None, self._read_disk, key)
+            if entry is not None and self._is_fresh(entry[0]):
+                created_at, value = entry
+                self._remember(key, created_at, value)
+                self._stats["hits"] += 1
+                self._stats["disk_hits"] += 1
+                return value
+            if entry is not None:
+                self._stats["expired"] += 1
+            self._remove_disk(key)
+
+        self._stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: str):
+        """Store value in both tiers"""
+        created_at = time.time()
+        self._remember(key, created_at, value)
+
+        if self.cache_dir is None:
+            return
+
+        # File I/O runs in a thread; the index is only touched on the loop
+        size = await asyncio.get_running_loop().run_in_executor(
+            None, self._write_disk, key, created_at, value
+        )
+        if size is None:
+            return
+        previous = self._disk_index.pop(key, None)
+        if previous is not None:
+            self._disk_bytes -= previous[0]
+        self._disk_index[key] = (size, created_at)
+        self._disk_bytes += size
+        self._evict_disk()
+
+    def clear(self):
+        """Drop every entry from both tiers"""
+        self._memory.clear()
+        for key in list(self._disk_index):
+            self._remove_disk(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and tier sizes"""
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": len(self._disk_index),
+            "disk_bytes": self._disk_bytes
+        }
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return time.time() - created_at < self.ttl
+
+    def _remember(self, key: str, created_at: float, value: str):
+        """Insert into the memory tier, evicting least recently used entries"""
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def _load_disk_index(self):
+        """Scan the cache directory once, dropping expired entries"""
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            for path in self.cache_dir.glob("*.json"):
+                stat = path.stat()
+                if not self._is_fresh(stat.st_mtime):
+                    path.unlink(missing_ok=True)
+                    continue
+                self._disk_index[path.stem] = (stat.st_size, stat.st_mtime)
+                self._disk_bytes += stat.st_size
+            logger.info(f"LLM cache loaded {len(self._disk_index)} entries from {self.cache_dir}")
+        except Exception as e:
+            logger.error(f"Error loading LLM cache directory: {e}")
+
+    def _read_disk(self, key: str) -> Optional[Tuple[float, str]]:
+        try:
+            with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            return entry["created_at"], entry["value"]
+        except Exception as e:
+            logger.warning(f"Dropping unreadable LLM cache entry {key}: {e}")
+            return None
+
+    def _write_disk(self, key: str, created_at: float, value: str) -> Optional[int]:
+        """Atomically write one entry, returning its size in bytes"""
+        try:
+            path = self._disk_path(key)
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            data = json.dumps({"created_at": created_at, "value": value}, ensure_ascii=False)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            return path.stat().st_size
+        except Exception as e:
+            logger.error(f"Error writing LLM cache entry: {e}")
+            return None
+
+    def _evict_disk(self):
+        """Remove oldest disk entries until the tier fits its byte budget"""
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+
+        for key, _ in sorted(self._disk_index.items(), key=lambda item: item[1][1]):
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            self._remove_disk(key)
+            self._stats["evictions"] += 1
+
+    def _remove_disk(self, key: str):
+        entry = self._disk_index.pop(key, None)
+        if entry is not None:
+            self._disk_bytes -= entry[0]
+        try:
+            self._disk_path(key).unlink(missing_ok=True)
+        except Exception as e:
+            logger.warning(f"Error removing LLM cache entry {key}: {e}")
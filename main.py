@@ -6,15 +6,26 @@ import os
 import uuid
 import asyncio
 import sys
+import time
+from collections import deque
 from datetime import datetime
+from typing import Optional
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters,
     ContextTypes, ConversationHandler, CallbackQueryHandler
 )
 from config import config
-from bot_generator import BotGenerator
+from bot_generator import BotGenerator, GenerationCancelled, FALLBACK_TIMEOUT
+from offline_generator import OFFLINE_MARKER
 from bot_executor import BotExecutor
+from executor_controller import ExecutorController
+from supervisor import BotSupervisor
+from webhook_ingress import WebhookIngress
+from bot_logs import bot_logs
+from utils import format_resources, sanitize_log_text
+from generation_queue import GenerationScheduler, PRIORITY_NEW, PRIORITY_REGENERATE
 from database import db
 
 # Setup logging
@@ -25,11 +36,85 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Conversation states
-STATE_DESCRIBE_BOT, STATE_REVIEW_CODE = range(2)
+STATE_DESCRIBE_BOT, STATE_REVIEW_CODE, STATE_CHOOSE_REUSE = range(3)
 
 # Global instances
 generator = BotGenerator()
-executor = BotExecutor()
+executor = (
+    ExecutorController(config.BOT_CONTROLLER_LISTEN, config.BOT_AGENT_SECRET, config.BOT_CONTROLLER_LOCAL_BOTS)
+    if config.BOT_CONTROLLER_LISTEN else BotExecutor()
+)
+supervisor = BotSupervisor(executor, db)
+ingress = WebhookIngress(
+    executor,
+    config.BOT_WEBHOOK_URL,
+    config.BOT_WEBHOOK_SECRET or config.MAIN_BOT_TOKEN,
+    host=config.BOT_WEBHOOK_LISTEN,
+    port=config.BOT_PORT,
+    queue_size=config.BOT_WEBHOOK_QUEUE_SIZE,
+    batch_size=config.BOT_WEBHOOK_BATCH_SIZE,
+    hold=config.BOT_WEBHOOK_HOLD,
+    wake=supervisor.receiver.wake,
+    wanted=supervisor.wanted
+) if config.BOT_WEBHOOK_URL else None
+if ingress is not None:
+    executor.webhook = ingress.endpoint
+    supervisor.receiver.pushed = ingress.handles
+    supervisor.released = ingress.release
+scheduler = GenerationScheduler(
+    workers=config.GENERATION_WORKERS,
+    max_queue=config.GENERATION_QUEUE_LIMIT
+)
+
+class GenerationProgress:
+    """Streams partial generation output into a Telegram status message"""
+    
+    HEADER = "⏳ Generating bot code...\n\n"
+    TAIL_CHARS = 1500
+    
+    def __init__(self, status_msg, session: dict, reply_markup=None):
+        self.status_msg = status_msg
+        self.session = session
+        self.reply_markup = reply_markup
+        self.interval = config.PROGRESS_EDIT_INTERVAL
+        self.next_edit_at = 0.0
+        self.active = True
+    
+    def stop(self):
+        """Stop editing, e.g. once the status message shows a final result"""
+        self.active = False
+    
+    async def __call__(self, partial: str) -> bool:
+        """Edit the status message at most once per interval"""
+        if self.session.get("cancel_requested"):
+            return False
+        if not self.active:
+            return True
+        
+        now = time.monotonic()
+        if now < self.next_edit_at:
+            return True
+        self.next_edit_at = now + self.interval
+        
+        tail = partial[-self.TAIL_CHARS:]
+        if len(partial) > self.TAIL_CHARS:
+            tail = "..." + tail
+        
+        try:
+            await self.status_msg.edit_text(
+                f"{self.HEADER}{tail}",
+                reply_markup=self.reply_markup
+            )
+        except RetryAfter as e:
+            # Telegram asked us to slow down, skip edits until it allows them again
+            retry_after = e.retry_after
+            if not isinstance(retry_after, (int, float)):
+                retry_after = retry_after.total_seconds()
+            self.next_edit_at = time.monotonic() + retry_after
+        except BadRequest as e:
+            logger.debug(f"Progress edit skipped: {e}")
+        
+        return True
 
 class GeneratorBot:
     """Main bot generator Telegram bot"""
@@ -51,6 +136,8 @@ class GeneratorBot:
             "/list - Show running bots\n"
             "/status - Check bot statuses\n"
             "/stop - Stop a bot\n"
+            "/logs - Show a bot's output\n"
+            "/grep - Search a bot's log files\n"
             "/help - Show help\n"
             "/stats - Show database statistics"
         )
@@ -65,7 +152,9 @@ class GeneratorBot:
             "Manage bots:\n"
             "/list - List all bots\n"
             "/status - Show detailed status\n"
-            "/stop <bot_name> - Stop a specific bot\n\n"
+            "/stop <bot_name> - Stop a specific bot\n"
+            "/logs <bot_id> [lines|live] - Show or stream a bot's output\n"
+            "/grep <bot_id> <text> - Search a bot's saved logs\n\n"
             "Database:\n"
             "/stats - Show statistics\n\n"
             "Tips:\n"
@@ -113,82 +202,364 @@ class GeneratorBot:
             )
             return STATE_DESCRIBE_BOT
         
+        # Offer near-duplicates of stored bots before spending an LLM call
+        similar = generator.find_similar_bots(description, user_id)
+        if similar:
+            session = self.user_sessions.setdefault(user_id, {"created_at": datetime.now()})
+            session["pending_description"] = description
+            keyboard = [
+                [InlineKeyboardButton(
+                    f"♻️ Reuse {bot['name']} ({bot['similarity']:.0%} match)",
+                    callback_data=f"reuse_{bot['bot_id']}"
+                )]
+                for bot in similar
+            ]
+            keyboard.append([InlineKeyboardButton("✨ Generate a new bot", callback_data="fresh")])
+            await update.message.reply_text(
+                "🔎 You already have bots for very similar descriptions:\n\n"
+                + "\n".join(f"• {bot['name']}: {bot['description'][:100]}" for bot in similar)
+                + "\n\nReuse one of them instantly, or generate a new bot?",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+            return STATE_CHOOSE_REUSE
+        
+        return await self._start_generation(update.message, context, update.effective_chat.id, user_id, description)
+    
+    async def handle_reuse_choice(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """Reuse a near-duplicate bot's code, or go on to generate a new bot"""
+        query = update.callback_query
+        user_id = update.effective_user.id
+        await query.answer()
+        
+        session = self.user_sessions.get(user_id) or {}
+        description = session.pop("pending_description", None)
+        if not description:
+            await query.edit_message_text("❌ Session expired. Please use /generate again.")
+            return ConversationHandler.END
+        
+        if query.data == "fresh":
+            await query.edit_message_reply_markup(reply_markup=None)
+            return await self._start_generation(
+                query.message, context, update.effective_chat.id, user_id, description
+            )
+        
+        source_id = query.data.replace("reuse_", "")
+        source = db.get_bot(source_id)
+        try:
+            if source is None or source.get("user_id") != user_id:
+                raise LookupError("not one of the user's bots")
+            with open(source["code_file"], 'r', encoding='utf-8') as f:
+                bot_code = f.read()
+        except Exception as e:
+            logger.error(f"Error reusing bot {source_id}: {e}")
+            await query.edit_message_text(
+                "❌ That bot is no longer available. Generating a new one instead..."
+            )
+            return await self._start_generation(
+                query.message, context, update.effective_chat.id, user_id, description
+            )
+        
+        bot_id = self._save_bot(user_id, description, bot_code, source["name"], reused_from=source_id)
+        check_error = await self._prepare_saved_bot(bot_id)
+        await query.edit_message_text(
+            f"♻️ Reused the code of bot {source_id}.\n\n"
+            + self._build_preview(source["name"], bot_id, bot_code, check_error),
+            reply_markup=self._review_markup(bot_id),
+            parse_mode="Markdown"
+        )
+        return STATE_REVIEW_CODE
+    
+    async def _start_generation(
+        self,
+        message,
+        context: ContextTypes.DEFAULT_TYPE,
+        chat_id: int,
+        user_id: int,
+        description: str
+    ) -> int:
+        """Post the generating status message and run a new generation"""
         # Show generating status
-        status_msg = await update.message.reply_text(
+        status_msg = await message.reply_text(
             "⏳ Generating bot code...\n\n"
             "This may take a few moments as I:\n"
             "1. Analyze your description\n"
             "2. Generate Python code\n"
             "3. Validate the code\n"
-            "4. Prepare for launch"
+            "4. Prepare for launch",
+            reply_markup=self._stop_markup(user_id)
         )
         
+        return await self._generate_and_preview(context, chat_id, user_id, description, status_msg)
+    
+    async def _generate_and_preview(
+        self,
+        context: ContextTypes.DEFAULT_TYPE,
+        chat_id: int,
+        user_id: int,
+        description: str,
+        status_msg,
+        priority: int = PRIORITY_NEW,
+        use_cache: bool = True
+    ) -> int:
+        """Queue a generation, then save the code and show the review keyboard"""
+        session = self.user_sessions.setdefault(user_id, {"created_at": datetime.now()})
+        session["cancel_requested"] = False
+        stop_markup = self._stop_markup(user_id)
+        
+        progress = GenerationProgress(status_msg, session, stop_markup)
+        # Filled in once the code is saved, so a late LLM result knows its bot
+        saved = {}
+        # Why generate_bot fell back to the offline result, if it did
+        fallback = {}
+        
+        async def offer_upgrade(result):
+            if saved:
+                await self._offer_upgrade(context, chat_id, user_id, saved["bot_id"], result)
+        
+        async def report_position(position: int):
+            if position > 0:
+                await status_msg.edit_text(
+                    f"🕒 You're #{position} in the generation queue.\n"
+                    "Your bot will start generating shortly.",
+                    reply_markup=stop_markup
+                )
+        
         try:
-            # Generate bot code
-            bot_code, bot_class_name, bot_name = await generator.generate_bot(
-                description=description,
-                user_id=user_id,
-                enhanced=True
+            # Generate bot code through the shared queue, streaming partial output
+            # into the status message; if the LLM misses its budget we get the
+            # instant offline result
+            bot_code, bot_class_name, bot_name = await scheduler.submit(
+                user_id,
+                lambda: generator.generate_bot(
+                    description=description,
+                    user_id=user_id,
+                    enhanced=True,
+                    on_progress=progress,
+                    on_upgrade=offer_upgrade,
+                    use_cache=use_cache,
+                    on_fallback=lambda reason: fallback.update(reason=reason)
+                ),
+                priority=priority,
+                on_position=report_position
             )
+            progress.stop()
             
-            # Save the generated code
-            bot_id = str(uuid.uuid4())[:8]
-            bot_file = f"{config.GENERATED_BOTS_DIR}/bot_{bot_id}.py"
-            
-            os.makedirs(config.GENERATED_BOTS_DIR, exist_ok=True)
-            
-            with open(bot_file, 'w', encoding='utf-8') as f:
-                f.write(bot_code)
+            offline = OFFLINE_MARKER in bot_code
+            bot_id = self._save_bot(user_id, description, bot_code, bot_name, offline=offline)
+            saved["bot_id"] = bot_id
+            check_error = await self._prepare_saved_bot(bot_id)
+            if not offline and not check_error:
+                generator.remember_bot(bot_id, description, user_id)
             
-            # Save to database
-            bot_data = {
-                "bot_id": bot_id,
-                "name": bot_name,
-                "description": description,
-                "user_id": user_id,
-                "status": "generated",
-                "code_file": bot_file,
-                "code_length": len(bot_code)
-            }
-            db.add_bot(bot_id, bot_data)
-            
-            # Store session info
-            self.user_sessions[user_id]["bot_code"] = bot_code
-            self.user_sessions[user_id]["bot_file"] = bot_file
-            self.user_sessions[user_id]["bot_id"] = bot_id
-            self.user_sessions[user_id]["bot_name"] = bot_name
-            self.user_sessions[user_id]["description"] = description
-            self.user_sessions[user_id]["status"] = "code_generated"
-            
-            # Send code preview (first 800 chars)
-            code_preview = bot_code[:800] + "...\n\n[code truncated]" if len(bot_code) > 800 else bot_code
+            preview_text = self._build_preview(bot_name, bot_id, bot_code, check_error)
+            if offline and fallback.get("reason") == FALLBACK_TIMEOUT:
+                # The LLM run goes on and offer_upgrade gets its result
+                preview_text = (
+                    "⚡ The AI is taking a while, so here is an instant version built "
+                    "from templates. I'll offer the AI version when it's ready.\n\n"
+                    + preview_text
+                )
+            elif offline:
+                preview_text = (
+                    "⚡ The AI couldn't generate this bot right now, so here is an instant "
+                    "version built from templates. Use 🔄 Regenerate to try the AI again.\n\n"
+                    + preview_text
+                )
             
-            preview_text = (
-                f"✅ Bot code generated successfully!\n\n"
-                f"Bot Name: {bot_name}\n"
-                f"Bot ID: {bot_id}\n"
-                f"Code Length: {len(bot_code)} characters\n\n"
-                f"Code Preview:\n"
-                f"```python\n{code_preview}\n```"
+            await status_msg.edit_text(
+                preview_text, reply_markup=self._review_markup(bot_id), parse_mode="Markdown"
             )
             
-            keyboard = [
-                [InlineKeyboardButton("✅ Launch Bot", callback_data=f"launch_{bot_id}")],
-                [InlineKeyboardButton("📄 Save for Later", callback_data=f"save_{bot_id}")],
-                [InlineKeyboardButton("❌ Cancel", callback_data="cancel")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await status_msg.edit_text(preview_text, reply_markup=reply_markup, parse_mode="Markdown")
-            
             return STATE_REVIEW_CODE
         
+        except GenerationCancelled:
+            progress.stop()
+            await status_msg.edit_text(
+                "⛔ Generation stopped.\n"
+                "Send a new description to try again."
+            )
+            return STATE_DESCRIBE_BOT
+        
         except Exception as e:
+            progress.stop()
             logger.error(f"Error generating bot: {e}")
             error_text = f"❌ Error generating bot:\n{str(e)}"
             await status_msg.edit_text(error_text)
             return STATE_DESCRIBE_BOT
     
+    def _save_bot(self, user_id: int, description: str, bot_code: str, bot_name: str, **extra) -> str:
+        """Write generated code to disk, record it and make it the session's bot"""
+        bot_id = str(uuid.uuid4())[:8]
+        bot_file = f"{config.GENERATED_BOTS_DIR}/bot_{bot_id}.py"
+        
+        os.makedirs(config.GENERATED_BOTS_DIR, exist_ok=True)
+        
+        with open(bot_file, 'w', encoding='utf-8') as f:
+            f.write(bot_code)
+        
+        # Save to database
+        bot_data = {
+            "bot_id": bot_id,
+            "name": bot_name,
+            "description": description,
+            "user_id": user_id,
+            "status": "generated",
+            "code_file": bot_file,
+            "code_length": len(bot_code),
+            **extra
+        }
+        db.add_bot(bot_id, bot_data)
+        
+        # Store session info
+        session = self.user_sessions.setdefault(user_id, {"created_at": datetime.now()})
+        session["bot_code"] = bot_code
+        session["bot_file"] = bot_file
+        session["bot_id"] = bot_id
+        session["bot_name"] = bot_name
+        session["description"] = description
+        session["status"] = "code_generated"
+        return bot_id
+    
+    async def _prepare_saved_bot(self, bot_id: str) -> Optional[str]:
+        """Precompile a saved bot and record whether it passed the import check"""
+        bot_data = db.get_bot(bot_id)
+        check_error = await executor.prepare_bot(bot_data["code_file"])
+        db.update_bot(bot_id, {"import_error": check_error})
+        return check_error
+    
+    @staticmethod
+    def _review_markup(bot_id: str) -> InlineKeyboardMarkup:
+        """Keyboard shown under a generated code preview"""
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ Launch Bot", callback_data=f"launch_{bot_id}")],
+            [InlineKeyboardButton("📄 Save for Later", callback_data=f"save_{bot_id}")],
+            [InlineKeyboardButton("🔄 Regenerate", callback_data=f"regen_{bot_id}")],
+            [InlineKeyboardButton("❌ Cancel", callback_data="cancel")]
+        ])
+    
+    @staticmethod
+    def _stop_markup(user_id: int) -> InlineKeyboardMarkup:
+        """Keyboard with the stop button shown while a generation runs"""
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton("⛔ Stop generation", callback_data=f"stopgen_{user_id}")]
+        ])
+    
+    @staticmethod
+    def _build_preview(bot_name: str, bot_id: str, bot_code: str, check_error: Optional[str] = None) -> str:
+        """Build the generated code preview message"""
+        # Send code preview (first 800 chars)
+        code_preview = bot_code[:800] + "...\n\n[code truncated]" if len(bot_code) > 800 else bot_code
+        
+        if check_error:
+            header = (
+                f"⚠️ Bot code generated, but it failed the pre-launch check and can't be launched:\n"
+                f"`{check_error.replace('`', chr(39))[:300]}`\n"
+                f"Try 🔄 Regenerate.\n\n"
+            )
+        else:
+            header = "✅ Bot code generated successfully!\n\n"
+        
+        return (
+            header +
+            f"Bot Name: {bot_name}\n"
+            f"Bot ID: {bot_id}\n"
+            f"Code Length: {len(bot_code)} characters\n\n"
+            f"Code Preview:\n"
+            f"```python\n{code_preview}\n```"
+        )
+    
+    async def _offer_upgrade(
+        self,
+        context: ContextTypes.DEFAULT_TYPE,
+        chat_id: int,
+        user_id: int,
+        bot_id: str,
+        result
+    ):
+        """Offer an LLM result that arrived after the offline version was shown"""
+        bot_code, bot_class_name, bot_name = result
+        session = self.user_sessions.get(user_id)
+        if not session:
+            return
+        
+        session.setdefault("upgrades", {})[bot_id] = {"bot_code": bot_code, "bot_name": bot_name}
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("⬆️ Use AI version", callback_data=f"upgrade_{bot_id}")]
+        ])
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=(
+                f"✨ The AI version of your bot is ready!\n\n"
+                f"Bot Name: {bot_name}\n"
+                f"Code Length: {len(bot_code)} characters\n\n"
+                f"Replace the instant version (Bot ID: {bot_id}) with it?"
+            ),
+            reply_markup=keyboard
+        )
+    
+    async def handle_upgrade(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Replace an offline-generated bot with its late LLM version"""
+        query = update.callback_query
+        user_id = update.effective_user.id
+        bot_id = query.data.replace("upgrade_", "")
+        await query.answer()
+        
+        session = self.user_sessions.get(user_id) or {}
+        upgrade = session.get("upgrades", {}).pop(bot_id, None)
+        bot_data = db.get_bot(bot_id)
+        if not upgrade or not bot_data or bot_data.get("user_id") != user_id:
+            await query.edit_message_text("❌ This upgrade is no longer available.")
+            return
+        
+        bot_code = upgrade["bot_code"]
+        with open(bot_data["code_file"], 'r', encoding='utf-8') as f:
+            previous_code = f.read()
+        with open(bot_data["code_file"], 'w', encoding='utf-8') as f:
+            f.write(bot_code)
+        
+        check_error = await executor.prepare_bot(bot_data["code_file"])
+        if check_error:
+            # Keep the working instant version rather than a bot that can't start
+            with open(bot_data["code_file"], 'w', encoding='utf-8') as f:
+                f.write(previous_code)
+            await executor.prepare_bot(bot_data["code_file"])
+            await query.edit_message_text(
+                f"⚠️ The AI version failed its pre-launch check ({check_error[:200]}), "
+                f"so bot {bot_id} keeps the instant version."
+            )
+            return
+        
+        db.update_bot(bot_id, {
+            "name": upgrade["bot_name"],
+            "code_length": len(bot_code),
+            "upgraded": True,
+            "import_error": None
+        })
+        generator.remember_bot(bot_id, bot_data["description"], user_id)
+        
+        if session.get("bot_id") == bot_id:
+            session["bot_code"] = bot_code
+            session["bot_name"] = upgrade["bot_name"]
+        
+        text = f"✅ Bot {bot_id} now uses the AI-generated code ({len(bot_code)} characters)."
+        if bot_id in executor.bots and executor.bots[bot_id].status == "running":
+            text += "\nStop and relaunch the bot to run the new version."
+        await query.edit_message_text(text)
+    
+    async def stop_generation(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle the stop button shown while a generation is streaming"""
+        query = update.callback_query
+        user_id = update.effective_user.id
+        
+        if query.data != f"stopgen_{user_id}":
+            await query.answer("This generation isn't yours.")
+            return
+        
+        session = self.user_sessions.get(user_id)
+        if session is not None:
+            session["cancel_requested"] = True
+        await query.answer("Stopping generation...")
+    
     async def handle_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Handle inline button presses"""
         query = update.callback_query
@@ -215,6 +586,24 @@ class GeneratorBot:
             
             return ConversationHandler.END
         
+        elif query.data.startswith("regen_"):
+            bot_id = query.data.replace("regen_", "")
+            session = self.user_sessions.get(user_id)
+            
+            if not session or session.get("bot_id") != bot_id:
+                await query.edit_message_text("❌ Session expired. Please generate a new bot.")
+                return ConversationHandler.END
+            
+            await query.edit_message_text(
+                "🔄 Regenerating bot code with a fresh AI response...",
+                reply_markup=self._stop_markup(user_id)
+            )
+            # Regenerations skip the cache and jump ahead of new generations
+            return await self._generate_and_preview(
+                context, update.effective_chat.id, user_id, session["description"],
+                query.message, priority=PRIORITY_REGENERATE, use_cache=False
+            )
+        
         elif query.data.startswith("launch_"):
             bot_id = query.data.replace("launch_", "")
             session = self.user_sessions.get(user_id)
@@ -223,6 +612,15 @@ class GeneratorBot:
                 await query.edit_message_text("❌ Session expired. Please generate a new bot.")
                 return ConversationHandler.END
             
+            # Don't spawn a process that is known to fail on import
+            check_error = (db.get_bot(bot_id) or {}).get("import_error")
+            if check_error:
+                await query.edit_message_text(
+                    f"❌ This bot failed its pre-launch check and can't be launched:\n{check_error}\n\n"
+                    f"Use /generate to create a new one."
+                )
+                return ConversationHandler.END
+            
             # Launch the bot
             try:
                 await query.edit_message_text(
@@ -234,21 +632,18 @@ class GeneratorBot:
                 # For now, we'll simulate it
                 bot_token = "1234567890:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijk"  # Placeholder
                 
-                bot_process = executor.launch_bot(
+                bot_process = await supervisor.launch(
                     bot_code_path=session["bot_file"],
                     bot_name=session["bot_name"],
                     bot_token=bot_token,
                     bot_id=bot_id
                 )
                 
-                # Update database
-                db.update_bot(bot_id, {"status": "running", "process_id": bot_process.process.pid})
-                
                 success_text = (
                     f"✅ Bot '{session['bot_name']}' launched successfully!\n\n"
                     f"Bot ID: {bot_id}\n"
                     f"Status: {bot_process.status}\n"
-                    f"Process ID: {bot_process.process.pid}\n"
+                    f"Process ID: {bot_process.pid}\n"
                     f"Created: {bot_process.created_at}\n\n"
                     f"💡 Next steps:\n"
                     f"1. Replace the token placeholder in the bot code\n"
@@ -264,8 +659,6 @@ class GeneratorBot:
                 error_text = f"❌ Error launching bot:\n{str(e)}"
                 await query.edit_message_text(error_text)
                 logger.error(f"Error launching bot: {e}")
-                # Update database with error
-                db.update_bot(bot_id, {"status": "error", "error": str(e)})
             
             return ConversationHandler.END
     
@@ -287,8 +680,11 @@ class GeneratorBot:
             status = bot_data.get("status", "unknown")
             status_emoji = {
                 "running": "🟢",
+                "restarting": "🔄",
+                "hibernating": "💤",
                 "stopped": "🔴",
                 "error": "❌",
+                "crashed": "💥",
                 "saved": "📄",
                 "generated": "🔨"
             }.get(status, "❓")
@@ -317,8 +713,11 @@ class GeneratorBot:
         for bot_id, bot_data in user_bots.items():
             status_emoji = {
                 "running": "🟢",
+                "restarting": "🔄",
+                "hibernating": "💤",
                 "stopped": "🔴",
                 "error": "❌",
+                "crashed": "💥",
                 "saved": "📄",
                 "generated": "🔨"
             }.get(bot_data.get("status"), "❓")
@@ -330,6 +729,14 @@ class GeneratorBot:
                 f"   Created: {bot_data.get('created_at', 'N/A')}\n"
             )
             
+            if bot_data.get('restarts'):
+                text += f"   Restarts: {bot_data['restarts']}\n"
+            if bot_data.get('status') == 'running' and bot_id in executor.bots:
+                resources = executor.get_bot_status(bot_id).get('resources')
+                if resources:
+                    text += f"   Resources: {format_resources(resources)}\n"
+            if bot_data.get('status') == 'restarting' and bot_data.get('next_restart_at'):
+                text += f"   Next restart: {bot_data['next_restart_at']}\n"
             if bot_data.get('error'):
                 text += f"   Error: {bot_data['error']}\n"
             
@@ -355,6 +762,73 @@ class GeneratorBot:
         for status, count in stats.get('bots_by_status', {}).items():
             text += f"  {status}: {count}\n"
         
+        cache_stats = generator.client.get_cache_stats()
+        if cache_stats:
+            text += (
+                f"\nLLM cache:\n"
+                f"  Hits: {cache_stats['hits']} (memory {cache_stats['memory_hits']}, "
+                f"disk {cache_stats['disk_hits']})\n"
+                f"  Misses: {cache_stats['misses']}\n"
+                f"  Hit rate: {cache_stats['hit_rate']:.0%}\n"
+            )
+        
+        upstream = generator.client.get_resilience_stats()
+        breaker = upstream["circuit_breaker"]
+        text += (
+            f"\nOnlySq API:\n"
+            f"  Requests: {upstream['requests']} (retries {upstream['retries']}, "
+            f"failures {upstream['failures']}, fallbacks {upstream['fallbacks']})\n"
+            f"  Circuit breaker: {breaker['state']}"
+        )
+        if breaker["retry_in"] is not None:
+            text += f" (probe in {breaker['retry_in']}s)"
+        text += f"\n  Rate limit: {upstream['rate_limiter']['rate']}/s\n"
+        
+        queue = scheduler.get_metrics()
+        text += (
+            f"\nGeneration queue:\n"
+            f"  Queued: {queue['queue_depth']}, running: {queue['running']}/{queue['workers']}\n"
+            f"  Completed: {queue['completed']} (failed {queue['failed']}, "
+            f"cancelled {queue['cancelled']}, rejected {queue['rejected']})\n"
+        )
+        if queue["wait_p50"] is not None:
+            text += f"  Wait: p50 {queue['wait_p50']}s, p90 {queue['wait_p90']}s, max {queue['wait_max']}s\n"
+        
+        launches = executor.launch_metrics()
+        if launches["launches"]:
+            text += (
+                f"\nBot launches ({'zygote' if launches['zygote'] else 'cold start'}):\n"
+                f"  {launches['launches']} recent: p50 {launches['p50_ms']}ms, p90 {launches['p90_ms']}ms, "
+                f"p99 {launches['p99_ms']}ms, max {launches['max_ms']}ms\n"
+            )
+        
+        hosts = executor.host_stats()
+        if hosts:
+            text += f"\nBot hosts ({sum(host['alive'] for host in hosts)}/{len(executor.hosts)} up):\n"
+            for host in hosts:
+                state = f"PID {host['pid']}" if host["alive"] else "down"
+                text += f"  #{host['index']}: {host['bots']} bots, {state}\n"
+        
+        if ingress is not None:
+            webhooks = ingress.stats()
+            text += (
+                f"\nWebhook ingress ({webhooks['bots']} bots):\n"
+                f"  Received: {webhooks['received']}, delivered: {webhooks['delivered']}, "
+                f"queued: {webhooks['queued']}\n"
+                f"  Rejected (busy): {webhooks['rejected']}, dropped: {webhooks['dropped']}\n"
+            )
+        
+        if isinstance(executor, ExecutorController):
+            agents = executor.agent_stats()
+            text += f"\nExecutor agents ({len(agents)} connected):\n"
+            for agent in agents:
+                text += f"  {agent['name']}: {agent['bots']}/{agent['capacity']} bots"
+                if agent["cpu"] is not None:
+                    text += f", load {agent['cpu']}"
+                if agent["mem_free_mb"] is not None:
+                    text += f", {agent['mem_free_mb']} MB free"
+                text += "\n"
+        
         await update.message.reply_text(text)
     
     async def stop_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -374,6 +848,12 @@ class GeneratorBot:
             if bot.name.lower() == bot_name.lower():
                 bot_to_stop = bot_id
                 break
+        else:
+            # Hibernated since the last restart, so no process was ever started here
+            for bot_id, entry in supervisor.bots.items():
+                if entry.hibernating and entry.bot_name.lower() == bot_name.lower():
+                    bot_to_stop = bot_id
+                    break
         
         if not bot_to_stop:
             await update.message.reply_text(
@@ -381,9 +861,7 @@ class GeneratorBot:
             )
             return
         
-        if executor.stop_bot(bot_to_stop):
-            # Update database
-            db.update_bot(bot_to_stop, {"status": "stopped"})
+        if await supervisor.stop(bot_to_stop):
             await update.message.reply_text(
                 f"✅ Bot '{bot_name}' stopped successfully."
             )
@@ -392,6 +870,114 @@ class GeneratorBot:
                 f"❌ Failed to stop bot '{bot_name}'."
             )
 
+    async def logs_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show the latest output of one of your bots, or stream it live"""
+        if not context.args:
+            await update.message.reply_text(
+                "❌ Please specify bot ID:\n"
+                "/logs <bot_id> [lines|live]"
+            )
+            return
+        
+        bot_id = context.args[0]
+        bot_data = db.get_bot(bot_id)
+        if not bot_data or bot_data.get("user_id") != update.effective_user.id:
+            await update.message.reply_text(f"❌ Bot '{bot_id}' not found.")
+            return
+        
+        option = context.args[1].lower() if len(context.args) > 1 else ""
+        if option == "live":
+            await self._follow_logs(update, bot_id, bot_data.get("name", bot_id))
+            return
+        
+        count = min(int(option), 100) if option.isdigit() else 20
+        lines = bot_logs.tail(bot_id, count)
+        if not lines:
+            # Nothing in memory (e.g. after a restart); read the saved log files
+            lines = await asyncio.get_running_loop().run_in_executor(
+                None, bot_logs.tail_files, bot_id, count
+            )
+        if not lines:
+            await update.message.reply_text(
+                f"📭 No output captured for {bot_data.get('name', bot_id)} yet."
+            )
+            return
+        
+        text = sanitize_log_text("\n".join(lines), max_lines=count)
+        await update.message.reply_text(
+            f"📜 Last {len(lines)} lines of {bot_data.get('name', bot_id)} ({bot_id}):\n\n"
+            f"{text[-3500:]}"
+        )
+    
+    async def grep_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Search the saved log files of one of your bots"""
+        if len(context.args) < 2:
+            await update.message.reply_text(
+                "❌ Please specify bot ID and text to search for:\n"
+                "/grep <bot_id> <text>"
+            )
+            return
+        
+        bot_id = context.args[0]
+        bot_data = db.get_bot(bot_id)
+        if not bot_data or bot_data.get("user_id") != update.effective_user.id:
+            await update.message.reply_text(f"❌ Bot '{bot_id}' not found.")
+            return
+        
+        query = " ".join(context.args[1:])
+        try:
+            lines = await asyncio.get_running_loop().run_in_executor(
+                None, bot_logs.search, bot_id, query, 20
+            )
+        except Exception as e:
+            logger.error(f"Error searching logs of bot {bot_id}: {e}")
+            await update.message.reply_text("❌ Failed to search the logs.")
+            return
+        
+        if not lines:
+            await update.message.reply_text(
+                f"🔍 No log lines of {bot_data.get('name', bot_id)} contain \"{query}\"."
+            )
+            return
+        
+        text = sanitize_log_text("\n".join(lines), max_lines=len(lines))
+        await update.message.reply_text(
+            f"🔍 Latest {len(lines)} matches for \"{query}\" in {bot_data.get('name', bot_id)} ({bot_id}):\n\n"
+            f"{text[-3500:]}"
+        )
+    
+    async def _follow_logs(self, update: Update, bot_id: str, bot_name: str):
+        """Edit one message with a bot's newest output for a while"""
+        seconds = config.BOT_LOG_FOLLOW_SECONDS
+        header = f"📡 Live output of {bot_name} ({bot_id}), {seconds:.0f}s:\n\n"
+        message = await update.message.reply_text(header + "Waiting for output...")
+        lines = deque(bot_logs.tail(bot_id, 20), maxlen=20)
+        
+        async def collect():
+            async for line in bot_logs.subscribe(bot_id):
+                lines.append(line)
+        
+        collector = asyncio.ensure_future(collect())
+        shown = None
+        try:
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                await asyncio.sleep(config.PROGRESS_EDIT_INTERVAL)
+                text = sanitize_log_text("\n".join(lines), max_lines=20)[-3500:]
+                if text and text != shown:
+                    try:
+                        await message.edit_text(header + text)
+                        shown = text
+                    except (BadRequest, RetryAfter) as e:
+                        logger.debug(f"Live log edit skipped: {e}")
+        finally:
+            collector.cancel()
+        
+        try:
+            await message.edit_text(header + (shown or "No new output.") + "\n\n⏹ Live output ended.")
+        except (BadRequest, RetryAfter) as e:
+            logger.debug(f"Live log edit skipped: {e}")
+
 async def run_bot():
     """Setup and run the bot"""
     try:
@@ -402,9 +988,24 @@ async def run_bot():
         logger.info(f"Database file: {config.DATABASE_FILE}")
         
         # Create application
-        app = Application.builder().token(config.MAIN_BOT_TOKEN).build()
+        # Concurrent updates let generations for different users overlap
+        app = (
+            Application.builder()
+            .token(config.MAIN_BOT_TOKEN)
+            .concurrent_updates(True)
+            .build()
+        )
         
         bot_instance = GeneratorBot()
+        if ingress is not None:
+            await ingress.start()
+        await executor.start()
+        supervisor.start()
+        # Reattach to bots that outlived the last run and relaunch the rest
+        await supervisor.recover()
+        
+        # Catch the similarity index up with bots added while it was offline
+        await asyncio.get_running_loop().run_in_executor(None, generator.index_existing_bots)
         
         # Add handlers
         app.add_handler(CommandHandler("start", bot_instance.start))
@@ -413,6 +1014,10 @@ async def run_bot():
         app.add_handler(CommandHandler("status", bot_instance.status_command))
         app.add_handler(CommandHandler("stats", bot_instance.stats_command))
         app.add_handler(CommandHandler("stop", bot_instance.stop_command))
+        app.add_handler(CommandHandler("logs", bot_instance.logs_command))
+        app.add_handler(CommandHandler("grep", bot_instance.grep_command))
+        app.add_handler(CallbackQueryHandler(bot_instance.stop_generation, pattern="^stopgen_"))
+        app.add_handler(CallbackQueryHandler(bot_instance.handle_upgrade, pattern="^upgrade_"))
         
         # Conversation handler for bot generation
         conv_handler = ConversationHandler(
@@ -421,8 +1026,11 @@ async def run_bot():
                 STATE_DESCRIBE_BOT: [
                     MessageHandler(filters.TEXT & ~filters.COMMAND, bot_instance.handle_description)
                 ],
+                STATE_CHOOSE_REUSE: [
+                    CallbackQueryHandler(bot_instance.handle_reuse_choice, pattern="^(reuse_|fresh$)")
+                ],
                 STATE_REVIEW_CODE: [
-                    CallbackQueryHandler(bot_instance.handle_button, pattern="^(launch|save|cancel)")
+                    CallbackQueryHandler(bot_instance.handle_button, pattern="^(launch|save|regen|cancel)")
                 ]
             },
             fallbacks=[]
@@ -441,19 +1049,22 @@ async def run_bot():
     finally:
         # Cleanup
         try:
-            executor.cleanup()
-            generator.close()
+            await supervisor.close()
+            await executor.cleanup()
+            if ingress is not None:
+                await ingress.close()
+            await scheduler.stop()
+            await generator.close()
             logger.info("Cleanup completed")
         except Exception as e:
             logger.error(f"Error during cleanup: {e}")
 
 def main():
     """Main entry point with proper event loop setup"""
-    # Fix for Windows asyncio issues
+    # Bots run as asyncio subprocesses, which need the Proactor loop on Windows
     if sys.platform == 'win32':
-        # Use SelectorEventLoop on Windows for better stability
-        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-        logger.info("Using WindowsSelectorEventLoopPolicy for Windows")
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+        logger.info("Using WindowsProactorEventLoopPolicy for Windows")
     
     # Create new event loop and run
     try:
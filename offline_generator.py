@@ -0,0 +1,195 @@
+"""Instant keyword/template bot generator that works without the LLM"""
+
+import logging
+import re
+from typing import Dict, Any, List, Optional
+from utils import estimate_bot_complexity
+
+logger = logging.getLogger(__name__)
+
+# Added to offline-generated code so it can be told apart from LLM output
+OFFLINE_MARKER = "# Generated instantly from built-in recipes"
+
+# keyword(s) -> recipe; each recipe contributes methods and registrations
+RECIPES: List[Dict[str, Any]] = [
+    {
+        "keywords": ["echo", "repeat", "parrot"],
+        "name": "Echo",
+        "methods": '''async def echo_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Echo the user's message back"""
+    try:
+        await update.message.reply_text(update.message.text)
+    except Exception as e:
+        logger.error(f"Error echoing message: {e}")''',
+        "handlers": [{"type": "message", "filter": "text", "method": "echo_message"}]
+    },
+    {
+        "keywords": ["joke", "funny", "humor", "humour"],
+        "name": "Joke",
+        "methods": '''async def joke_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send a random joke"""
+    import random
+    jokes = [
+        "Why do programmers prefer dark mode? Because light attracts bugs.",
+        "There are 10 kinds of people: those who understand binary and those who don't.",
+        "A SQL query walks into a bar, goes up to two tables and asks: can I join you?",
+        "Why did the developer go broke? Because he used up all his cache."
+    ]
+    try:
+        await update.message.reply_text(random.choice(jokes))
+    except Exception as e:
+        logger.error(f"Error sending joke: {e}")''',
+        "handlers": [{"type": "command", "command": "joke", "method": "joke_command"}]
+    },
+    {
+        "keywords": ["weather", "forecast", "temperature"],
+        "name": "Weather",
+        "methods": '''async def weather_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show current weather for a city: /weather <city>"""
+    import asyncio
+    import urllib.parse
+    import urllib.request
+    if not context.args:
+        await update.message.reply_text("Usage: /weather <city>")
+        return
+    city = " ".join(context.args)
+    url = f"https://wttr.in/{urllib.parse.quote(city)}?format=3"
+    try:
+        report = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: urllib.request.urlopen(url, timeout=10).read().decode("utf-8")
+        )
+        await update.message.reply_text(f"🌤 {report.strip()}")
+    except Exception as e:
+        logger.error(f"Error fetching weather: {e}")
+        await update.message.reply_text("❌ Couldn't fetch the weather right now.")''',
+        "handlers": [{"type": "command", "command": "weather", "method": "weather_command"}]
+    },
+    {
+        "keywords": ["remind", "reminder", "timer", "alarm"],
+        "name": "Reminder",
+        "methods": '''async def remind_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Set a reminder: /remind <minutes> <text>"""
+    import asyncio
+    if len(context.args) < 2 or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /remind <minutes> <text>")
+        return
+    minutes = int(context.args[0])
+    text = " ".join(context.args[1:])
+    chat_id = update.effective_chat.id
+
+    async def notify():
+        await asyncio.sleep(minutes * 60)
+        await context.bot.send_message(chat_id=chat_id, text=f"⏰ Reminder: {text}")
+
+    asyncio.create_task(notify())
+    await update.message.reply_text(f"✅ I'll remind you in {minutes} minute(s).")''',
+        "handlers": [{"type": "command", "command": "remind", "method": "remind_command"}]
+    },
+    {
+        "keywords": ["todo", "task", "note", "list"],
+        "name": "Todo",
+        "methods": '''async def add_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Add an item: /add <text>"""
+    if not context.args:
+        await update.message.reply_text("Usage: /add <text>")
+        return
+    items = context.user_data.setdefault("items", [])
+    items.append(" ".join(context.args))
+    await update.message.reply_text(f"✅ Added. You have {len(items)} item(s).")
+
+async def items_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List saved items: /items"""
+    items = context.user_data.get("items", [])
+    if not items:
+        await update.message.reply_text("📭 Your list is empty. Use /add <text>.")
+        return
+    lines = [f"{i}. {item}" for i, item in enumerate(items, 1)]
+    await update.message.reply_text("📋 Your list:\\n" + "\\n".join(lines))''',
+        "handlers": [
+            {"type": "command", "command": "add", "method": "add_command"},
+            {"type": "command", "command": "items", "method": "items_command"}
+        ]
+    },
+    {
+        "keywords": ["dice", "roll", "random", "coin", "flip"],
+        "name": "Dice",
+        "methods": '''async def roll_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Roll a die: /roll [sides]"""
+    import random
+    sides = int(context.args[0]) if context.args and context.args[0].isdigit() else 6
+    sides = max(2, min(sides, 1000))
+    await update.message.reply_text(f"🎲 You rolled {random.randint(1, sides)} (d{sides})")''',
+        "handlers": [{"type": "command", "command": "roll", "method": "roll_command"}]
+    },
+    {
+        "keywords": ["quote", "motivat", "inspir"],
+        "name": "Quote",
+        "methods": '''async def quote_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send an inspirational quote"""
+    import random
+    quotes = [
+        "The best way to get started is to quit talking and begin doing. - Walt Disney",
+        "Simplicity is the soul of efficiency. - Austin Freeman",
+        "Make it work, make it right, make it fast. - Kent Beck",
+        "First, solve the problem. Then, write the code. - John Johnson"
+    ]
+    await update.message.reply_text(f"💬 {random.choice(quotes)}")''',
+        "handlers": [{"type": "command", "command": "quote", "method": "quote_command"}]
+    },
+    {
+        "keywords": ["count", "counter", "track", "statistic"],
+        "name": "Counter",
+        "methods": '''async def count_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Increase and show the user's personal counter"""
+    count = context.user_data.get("count", 0) + 1
+    context.user_data["count"] = count
+    await update.message.reply_text(f"🔢 Your count: {count}")''',
+        "handlers": [{"type": "command", "command": "count", "method": "count_command"}]
+    }
+]
+
+# How many matching recipes each complexity level may combine
+RECIPES_PER_COMPLEXITY = {'simple': 1, 'medium': 2, 'complex': 3}
+
+class OfflineGenerator:
+    """Build bot logic from keyword-matched recipes in milliseconds"""
+
+    def generate(self, description: str, bot_name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Generate bot parts from a description
+
+        Returns:
+            Dict with "name", "methods" and "handlers", in the same shape as
+            BotGenerator's structured LLM output
+        """
+        desc_lower = description.lower()
+        limit = RECIPES_PER_COMPLEXITY.get(estimate_bot_complexity(description), 2)
+        # Recipes mentioned earliest in the description take priority
+        positions = []
+        for recipe in RECIPES:
+            hits = [desc_lower.find(k) for k in recipe["keywords"] if k in desc_lower]
+            if hits:
+                positions.append((min(hits), recipe))
+        matched = [recipe for _, recipe in sorted(positions, key=lambda item: item[0])][:limit]
+
+        methods = "\n\n".join(recipe["methods"] for recipe in matched)
+        handlers = [handler for recipe in matched for handler in recipe["handlers"]]
+        if methods:
+            methods = f"{OFFLINE_MARKER}\n{methods}"
+
+        name = bot_name or self._make_name(description, matched)
+        logger.info(f"Offline generator matched {len(matched)} recipe(s) for {name}")
+        return {"name": name, "methods": methods, "handlers": handlers}
+
+    @staticmethod
+    def _make_name(description: str, matched: List[Dict[str, Any]]) -> str:
+        """Derive a bot name from matched recipes or the description's words"""
+        if matched:
+            return "".join(recipe["name"] for recipe in matched[:2]) + "Bot"
+
+        stopwords = {'create', 'make', 'build', 'bot', 'telegram', 'that', 'which', 'with', 'the', 'and', 'for'}
+        words = [
+            w for w in re.findall(r'[A-Za-z]+', description)
+            if len(w) > 2 and w.lower() not in stopwords
+        ]
+        return "".join(w.capitalize() for w in words[:2]) + "Bot" if words else "GeneratedBot"
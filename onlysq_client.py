@@ -1,7 +1,15 @@
+import asyncio
 import httpx
+import json
 import logging
-from typing import Optional, List, Dict, Any
+import time
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable, Awaitable
 from config import config
+from llm_cache import LLMCache
+from resilience import (
+    AdaptiveRateLimiter, RetryPolicy, CircuitBreaker, LatencyTracker, parse_retry_after
+)
+from singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
@@ -11,13 +19,67 @@ class OnlySqClient:
     def __init__(self, base_url: Optional[str] = None):
         self.base_url = base_url or config.ONLYSQ_BASE_URL
         self.model = config.ONLYSQ_MODEL
-        # OnlySq free tier doesn't require authentication
-        self.client = httpx.Client(
-            headers={
-                'Content-Type': 'application/json'
-            },
-            timeout=30.0
+        self.total_timeout = config.ONLYSQ_TOTAL_TIMEOUT
+        self.limits = httpx.Limits(
+            max_connections=config.ONLYSQ_MAX_CONNECTIONS,
+            max_keepalive_connections=config.ONLYSQ_MAX_KEEPALIVE,
+            keepalive_expiry=config.ONLYSQ_KEEPALIVE_EXPIRY
         )
+        self.timeout = httpx.Timeout(
+            connect=config.ONLYSQ_CONNECT_TIMEOUT,
+            read=config.ONLYSQ_READ_TIMEOUT,
+            write=config.ONLYSQ_CONNECT_TIMEOUT,
+            pool=config.ONLYSQ_CONNECT_TIMEOUT
+        )
+        # Created lazily so the pool binds to the event loop that uses it
+        self.client: Optional[httpx.AsyncClient] = None
+        self._inflight = SingleFlight()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.limiter = AdaptiveRateLimiter(
+            rate=config.ONLYSQ_RATE_LIMIT,
+            burst=config.ONLYSQ_RATE_BURST
+        )
+        self.retry_policy = RetryPolicy(
+            max_attempts=config.ONLYSQ_MAX_RETRIES + 1,
+            base_delay=config.ONLYSQ_RETRY_BASE_DELAY,
+            max_delay=config.ONLYSQ_RETRY_MAX_DELAY
+        )
+        self.breaker = CircuitBreaker(
+            failure_threshold=config.ONLYSQ_BREAKER_THRESHOLD,
+            reset_timeout=config.ONLYSQ_BREAKER_RESET
+        )
+        self.latency = LatencyTracker()
+        self._stats = {
+            "requests": 0, "retries": 0, "failures": 0, "fallbacks": 0,
+            "hedged": 0, "hedge_wins": 0
+        }
+        self.cache: Optional[LLMCache] = None
+        if config.LLM_CACHE_ENABLED:
+            self.cache = LLMCache(
+                max_entries=config.LLM_CACHE_MAX_ENTRIES,
+                ttl=config.LLM_CACHE_TTL,
+                cache_dir=config.LLM_CACHE_DIR or None,
+                max_disk_bytes=config.LLM_CACHE_MAX_DISK_MB * 1024 * 1024
+            )
+    
+    def _upstream_slots(self) -> asyncio.Semaphore:
+        """Semaphore bounding concurrent upstream calls, created on first use"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(config.ONLYSQ_MAX_CONCURRENT_REQUESTS)
+        return self._semaphore
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the shared pooled async client, creating it on first use"""
+        if self.client is None or self.client.is_closed:
+            # OnlySq free tier doesn't require authentication
+            self.client = httpx.AsyncClient(
+                headers={
+                    'Content-Type': 'application/json'
+                },
+                limits=self.limits,
+                timeout=self.timeout
+            )
+        return self.client
     
     async def generate_text(
         self,
@@ -25,40 +87,281 @@ class OnlySqClient:
         system_prompt: Optional[str] = None,
         temperature: float = 0.7,
         max_tokens: int = 2000,
-        model: Optional[str] = None
+        model: Optional[str] = None,
+        use_cache: bool = True,
+        hedge: bool = False,
+        fallback: bool = True
     ) -> str:
-        """Generate text using OnlySq API"""
+        """
+        Generate text using OnlySq API
+        
+        Responses are served from the cache when one is configured;
+        pass use_cache=False to force a fresh completion.
+        With hedge=True a backup request to a second model is sent if the
+        primary model has not answered by its observed latency percentile;
+        the first valid answer wins.
+        With fallback=False errors are raised instead of answered with the
+        canned fallback response, for callers with a fallback of their own.
+        """
         try:
-            model = model or self.model
-            messages = []
+            payload = self._build_payload(prompt, system_prompt, temperature, max_tokens, model)
+            cache_key = None
+            if use_cache and self.cache is not None:
+                cache_key = self.cache.make_key(payload)
+                cached = await self.cache.get(cache_key)
+                if cached is not None:
+                    return cached
             
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            
-            messages.append({"role": "user", "content": prompt})
-            
-            response = await self._request(
-                method='POST',
-                endpoint='/chat/completions',
-                json={
-                    'model': model,
-                    'messages': messages,
-                    'temperature': temperature,
-                    'max_tokens': max_tokens,
-                    'top_p': 0.95
-                }
+            # Identical requests already in flight share one upstream call
+            if hedge:
+                return await self._inflight.do(
+                    LLMCache.make_key(payload),
+                    lambda: self._hedged_complete(payload, cache_key)
+                )
+            return await self._inflight.do(
+                LLMCache.make_key(payload),
+                lambda: self._complete(payload, cache_key)
             )
-            
-            if 'choices' in response and len(response['choices']) > 0:
-                return response['choices'][0]['message']['content']
-            else:
-                raise Exception(f"Unexpected API response: {response}")
         
         except Exception as e:
             logger.error(f"Error generating text: {e}")
+            if not fallback:
+                raise
             # Return fallback response on error
+            self._stats["fallbacks"] += 1
             return self._fallback_response(prompt)
     
+    async def stream_text(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 2000,
+        model: Optional[str] = None,
+        use_cache: bool = True,
+        fallback: bool = True
+    ) -> AsyncIterator[str]:
+        """
+        Stream generated text from OnlySq API token by token
+        
+        Yields content deltas as they arrive. Closing the generator early
+        (e.g. ``break`` or ``aclose()``) detaches this consumer; the upstream
+        request is aborted once no consumer is left.
+        If the request fails before anything was yielded, the fallback
+        response is yielded instead, unless fallback=False; later failures
+        are re-raised.
+        A cached response is yielded as a single chunk, and only streams
+        that run to completion are cached.
+        """
+        payload = self._build_payload(prompt, system_prompt, temperature, max_tokens, model)
+        cache_key = None
+        if use_cache and self.cache is not None:
+            cache_key = self.cache.make_key(payload)
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        
+        # Identical streams already in flight are shared and replayed
+        stream = self._inflight.stream(
+            f"stream:{LLMCache.make_key(payload)}",
+            lambda: self._stream_completion(payload, cache_key)
+        )
+        yielded = False
+        
+        try:
+            async for delta in stream:
+                yielded = True
+                yield delta
+        
+        except Exception as e:
+            logger.error(f"Error streaming text: {e}")
+            if yielded or not fallback:
+                raise
+            self._stats["fallbacks"] += 1
+            yield self._fallback_response(prompt)
+        
+        finally:
+            await stream.aclose()
+    
+    async def _complete(self, payload: Dict[str, Any], cache_key: Optional[str]) -> str:
+        """Run one chat completion upstream and cache the result"""
+        async with self._upstream_slots():
+            started = time.monotonic()
+            response = await self._request(
+                method='POST',
+                endpoint='/chat/completions',
+                json=payload
+            )
+        
+        if 'choices' in response and len(response['choices']) > 0:
+            content = response['choices'][0]['message']['content']
+            self.latency.record(payload['model'], time.monotonic() - started)
+            if cache_key is not None and content:
+                await self.cache.set(cache_key, content)
+            return content
+        else:
+            raise Exception(f"Unexpected API response: {response}")
+    
+    async def _hedged_complete(self, payload: Dict[str, Any], cache_key: Optional[str]) -> str:
+        """
+        Race the primary model against a delayed backup request
+        
+        The backup is only sent if the primary misses its hedge deadline
+        (or fails first). The loser is cancelled; the winner is cached under
+        the primary request's key.
+        """
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self._complete(payload, None))
+        pending = {primary}
+        last_error: Optional[BaseException] = None
+        backup_model = self._pick_hedge_model(payload['model'])
+        
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self._hedge_delay(payload['model']))
+            
+            while True:
+                for task in done:
+                    pending.discard(task)
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        continue
+                    content = task.result()
+                    if content and content.strip():
+                        if task is not primary:
+                            self._stats["hedge_wins"] += 1
+                        if cache_key is not None:
+                            await self.cache.set(cache_key, content)
+                        return content
+                
+                if backup_model is not None:
+                    logger.info(
+                        f"Hedging {payload['model']} request with backup model {backup_model}"
+                    )
+                    self._stats["hedged"] += 1
+                    pending.add(asyncio.ensure_future(
+                        self._complete({**payload, 'model': backup_model}, None)
+                    ))
+                    backup_model = None
+                
+                if not pending:
+                    raise last_error or Exception("Hedged request returned no valid answer")
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        
+        finally:
+            if primary in pending:
+                # A lower bound still keeps the percentile honest about slow models
+                self.latency.record(payload['model'], time.monotonic() - started)
+            for task in pending:
+                task.cancel()
+    
+    def _hedge_delay(self, model: str) -> float:
+        """Time to wait for the primary model before sending a backup request"""
+        observed = self.latency.percentile(model, config.ONLYSQ_HEDGE_PERCENTILE)
+        if observed is None:
+            return config.ONLYSQ_HEDGE_DEFAULT_DELAY
+        return min(max(observed, config.ONLYSQ_HEDGE_MIN_DELAY), self.total_timeout)
+    
+    def _pick_hedge_model(self, primary: str) -> Optional[str]:
+        """Pick the backup model with the best observed median latency"""
+        configured = [m.strip() for m in config.ONLYSQ_HEDGE_MODELS.split(',') if m.strip()]
+        candidates = [m for m in (configured or self.list_models()) if m != primary]
+        if not candidates:
+            return None
+        return self.latency.fastest(candidates)[0]
+    
+    async def _stream_completion(
+        self,
+        payload: Dict[str, Any],
+        cache_key: Optional[str]
+    ) -> AsyncIterator[str]:
+        """Stream one chat completion upstream and cache the full result"""
+        url = f"{self.base_url}/chat/completions"
+        payload = {**payload, 'stream': True}
+        deadline = time.monotonic() + self.total_timeout
+        chunks = []
+        
+        async def open_stream() -> httpx.Response:
+            client = self._get_client()
+            request = client.build_request('POST', url, json=payload)
+            response = await asyncio.wait_for(
+                client.send(request, stream=True),
+                timeout=self.total_timeout
+            )
+            if response.is_error:
+                await response.aread()
+                await response.aclose()
+            return response
+        
+        # The slot is held for the whole stream, not just while it opens
+        async with self._upstream_slots():
+            # Retries only cover opening the stream; once tokens flow they are final
+            response = await self._call_upstream(open_stream)
+            try:
+                async for line in response.aiter_lines():
+                    if time.monotonic() > deadline:
+                        raise asyncio.TimeoutError(
+                            f"Stream exceeded {self.total_timeout}s"
+                        )
+                    
+                    delta = self._parse_stream_line(line)
+                    if delta is None:
+                        continue
+                    if delta == '[DONE]':
+                        break
+                    
+                    chunks.append(delta)
+                    yield delta
+            except (httpx.HTTPError, asyncio.TimeoutError):
+                self.breaker.record_failure()
+                raise
+            finally:
+                await response.aclose()
+        
+        if cache_key is not None and chunks:
+            await self.cache.set(cache_key, ''.join(chunks))
+    
+    @staticmethod
+    def _parse_stream_line(line: str) -> Optional[str]:
+        """Extract the content delta from one server-sent event line"""
+        if not line.startswith('data:'):
+            return None
+        
+        data = line[5:].strip()
+        if data == '[DONE]':
+            return data
+        
+        try:
+            chunk = json.loads(data)
+            return chunk['choices'][0].get('delta', {}).get('content') or None
+        except (ValueError, KeyError, IndexError):
+            logger.debug(f"Skipping malformed stream chunk: {data[:100]}")
+            return None
+    
+    def _build_payload(
+        self,
+        prompt: str,
+        system_prompt: Optional[str],
+        temperature: float,
+        max_tokens: int,
+        model: Optional[str]
+    ) -> Dict[str, Any]:
+        """Build a chat completions request body"""
+        messages = []
+        
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        
+        messages.append({"role": "user", "content": prompt})
+        
+        return {
+            'model': model or self.model,
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'top_p': 0.95
+        }
+    
     async def _request(
         self,
         method: str,
@@ -68,22 +371,73 @@ class OnlySqClient:
         """Make request to OnlySq API"""
         url = f"{self.base_url}{endpoint}"
         
-        try:
-            response = self.client.request(
-                method,
-                url,
-                **kwargs,
-                timeout=30.0
+        async def send() -> httpx.Response:
+            return await asyncio.wait_for(
+                self._get_client().request(method, url, **kwargs),
+                timeout=self.total_timeout
             )
-            response.raise_for_status()
-            return response.json()
         
-        except httpx.HTTPError as e:
-            logger.error(f"HTTP Error: {e}")
-            raise
-        except Exception as e:
-            logger.error(f"Request Error: {e}")
-            raise
+        response = await self._call_upstream(send)
+        return response.json()
+    
+    async def _call_upstream(
+        self,
+        send: Callable[[], Awaitable[httpx.Response]]
+    ) -> httpx.Response:
+        """
+        Send a request through the rate limiter, retry policy and circuit breaker
+        
+        Raises CircuitOpenError without touching the network while the
+        breaker is open, and the last error once retries are exhausted.
+        """
+        attempt = 0
+        while True:
+            # Wait for a token first: once before_call() admits a half-open
+            # probe, nothing may await outside the try that releases it
+            await self.limiter.acquire()
+            self.breaker.before_call()
+            self._stats["requests"] += 1
+            retry_after = None
+            
+            try:
+                response = await send()
+                if response.status_code == 429:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    self.limiter.on_throttled(retry_after)
+                response.raise_for_status()
+                
+                self.breaker.record_success()
+                self.limiter.on_success()
+                return response
+            
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                retryable = self.retry_policy.is_retryable(e)
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    # The upstream answered; the request itself was bad
+                    self.breaker.record_success()
+                
+                if not retryable or attempt + 1 >= self.retry_policy.max_attempts:
+                    self._stats["failures"] += 1
+                    if isinstance(e, asyncio.TimeoutError):
+                        logger.error(f"Request exceeded {self.total_timeout}s")
+                    elif isinstance(e, httpx.HTTPError):
+                        logger.error(f"HTTP Error: {e}")
+                    else:
+                        logger.error(f"Request Error: {e}")
+                    raise
+                
+                delay = self.retry_policy.backoff(attempt, retry_after)
+                attempt += 1
+                self._stats["retries"] += 1
+                logger.warning(
+                    f"Transient upstream error ({e!r}), retry {attempt} in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
     
     def _fallback_response(self, prompt: str) -> str:
         """Return fallback response if API fails"""
@@ -95,6 +449,23 @@ class OnlySqClient:
         else:
             return "BasicBot"
     
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Return response cache counters (empty if caching is disabled)"""
+        return self.cache.stats() if self.cache is not None else {}
+    
+    def get_resilience_stats(self) -> Dict[str, Any]:
+        """Return request/retry counters, limiter and circuit breaker state"""
+        return {
+            **self._stats,
+            "circuit_breaker": self.breaker.stats(),
+            "rate_limiter": self.limiter.stats(),
+            "model_latency": self.latency.stats()
+        }
+    
+    def get_coalescing_stats(self) -> Dict[str, int]:
+        """Return counters for requests that joined an identical in-flight call"""
+        return self._inflight.stats()
+    
     def list_models(self) -> List[str]:
         """List available models on OnlySq"""
         return [
@@ -111,12 +482,14 @@ class OnlySqClient:
             'mistral-large'
         ]
     
-    def close(self):
-        """Close the client"""
-        self.client.close()
+    async def close(self):
+        """Close the client and release pooled connections"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
     
-    def __enter__(self):
+    async def __aenter__(self):
         return self
     
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.close()
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
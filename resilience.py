@@ -0,0 +1,231 @@
+"""Rate limiting, retry, circuit breaking and latency tracking for upstream API calls"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, Deque, List
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit breaker is open"""
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delta-seconds or HTTP-date) into seconds"""
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose refill rate adapts to upstream throttling
+
+    Each 429 halves the rate (down to ``min_rate``) and a Retry-After
+    header pauses all callers until it expires. Successful calls raise the
+    rate back towards the configured maximum additively.
+    """
+
+    def __init__(self, rate: float, burst: int, min_rate: float = 0.2):
+        if rate <= 0:
+            raise ValueError(f"Rate limit must be positive, got {rate}")
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.throttled = 0
+
+    async def acquire(self):
+        """Wait until a request may be sent"""
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        """Recover the rate after an accepted request"""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def on_throttled(self, retry_after: Optional[float] = None):
+        """Back off after a 429 response"""
+        self.throttled += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = min(self.tokens, 0.0)
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        logger.warning(
+            f"Upstream throttled request, rate lowered to {self.rate:.2f}/s"
+            + (f", pausing {retry_after:.1f}s" if retry_after else "")
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate": round(self.rate, 3),
+            "max_rate": self.max_rate,
+            "throttled": self.throttled,
+            "paused_for": max(0.0, round(self.blocked_until - time.monotonic(), 1))
+        }
+
+class RetryPolicy:
+    """Bounded retries with full-jitter exponential backoff"""
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def is_retryable(error: BaseException) -> bool:
+        """Timeouts, transport failures, 429 and 5xx are worth retrying"""
+        if isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+            return status == 429 or status >= 500
+        return isinstance(error, (httpx.TimeoutException, httpx.TransportError, asyncio.TimeoutError))
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Delay before retry number ``attempt`` (0-based)"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open circuit breaker
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls fail fast with CircuitOpenError. Once ``reset_timeout`` has passed
+    a single probe call is let through; its outcome closes or re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call must not reach the upstream"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpenError("Circuit breaker is open, upstream marked unavailable")
+            self.state = self.HALF_OPEN
+            logger.info("Circuit breaker half-open, sending probe request")
+
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                self.rejected += 1
+                raise CircuitOpenError("Circuit breaker is half-open, probe in progress")
+            self._probe_in_flight = True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("Circuit breaker closed, upstream recovered")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+                logger.warning(f"Circuit breaker opened after {self.failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Free the half-open probe slot when a call ends without a verdict"""
+        self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        retry_in = None
+        if self.state == self.OPEN:
+            retry_in = max(0.0, round(self.reset_timeout - (time.monotonic() - self.opened_at), 1))
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "retry_in": retry_in
+        }
+
+class LatencyTracker:
+    """Rolling per-key latency samples with percentile queries"""
+
+    def __init__(self, window: int = 100, min_samples: int = 5):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, key: str, seconds: float):
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def percentile(self, key: str, fraction: float) -> Optional[float]:
+        """Return the given percentile (0-1), or None without enough samples"""
+        samples = self._samples.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+        return ordered[index]
+
+    def fastest(self, keys: List[str]) -> List[str]:
+        """Order keys by median latency; keys without enough samples go last"""
+        def median(key: str) -> float:
+            value = self.percentile(key, 0.5)
+            return value if value is not None else float('inf')
+        return sorted(keys, key=median)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            key: {
+                "samples": len(samples),
+                "p50": self.percentile(key, 0.5),
+                "p90": self.percentile(key, 0.9)
+            }
+            for key, samples in self._samples.items()
+        }
@@ -0,0 +1,256 @@
+"""
+Per-bot resource accounting sampled from /proc
+
+One timer samples every bot process and bot host each interval, reading
+/proc/<pid>/stat and counting /proc/<pid>/fd in a worker thread, and keeps
+a rolling window of samples per process. Limits are checked against the
+windows:
+
+- RSS over the cap restarts the bot
+- CPU above its share, averaged over a full window, renices the bot to 19
+  until it drops below half the share
+- The open files cap is set as RLIMIT_NOFILE at launch; a bot found at
+  the cap is leaking and is restarted
+
+Bots in a shared bot host can't be told apart in /proc; they report their
+host's numbers, and limits only apply to bots with a process of their own.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_MB = 1024 * 1024
+# Niceness of throttled bots
+_THROTTLED_NICE = 19
+
+def available() -> bool:
+    return os.path.isdir('/proc/self/fd')
+
+@dataclass
+class Sample:
+    time: float
+    # User plus system CPU seconds since the process started
+    cpu: float
+    rss: int
+    fds: Optional[int]
+    threads: int
+
+def read_process(pid: int) -> Optional[Sample]:
+    """One sample of a live process, or None if it is gone"""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    try:
+        values = stat[stat.rindex(b")") + 2:].split()
+        if values[0] in (b"Z", b"X"):
+            return None
+        cpu = (int(values[11]) + int(values[12])) / _CLOCK_TICKS
+        threads, rss = int(values[17]), int(values[21]) * _PAGE_SIZE
+    except (ValueError, IndexError):
+        return None
+    try:
+        fds: Optional[int] = len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        fds = None
+    return Sample(time.monotonic(), cpu, rss, fds, threads)
+
+class ProcessWindow:
+    """Recent samples of one process"""
+
+    def __init__(self, pid: int, size: int):
+        self.pid = pid
+        self.samples: Deque[Sample] = deque(maxlen=size)
+        self.throttled = False
+        # Lowering niceness needs privileges; without them a throttled bot stays throttled
+        self.stuck = False
+
+    @property
+    def full(self) -> bool:
+        return len(self.samples) == self.samples.maxlen
+
+    def usage(self) -> Dict[str, Any]:
+        last, first = self.samples[-1], self.samples[0]
+        elapsed = last.time - first.time
+        return {
+            "pid": self.pid,
+            "rss_mb": round(last.rss / _MB, 1),
+            "rss_peak_mb": round(max(sample.rss for sample in self.samples) / _MB, 1),
+            # Share of one core over the window
+            "cpu_percent": round(100 * (last.cpu - first.cpu) / elapsed, 1) if elapsed > 0 else None,
+            "fds": last.fds,
+            "threads": last.threads,
+            "throttled": self.throttled
+        }
+
+class ResourceMonitor:
+    """Samples an executor's bot processes and bot hosts on one shared timer"""
+
+    def __init__(
+        self,
+        executor,
+        interval: float = 5,
+        window: int = 12,
+        max_rss_mb: float = 0,
+        max_cpu_percent: float = 0,
+        max_open_files: int = 0,
+        nice: int = 0
+    ):
+        self.executor = executor
+        self.interval = interval
+        self.window = max(2, window)
+        self.max_rss_mb = max_rss_mb
+        self.max_cpu_percent = max_cpu_percent
+        self.max_open_files = max_open_files
+        self.nice = nice
+        # bot_id, or "host:<index>" for bot hosts -> samples
+        self.windows: Dict[str, ProcessWindow] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def prepare(self, pid: Optional[int], limit_files: bool = True):
+        """Apply the niceness and open files cap to a freshly launched process"""
+        if not pid:
+            return
+        if self.nice and hasattr(os, 'setpriority'):
+            try:
+                os.setpriority(os.PRIO_PROCESS, pid, self.nice)
+            except OSError as e:
+                logger.warning(f"Could not renice PID {pid}: {e}")
+        if limit_files and self.max_open_files and resource is not None and hasattr(resource, 'prlimit'):
+            try:
+                _, hard = resource.prlimit(pid, resource.RLIMIT_NOFILE)
+                cap = self.max_open_files if hard == resource.RLIM_INFINITY else min(self.max_open_files, hard)
+                resource.prlimit(pid, resource.RLIMIT_NOFILE, (cap, cap))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not limit open files of PID {pid}: {e}")
+
+    def start(self):
+        if self._task is None and available():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _targets(self) -> List[Tuple[str, int]]:
+        targets = []
+        for bot in self.executor.bots.values():
+            if bot.status == "running" and bot.host is None and bot.node is None and bot.pid:
+                targets.append((bot.bot_id, bot.pid))
+        for host in self.executor.hosts:
+            if host is not None and host.alive:
+                targets.append((f"host:{host.index}", host.pid))
+        return targets
+
+    @staticmethod
+    def _sample_all(targets: List[Tuple[str, int]]) -> Dict[str, Optional[Sample]]:
+        return {key: read_process(pid) for key, pid in targets}
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                targets = self._targets()
+                samples = await loop.run_in_executor(None, self._sample_all, targets)
+                self._record(targets, samples)
+                await self._enforce()
+            except Exception as e:
+                logger.error(f"Error sampling bot resources: {e}")
+
+    def _record(self, targets: List[Tuple[str, int]], samples: Dict[str, Optional[Sample]]):
+        windows = {}
+        for key, pid in targets:
+            window = self.windows.get(key)
+            if window is None or window.pid != pid:
+                # New process, e.g. after a restart; start over
+                window = ProcessWindow(pid, self.window)
+            sample = samples.get(key)
+            if sample is not None:
+                window.samples.append(sample)
+            if window.samples:
+                windows[key] = window
+        self.windows = windows
+
+    async def _enforce(self):
+        victims: Dict[str, str] = {}
+        for key, window in self.windows.items():
+            bot = self.executor.bots.get(key)
+            if bot is None or bot.status != "running" or bot.unhealthy:
+                continue
+            usage = window.usage()
+            if self.max_rss_mb and usage["rss_mb"] > self.max_rss_mb:
+                victims[key] = f"RSS {usage['rss_mb']:.0f} MB over the {self.max_rss_mb:.0f} MB limit"
+            elif self.max_open_files and usage["fds"] is not None and usage["fds"] >= self.max_open_files:
+                victims[key] = f"{usage['fds']} open files, at the {self.max_open_files} limit"
+            elif self.max_cpu_percent and usage["cpu_percent"] is not None:
+                if not window.throttled and window.full and usage["cpu_percent"] > self.max_cpu_percent:
+                    if self._renice(window.pid, _THROTTLED_NICE):
+                        window.throttled = True
+                        logger.warning(
+                            f"Throttling bot {key}: {usage['cpu_percent']}% CPU over "
+                            f"the {self.max_cpu_percent:.0f}% share"
+                        )
+                elif window.throttled and not window.stuck and usage["cpu_percent"] < self.max_cpu_percent / 2:
+                    if self._renice(window.pid, self.nice):
+                        window.throttled = False
+                        logger.info(f"Bot {key} is back under its CPU share")
+                    else:
+                        window.stuck = True
+
+        for bot_id, reason in victims.items():
+            logger.warning(f"Restarting bot {bot_id}: {reason}")
+            self.executor.bots[bot_id].unhealthy = reason
+        if victims:
+            await asyncio.gather(*(self.executor.kill_bot(bot_id) for bot_id in victims), return_exceptions=True)
+
+    @staticmethod
+    def _renice(pid: int, nice: int) -> bool:
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, nice)
+            return True
+        except (OSError, AttributeError) as e:
+            # Lowering niceness again needs CAP_SYS_NICE
+            logger.warning(f"Could not renice PID {pid} to {nice}: {e}")
+            return False
+
+    def usage(self, bot_id: str) -> Optional[Dict[str, Any]]:
+        """Latest numbers for a bot; hosted bots get their host's, marked shared"""
+        window = self.windows.get(bot_id)
+        if window is not None:
+            return window.usage()
+        bot = self.executor.bots.get(bot_id)
+        if bot is None or bot.host is None or bot.status != "running":
+            return None
+        window = self.windows.get(f"host:{bot.host.index}")
+        if window is None:
+            return None
+        usage = window.usage()
+        usage["shared"] = bot.host.load
+        return usage
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Usage of every running bot that has samples"""
+        result = {}
+        for bot_id in self.executor.bots:
+            usage = self.usage(bot_id)
+            if usage is not None:
+                result[bot_id] = usage
+        return result
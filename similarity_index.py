@@ -0,0 +1,273 @@
+"""Near-duplicate search over bot descriptions using MinHash and LSH"""
+
+import logging
+import os
+import random
+import re
+import struct
+import zlib
+from array import array
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# File layout: header, then append-only records
+#   header: magic, version, num_perm, seed
+#   record: op (1 = add, 0 = remove), id length, id bytes, [num_perm x uint32]
+_MAGIC = b"BSIX"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHHI")
+_RECORD = struct.Struct("<BB")
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+class SimilarityIndex:
+    """
+    Find stored descriptions that are close paraphrases of a new one
+
+    Descriptions are reduced to character shingles and summarized by a
+    MinHash signature, whose matching positions estimate Jaccard similarity.
+    Signatures are split into bands for locality-sensitive hashing, so a
+    query only compares against bots sharing at least one band bucket
+    instead of scanning every stored description.
+
+    Adds and removals are appended to a compact binary file; the band
+    buckets are rebuilt from the signatures on load.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        num_perm: int = 128,
+        bands: int = 32,
+        shingle_size: int = 5,
+        seed: int = 1
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+
+        rng = random.Random(seed)
+        self._perms = [
+            (rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)
+        ]
+        self._signatures: Dict[str, array] = {}
+        self._buckets: List[Dict[bytes, Set[str]]] = [{} for _ in range(bands)]
+        self._dead_records = 0
+
+        if path:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._signatures
+
+    def shingles(self, text: str) -> Set[int]:
+        """Hash the character shingles of normalized text"""
+        normalized = " ".join(re.findall(r"\w+", text.lower()))
+        k = self.shingle_size
+        if len(normalized) <= k:
+            return {zlib.crc32(normalized.encode("utf-8"))} if normalized else set()
+        return {
+            zlib.crc32(normalized[i:i + k].encode("utf-8"))
+            for i in range(len(normalized) - k + 1)
+        }
+
+    def signature(self, text: str) -> array:
+        """MinHash signature of a text"""
+        shingles = self.shingles(text)
+        if not shingles:
+            return array("I", [_MAX_HASH] * self.num_perm)
+        return array("I", [
+            min((a * s + b) % _PRIME for s in shingles) & _MAX_HASH
+            for a, b in self._perms
+        ])
+
+    def add(self, item_id: str, text: str):
+        """Index a description, replacing any previous entry for the id"""
+        if item_id in self._signatures:
+            self.remove(item_id)
+        signature = self.signature(text)
+        self._insert(item_id, signature)
+        self._append(1, item_id, signature)
+
+    def remove(self, item_id: str) -> bool:
+        """Drop an id from the index"""
+        if not self._unindex(item_id):
+            return False
+        self._append(0, item_id)
+        # The removal and the add it cancels are both dead weight now
+        self._dead_records += 2
+        return True
+
+    def query(
+        self,
+        text: str,
+        threshold: float = 0.5,
+        limit: int = 3,
+        accept: Optional[Callable[[str], bool]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Find indexed ids similar to a text, only among ids ``accept`` allows if given
+
+        Returns:
+            (id, estimated Jaccard similarity) pairs, best first
+        """
+        signature = self.signature(text)
+        candidates: Set[str] = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            candidates.update(self._buckets[band].get(key, ()))
+
+        matches = []
+        for item_id in candidates:
+            other = self._signatures[item_id]
+            similarity = sum(1 for x, y in zip(signature, other) if x == y) / self.num_perm
+            if similarity >= threshold:
+                matches.append((item_id, similarity))
+        matches.sort(key=lambda match: match[1], reverse=True)
+        if accept is not None:
+            # Best first, so ``accept`` only sees as many ids as it takes to fill the limit
+            matches = list(islice((match for match in matches if accept(match[0])), limit))
+        return matches[:limit]
+
+    def sync(self, items: Iterable[Tuple[str, str]]):
+        """Add missing ids and drop ids that are no longer present"""
+        wanted = {}
+        for item_id, text in items:
+            wanted[item_id] = text
+
+        removed = [item_id for item_id in self._signatures if item_id not in wanted]
+        for item_id in removed:
+            self.remove(item_id)
+        added = 0
+        for item_id, text in wanted.items():
+            if item_id not in self._signatures:
+                self.add(item_id, text)
+                added += 1
+
+        if added or removed:
+            logger.info(f"Similarity index synced: {added} added, {len(removed)} removed")
+        if self._dead_records > max(1000, len(self._signatures)):
+            self.compact()
+
+    def compact(self):
+        """Rewrite the index file without removed entries"""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, _VERSION, self.num_perm, self.seed))
+                for item_id, signature in self._signatures.items():
+                    f.write(self._encode(1, item_id, signature))
+            os.replace(tmp_path, self.path)
+            self._dead_records = 0
+            logger.info(f"Similarity index compacted: {len(self._signatures)} entries")
+        except OSError as e:
+            logger.error(f"Error compacting similarity index: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._signatures),
+            "buckets": sum(len(buckets) for buckets in self._buckets),
+            "file_bytes": os.path.getsize(self.path) if self.path and os.path.exists(self.path) else 0
+        }
+
+    def _band_keys(self, signature: array) -> List[bytes]:
+        rows = self.rows
+        return [signature[band * rows:(band + 1) * rows].tobytes() for band in range(self.bands)]
+
+    def _insert(self, item_id: str, signature: array):
+        self._signatures[item_id] = signature
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band].setdefault(key, set()).add(item_id)
+
+    def _unindex(self, item_id: str) -> bool:
+        signature = self._signatures.pop(item_id, None)
+        if signature is None:
+            return False
+        for band, key in enumerate(self._band_keys(signature)):
+            bucket = self._buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(item_id)
+                if not bucket:
+                    del self._buckets[band][key]
+        return True
+
+    def _encode(self, op: int, item_id: str, signature: Optional[array] = None) -> bytes:
+        raw_id = item_id.encode("utf-8")[:255]
+        record = _RECORD.pack(op, len(raw_id)) + raw_id
+        if signature is not None:
+            record += signature.tobytes()
+        return record
+
+    def _append(self, op: int, item_id: str, signature: Optional[array] = None):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "ab") as f:
+                if f.tell() == 0:
+                    f.write(_HEADER.pack(_MAGIC, _VERSION, self.num_perm, self.seed))
+                f.write(self._encode(op, item_id, signature))
+        except OSError as e:
+            logger.error(f"Error writing similarity index: {e}")
+
+    def _load(self):
+        """Replay the index file; a mismatched or damaged file is rebuilt later by sync()"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            logger.error(f"Error reading similarity index: {e}")
+            return
+
+        if len(data) < _HEADER.size:
+            self._discard_file("truncated header")
+            return
+        magic, version, num_perm, seed = _HEADER.unpack_from(data)
+        if (magic, version, num_perm, seed) != (_MAGIC, _VERSION, self.num_perm, self.seed):
+            self._discard_file("format or parameters changed")
+            return
+
+        sig_bytes = self.num_perm * 4
+        offset = _HEADER.size
+        records = 0
+        while offset + _RECORD.size <= len(data):
+            op, id_len = _RECORD.unpack_from(data, offset)
+            start = offset + _RECORD.size
+            end = start + id_len + (sig_bytes if op == 1 else 0)
+            if end > len(data):
+                # Torn final write; everything before it is intact
+                break
+            item_id = data[start:start + id_len].decode("utf-8", errors="replace")
+            if op == 1:
+                signature = array("I")
+                signature.frombytes(data[start + id_len:end])
+                if self._unindex(item_id):
+                    self._dead_records += 1
+                self._insert(item_id, signature)
+            elif self._unindex(item_id):
+                self._dead_records += 2
+            offset = end
+            records += 1
+
+        logger.info(f"Similarity index loaded: {len(self._signatures)} entries from {records} records")
+        if offset < len(data):
+            self.compact()
+
+    def _discard_file(self, reason: str):
+        logger.warning(f"Rebuilding similarity index ({reason})")
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            logger.error(f"Error removing similarity index: {e}")
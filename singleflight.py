@@ -0,0 +1,151 @@
+"""Coalescing of identical in-flight async calls"""
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class _Flight:
+    """One shared upstream call and the callers waiting on it"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class _StreamFlight:
+    """One shared upstream stream, buffered so late joiners replay it"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Event()
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+
+class SingleFlight:
+    """
+    Collapse concurrent calls that share a key into one execution
+
+    The first caller for a key starts the work in a task; later callers
+    await the same task. A caller being cancelled only detaches that
+    caller - the shared work is cancelled once nobody is waiting for it.
+    Errors are delivered to every waiter.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Flight] = {}
+        self._streams: Dict[str, _StreamFlight] = {}
+        self._stats = {"calls": 0, "coalesced": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn() once for all concurrent callers using the same key"""
+        self._stats["calls"] += 1
+        flight = self._calls.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._calls[key] = flight
+            flight.task.add_done_callback(lambda task: self._forget_call(key, flight))
+        else:
+            self._stats["coalesced"] += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                # Last interested caller left; stop the upstream work and make
+                # sure newcomers start fresh instead of joining a dying task
+                self._forget_call(key, flight)
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    async def stream(
+        self,
+        key: str,
+        factory: Callable[[], AsyncIterator[str]]
+    ) -> AsyncIterator[str]:
+        """
+        Share one async iterator between concurrent consumers of the same key
+
+        Each consumer receives every chunk from the start, even if it joined
+        after the upstream stream began.
+        """
+        self._stats["calls"] += 1
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = _StreamFlight()
+            self._streams[key] = flight
+            flight.task = asyncio.ensure_future(self._pump(key, flight, factory))
+        else:
+            self._stats["coalesced"] += 1
+
+        flight.subscribers += 1
+        position = 0
+        try:
+            while True:
+                if position < len(flight.chunks):
+                    chunk = flight.chunks[position]
+                    position += 1
+                    yield chunk
+                    continue
+
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+
+                await flight.changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+                flight.task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        """Return call and coalescing counters"""
+        return {
+            **self._stats,
+            "in_flight": len(self._calls) + len(self._streams)
+        }
+
+    def _forget_call(self, key: str, flight: _Flight):
+        if self._calls.get(key) is flight:
+            del self._calls[key]
+        if flight.task.done() and not flight.task.cancelled():
+            # Mark the exception retrieved; waiters already received it
+            flight.task.exception()
+
+    async def _pump(
+        self,
+        key: str,
+        flight: _StreamFlight,
+        factory: Callable[[], AsyncIterator[str]]
+    ):
+        """Drain the upstream iterator into the shared buffer"""
+        source = factory()
+        try:
+            async for chunk in source:
+                flight.chunks.append(chunk)
+                self._notify(flight)
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            await source.aclose()
+            flight.done = True
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+            self._notify(flight)
+
+    @staticmethod
+    def _notify(flight: _StreamFlight):
+        """Wake every consumer waiting for new chunks"""
+        flight.changed.set()
+        flight.changed = asyncio.Event()
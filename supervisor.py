@@ -0,0 +1,389 @@
+"""Restart supervision and liveness checks for launched bots"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from config import config
+from bot_executor import BotExecutor, BotProcess
+from bot_state import BotRecord
+from database import JSONDatabase
+from hibernation import WakeReceiver
+
+logger = logging.getLogger(__name__)
+
+RESTART_POLICIES = ('on-failure', 'always', 'never')
+
+# Called with a bot id and token once the bot is stopped for good
+ReleaseCallback = Callable[[str, str], Awaitable[None]]
+
+@dataclass
+class RestartPolicy:
+    """When and how quickly a bot is restarted after it exits"""
+    restart: str = 'on-failure'
+    # More failures than this within ``window`` seconds is a crash loop
+    max_restarts: int = 5
+    window: float = 600
+    backoff_initial: float = 2
+    backoff_max: float = 300
+
+    def should_restart(self, bot: BotProcess) -> bool:
+        if self.restart == 'never' or (bot.stop_requested and not bot.unhealthy):
+            return False
+        return self.restart == 'always' or bot.status == 'error'
+
+    def delay(self, failures: int) -> float:
+        """Exponential backoff with jitter, so bots crashing together don't restart together"""
+        base = min(self.backoff_max, self.backoff_initial * 2 ** max(0, failures - 1))
+        return base * random.uniform(0.8, 1.2)
+
+    @classmethod
+    def from_config(cls, restart: Optional[str] = None) -> 'RestartPolicy':
+        restart = restart or config.BOT_RESTART_POLICY
+        if restart not in RESTART_POLICIES:
+            logger.warning(f"Unknown restart policy {restart!r}, using on-failure")
+            restart = 'on-failure'
+        return cls(
+            restart=restart,
+            max_restarts=config.BOT_RESTART_MAX,
+            window=config.BOT_RESTART_WINDOW,
+            backoff_initial=config.BOT_RESTART_BACKOFF_INITIAL,
+            backoff_max=config.BOT_RESTART_BACKOFF_MAX
+        )
+
+@dataclass
+class SupervisedBot:
+    """Everything needed to launch a bot again"""
+    bot_code_path: str
+    bot_name: str
+    bot_token: str
+    bot_id: str
+    policy: RestartPolicy
+    # Monotonic times of failures inside the policy window
+    failures: Deque[float] = field(default_factory=deque)
+    restarts: int = 0
+    restart_task: Optional[asyncio.Task] = None
+    # Stopped for being idle; the wake receiver relaunches it on its next update
+    hibernating: bool = False
+
+class BotSupervisor:
+    """
+    Launches bots through the executor and keeps them running
+
+    Exits are reported by the executor; failed bots are relaunched after
+    an exponential backoff until they fail more than the policy allows
+    within its window, at which point they are left "crashed". A periodic
+    liveness check kills hung bots so they go through the same path, and
+    hibernates bots that got no update for a while until one arrives.
+    Every status transition is written to the database, so /status only
+    reads stored state.
+    """
+
+    def __init__(self, executor: BotExecutor, database: JSONDatabase):
+        self.executor = executor
+        self.db = database
+        self.bots: Dict[str, SupervisedBot] = {}
+        self._health_task: Optional[asyncio.Task] = None
+        # Bounds how many restarts launch at once
+        self._launch_slots: Optional[asyncio.Semaphore] = None
+        self.receiver = WakeReceiver(self.wake, self._wake_rejected, poll_timeout=config.BOT_WAKE_POLL_TIMEOUT)
+        # Undoes what launching set up outside the bot, e.g. its webhook
+        self.released: Optional[ReleaseCallback] = None
+        executor.exit_listeners.append(self._on_exit)
+
+    async def launch(
+        self,
+        bot_code_path: str,
+        bot_name: str,
+        bot_token: str,
+        bot_id: str,
+        policy: Optional[RestartPolicy] = None
+    ) -> BotProcess:
+        """Launch a bot and supervise it from now on"""
+        previous = self.bots.pop(bot_id, None)
+        if previous is not None and previous.restart_task is not None:
+            previous.restart_task.cancel()
+        self.receiver.cancel(bot_id)
+
+        policy = policy or RestartPolicy.from_config((self.db.get_bot(bot_id) or {}).get('restart_policy'))
+        entry = SupervisedBot(bot_code_path, bot_name, bot_token, bot_id, policy)
+        try:
+            bot_process = await self.executor.launch_bot(bot_code_path, bot_name, bot_token, bot_id)
+        except Exception as e:
+            self._record(bot_id, 'error', error=str(e))
+            raise
+        self.bots[bot_id] = entry
+        self._record(bot_id, 'running', process_id=bot_process.pid, restarts=0, error=None)
+        return bot_process
+
+    async def recover(self, stagger: Optional[float] = None) -> int:
+        """
+        Take over the bots the previous run left behind
+
+        Bot processes still alive are reattached and supervised as if
+        launched here. Hibernated bots go back to sleep until their next
+        update. The rest are relaunched in the background,
+        ``stagger`` seconds apart and at most BOT_RELAUNCH_CONCURRENCY at a
+        time, so hundreds of bots don't all import and connect at once.
+        Bots the database still shows as running that weren't recovered
+        are marked stopped.
+
+        Returns:
+            Number of bots reattached or queued for relaunch
+        """
+        stagger = config.BOT_RECOVERY_STAGGER if stagger is None else stagger
+        reattached, relaunch = await self.executor.recover()
+        known = self.db.get_all_bots()
+
+        for record in reattached:
+            if record.bot_id not in known:
+                # Deleted while the generator was down
+                await self.executor.stop_bot(record.bot_id, force=True)
+                continue
+            self.bots[record.bot_id] = self._entry(record, known[record.bot_id])
+            self._record(record.bot_id, 'running', process_id=self.executor.bots[record.bot_id].pid, error=None)
+
+        queued = 0
+        for record in relaunch:
+            if record.bot_id not in known:
+                await self._release(record.bot_id, record.token)
+                continue
+            entry = self.bots[record.bot_id] = self._entry(record, known[record.bot_id])
+            if record.hibernated:
+                self._hibernated(entry)
+                continue
+            self._restart_after(entry, queued * stagger, None, counted=False)
+            queued += 1
+
+        recovered = {record.bot_id for record in reattached + relaunch}
+        for bot_id, data in known.items():
+            if bot_id not in recovered and data.get('status') in ('running', 'restarting'):
+                self._record(bot_id, 'stopped', process_id=None, next_restart_at=None)
+        return len(self.bots)
+
+    @staticmethod
+    def _entry(record: BotRecord, data: dict) -> SupervisedBot:
+        return SupervisedBot(
+            record.code_path, record.name, record.token, record.bot_id,
+            RestartPolicy.from_config(data.get('restart_policy')),
+            restarts=data.get('restarts') or 0
+        )
+
+    async def stop(self, bot_id: str, force: bool = True) -> bool:
+        """Stop a bot for good, including one waiting to be restarted or woken"""
+        entry = self.bots.pop(bot_id, None)
+        if entry is not None and entry.hibernating:
+            self.receiver.cancel(bot_id)
+            await self._release(bot_id, entry.bot_token)
+            self._record(bot_id, 'stopped', next_restart_at=None)
+            return True
+        pending_restart = entry is not None and entry.restart_task is not None and not entry.restart_task.done()
+        if pending_restart:
+            entry.restart_task.cancel()
+
+        bot = self.executor.bots.get(bot_id)
+        stopped = await self.executor.stop_bot(bot_id, force=force)
+        if stopped or pending_restart:
+            token = entry.bot_token if entry is not None else getattr(bot, 'token', None)
+            await self._release(bot_id, token)
+            self._record(bot_id, 'stopped', next_restart_at=None)
+            return True
+        if entry is not None:
+            # Couldn't stop it; keep supervising
+            self.bots[bot_id] = entry
+        return False
+
+    async def _on_exit(self, bot: BotProcess):
+        entry = self.bots.get(bot.bot_id)
+        if entry is None:
+            self._record_exit(bot)
+            if not self.executor.closing:
+                await self._release(bot.bot_id, bot.token)
+            return
+        if bot is not self.executor.bots.get(bot.bot_id):
+            # Superseded by a newer launch of the same bot
+            return
+        if bot.status == 'hibernating':
+            self._hibernated(entry)
+            return
+
+        if not entry.policy.should_restart(bot):
+            self.bots.pop(bot.bot_id, None)
+            self._record_exit(bot)
+            await self._release(bot.bot_id, bot.token)
+            return
+
+        if bot.status == 'error':
+            self._schedule_restart(entry, bot.error_message or f"Exited with code {bot.exit_code}")
+        else:
+            # "always" restarts clean exits without counting them as failures
+            self._restart_after(entry, entry.policy.backoff_initial, None)
+
+    async def hibernate_idle(self, idle_timeout: float) -> int:
+        """
+        Hibernate supervised bots that got no update for ``idle_timeout`` seconds
+
+        Returns:
+            Number of bots hibernated
+        """
+        idle = []
+        for bot_id, entry in self.bots.items():
+            seconds = self.executor.idle_seconds(bot_id)
+            if seconds is not None and seconds >= idle_timeout and not entry.hibernating:
+                idle.append(bot_id)
+        if not idle:
+            return 0
+        results = await asyncio.gather(*(self.executor.hibernate_bot(bot_id) for bot_id in idle), return_exceptions=True)
+        return sum(1 for result in results if result is True)
+
+    def wanted(self, bot_id: str) -> bool:
+        """Whether a bot is supervised: running, waiting to restart or hibernating"""
+        return bot_id in self.bots
+
+    async def _release(self, bot_id: str, token: Optional[str]):
+        """Forget a bot that ended for good and undo its webhook"""
+        self.executor.forget(bot_id)
+        if self.released is not None and token:
+            try:
+                await self.released(bot_id, token)
+            except Exception as e:
+                logger.error(f"Error releasing bot {bot_id}: {e}")
+
+    def _hibernated(self, entry: SupervisedBot):
+        entry.hibernating = True
+        self._record(entry.bot_id, 'hibernating', process_id=None, next_restart_at=None, error=None)
+        self.receiver.watch(entry.bot_id, entry.bot_token)
+
+    async def wake(self, bot_id: str):
+        """Relaunch a hibernated bot; it picks up the updates queued while it slept"""
+        entry = self.bots.get(bot_id)
+        if entry is None or not entry.hibernating:
+            return
+        entry.hibernating = False
+        logger.info(f"Waking bot {bot_id}")
+        self._restart_after(entry, 0, None, counted=False)
+
+    def _wake_rejected(self, bot_id: str, reason: str):
+        """A hibernated bot whose token stopped working can't be woken; give up on it"""
+        entry = self.bots.get(bot_id)
+        if entry is None or not entry.hibernating:
+            return
+        self.bots.pop(bot_id, None)
+        self._record(bot_id, 'error', error=f"Token rejected while hibernating: {reason}")
+        self.executor.forget(bot_id)
+
+    def _record_exit(self, bot: BotProcess):
+        if bot.status == 'error':
+            self._record(bot.bot_id, 'error', error=bot.error_message, last_exit_code=bot.exit_code)
+        else:
+            self._record(bot.bot_id, 'stopped', last_exit_code=bot.exit_code)
+
+    def _schedule_restart(self, entry: SupervisedBot, reason: str):
+        """Count a failure and restart after a backoff, unless the bot is crash looping"""
+        now = time.monotonic()
+        entry.failures.append(now)
+        while entry.failures and now - entry.failures[0] > entry.policy.window:
+            entry.failures.popleft()
+
+        if len(entry.failures) > entry.policy.max_restarts:
+            self.bots.pop(entry.bot_id, None)
+            logger.error(
+                f"Bot {entry.bot_id} is crash looping ({len(entry.failures)} failures "
+                f"in {entry.policy.window:.0f}s); giving up"
+            )
+            self._record(
+                entry.bot_id, 'crashed',
+                error=f"Crash loop: {len(entry.failures)} failures in {entry.policy.window:.0f}s. Last: {reason}",
+                next_restart_at=None
+            )
+            asyncio.ensure_future(self._release(entry.bot_id, entry.bot_token))
+            return
+
+        self._restart_after(entry, entry.policy.delay(len(entry.failures)), reason)
+
+    def _restart_after(self, entry: SupervisedBot, delay: float, reason: Optional[str], counted: bool = True):
+        if reason or counted:
+            logger.warning(f"Restarting bot {entry.bot_id} in {delay:.1f}s" + (f": {reason}" if reason else ""))
+        self._record(
+            entry.bot_id, 'restarting',
+            error=reason,
+            next_restart_at=(datetime.now() + timedelta(seconds=delay)).isoformat(timespec='seconds')
+        )
+        entry.restart_task = asyncio.ensure_future(self._restart_later(entry, delay, counted))
+
+    async def _restart_later(self, entry: SupervisedBot, delay: float, counted: bool = True):
+        """Relaunch after ``delay``, waiting for a launch slot; ``counted`` restarts add to the bot's tally"""
+        await asyncio.sleep(delay)
+        if self._launch_slots is None:
+            self._launch_slots = asyncio.Semaphore(max(1, config.BOT_RELAUNCH_CONCURRENCY))
+        async with self._launch_slots:
+            if self.bots.get(entry.bot_id) is not entry:
+                return
+            try:
+                bot_process = await self.executor.launch_bot(
+                    entry.bot_code_path, entry.bot_name, entry.bot_token, entry.bot_id
+                )
+            except Exception as e:
+                logger.error(f"Restart of bot {entry.bot_id} failed: {e}")
+                self._schedule_restart(entry, f"Restart failed: {e}")
+                return
+        if counted:
+            entry.restarts += 1
+        self._record(
+            entry.bot_id, 'running',
+            process_id=bot_process.pid, restarts=entry.restarts, next_restart_at=None, error=None
+        )
+
+    def _record(self, bot_id: str, status: str, **fields):
+        """Push a status transition into the database"""
+        fields['status'] = status
+        fields['status_changed_at'] = datetime.now().isoformat(timespec='seconds')
+        if not self.db.update_bot(bot_id, fields):
+            logger.warning(f"Could not record status {status} for bot {bot_id}")
+
+    def start(
+        self,
+        interval: Optional[float] = None,
+        timeout: Optional[float] = None,
+        idle_timeout: Optional[float] = None
+    ):
+        """Begin periodic liveness and idle checks; an ``idle_timeout`` of 0 never hibernates"""
+        if self._health_task is None:
+            self._health_task = asyncio.ensure_future(self._check_health(
+                interval or config.BOT_HEARTBEAT_INTERVAL,
+                timeout or config.BOT_HEARTBEAT_TIMEOUT,
+                config.BOT_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+            ))
+
+    async def _check_health(self, interval: float, timeout: float, idle_timeout: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                killed = await self.executor.check_liveness(timeout)
+                if killed:
+                    logger.warning(f"Liveness check killed {killed} unresponsive bots")
+            except Exception as e:
+                logger.error(f"Error checking bot liveness: {e}")
+            if idle_timeout:
+                try:
+                    hibernated = await self.hibernate_idle(idle_timeout)
+                    if hibernated:
+                        logger.info(f"Hibernated {hibernated} idle bots")
+                except Exception as e:
+                    logger.error(f"Error hibernating idle bots: {e}")
+
+    async def close(self):
+        """Stop health checks, pending restarts and wake polls; running bots are left to the executor"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for entry in self.bots.values():
+            if entry.restart_task is not None:
+                entry.restart_task.cancel()
+        self.bots.clear()
+        await self.receiver.close()
@@ -0,0 +1,16 @@
+"""Keep test runs away from the real database, caches and executor state"""
+
+import os
+import sys
+import tempfile
+
+_STATE_DIR = tempfile.mkdtemp(prefix="botgen-tests-")
+
+os.environ.setdefault("MAIN_BOT_TOKEN", "test-token")
+os.environ["DATABASE_FILE"] = os.path.join(_STATE_DIR, "bots_database.json")
+os.environ["BOT_STATE_FILE"] = os.path.join(_STATE_DIR, "executor_state.json")
+os.environ["LLM_CACHE_DIR"] = ""
+os.environ["SIMILARITY_INDEX_FILE"] = ""
+os.environ["BOT_ZYGOTE_ENABLED"] = "false"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,33 @@
+"""Fallback tiers of BotGenerator.generate_bot"""
+
+import asyncio
+
+from bot_generator import FALLBACK_FAILED, BotGenerator
+from offline_generator import OFFLINE_MARKER
+from onlysq_client import OnlySqClient
+
+# Nothing listens on the discard port, so every connection is refused at once
+UNREACHABLE_URL = "http://127.0.0.1:9"
+
+def test_unreachable_llm_falls_back_to_offline_recipe():
+    async def generate():
+        generator = BotGenerator()
+        await generator.client.close()
+        generator.client = OnlySqClient(base_url=UNREACHABLE_URL)
+        generator.client.retry_policy.max_attempts = 1
+        reasons = []
+        try:
+            result = await generator.generate_bot(
+                "A bot that tracks my daily water intake and reminds me to drink",
+                budget=30,
+                on_fallback=reasons.append,
+                use_cache=False
+            )
+        finally:
+            await generator.close()
+        return result, reasons
+
+    (bot_code, _, bot_name), reasons = asyncio.run(generate())
+    assert reasons == [FALLBACK_FAILED]
+    assert OFFLINE_MARKER in bot_code
+    assert bot_name != "WeatherBot"
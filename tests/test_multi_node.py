@@ -0,0 +1,203 @@
+"""
+Several executor agents and the webhook ingress on localhost
+
+Agents run as real subprocesses with shared bot hosts, so webhook
+updates travel ingress -> controller -> agent -> bot host -> Application.
+The bots are stand-ins that print what they handle instead of talking
+to Telegram.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sys
+import time
+
+from bot_logs import bot_logs
+from database import JSONDatabase
+from executor_controller import ExecutorController
+from supervisor import BotSupervisor, RestartPolicy
+from webhook_ingress import SECRET_HEADER, WebhookIngress
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Registers its webhook and handles pushed updates without any network access
+FAKE_BOT = '''
+import asyncio
+
+class FakeTelegramBot:
+    async def set_webhook(self, url, secret_token):
+        pass
+
+class FakeUpdater:
+    running = False
+
+    async def start_polling(self):
+        self.running = True
+
+    async def stop(self):
+        self.running = False
+
+class FakeApplication:
+    running = False
+
+    def __init__(self):
+        self.bot = FakeTelegramBot()
+        self.updater = FakeUpdater()
+        self.update_queue = asyncio.Queue()
+        self.handlers = []
+
+    def add_handler(self, handler, group=0):
+        self.handlers.append(handler)
+
+    async def initialize(self):
+        pass
+
+    async def start(self):
+        self.running = True
+        self._consumer = asyncio.ensure_future(self._consume())
+
+    async def _consume(self):
+        while True:
+            update = await self.update_queue.get()
+            for handler in self.handlers:
+                await handler.callback(update, None)
+            print(f"handled {update.update_id}", flush=True)
+
+    async def stop(self):
+        self.running = False
+        self._consumer.cancel()
+
+    async def shutdown(self):
+        pass
+
+class StandInBot:
+    def __init__(self, token):
+        self.token = token
+
+    def build_application(self):
+        return FakeApplication()
+
+    def run(self):
+        pass
+'''
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def _wait_until(predicate, timeout: float = 20, message: str = "condition"):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError(f"Timed out waiting for {message}")
+        await asyncio.sleep(0.1)
+
+async def _start_agent(address: str, name: str, workdir: str) -> asyncio.subprocess.Process:
+    env = dict(os.environ)
+    env.update({
+        "BOT_HOSTING": "shared",
+        "BOT_HOST_WORKERS": "1",
+        "BOT_ZYGOTE_ENABLED": "false",
+        "BOT_AGENT_REPORT_INTERVAL": "0.2",
+        "PYTHONUNBUFFERED": "1"
+    })
+    return await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(ROOT, "executor_agent.py"), address, name,
+        cwd=workdir, env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+    )
+
+async def _post(ingress: WebhookIngress, bot_id: str, update_id: int) -> int:
+    """Post one synthetic update the way Telegram would; returns the HTTP status"""
+    body = json.dumps({"update_id": update_id}).encode()
+    reader, writer = await asyncio.open_connection("127.0.0.1", ingress.port)
+    writer.write(
+        f"POST {ingress.path_for(bot_id)} HTTP/1.1\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"{SECRET_HEADER}: {ingress.secret_for(bot_id)}\r\n"
+        "Connection: close\r\n\r\n".encode() + body
+    )
+    status_line = await reader.readline()
+    writer.close()
+    return int(status_line.split()[1])
+
+def _handled(bot_id: str, update_id: int) -> bool:
+    return f"handled {update_id}" in bot_logs.tail(bot_id, 50)
+
+def _nodes(controller: ExecutorController):
+    return {bot_id: bot.node for bot_id, bot in controller.bots.items() if bot.status == "running"}
+
+def test_placement_rebalancing_and_failover(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    code_path = str(tmp_path / "stand_in_bot.py")
+    with open(code_path, "w", encoding="utf-8") as f:
+        f.write(FAKE_BOT)
+    bot_ids = [f"bot{i}" for i in range(4)]
+    # Quick restarts, so failover doesn't wait out the production backoff
+    policy = RestartPolicy(backoff_initial=0.2)
+
+    async def scenario():
+        address = f"tcp://127.0.0.1:{_free_port()}"
+        controller = ExecutorController(address, local_bots=False)
+        supervisor = BotSupervisor(controller, JSONDatabase(str(tmp_path / "bots.json")))
+        ingress = WebhookIngress(
+            controller, "http://127.0.0.1", "test-secret", host="127.0.0.1", port=_free_port(),
+            wake=supervisor.receiver.wake, wanted=supervisor.wanted
+        )
+        controller.webhook = ingress.endpoint
+        supervisor.receiver.pushed = ingress.handles
+        agents = []
+        try:
+            await controller.start()
+            await ingress.start()
+
+            # Placement: the only agent takes every bot
+            agents.append(await _start_agent(address, "agent-a", str(tmp_path)))
+            await _wait_until(lambda: "agent-a" in controller.agents, message="agent-a to join")
+            for bot_id in bot_ids:
+                await supervisor.launch(code_path, bot_id, f"token-{bot_id}", bot_id, policy=policy)
+            assert set(_nodes(controller).values()) == {"agent-a"}
+
+            # Routing: a pushed update reaches the bot's Application on the agent
+            assert await _post(ingress, "bot0", 1) == 200
+            await _wait_until(lambda: _handled("bot0", 1), message="bot0 to handle update 1")
+
+            # Rebalancing: a second agent takes half of the bots
+            agents.append(await _start_agent(address, "agent-b", str(tmp_path)))
+            await _wait_until(lambda: "agent-b" in controller.agents, message="agent-b to join")
+            await controller.rebalance()
+            await _wait_until(
+                lambda: sorted(_nodes(controller).values()) == ["agent-a"] * 2 + ["agent-b"] * 2,
+                message="bots to spread over both agents"
+            )
+            moved = next(bot_id for bot_id, node in _nodes(controller).items() if node == "agent-b")
+            assert await _post(ingress, moved, 2) == 200
+            await _wait_until(lambda: _handled(moved, 2), message=f"{moved} to handle update 2")
+
+            # Failover: agent-b dies, its bots restart on agent-a, and an update
+            # posted while they are down is held and delivered once they are back
+            agents[1].kill()
+            await _wait_until(lambda: "agent-b" not in controller.agents, message="agent-b to be dropped")
+            assert await _post(ingress, moved, 3) == 200
+            await _wait_until(
+                lambda: _nodes(controller) == {bot_id: "agent-a" for bot_id in bot_ids},
+                message="agent-b's bots to restart on agent-a"
+            )
+            await _wait_until(lambda: _handled(moved, 3), message=f"{moved} to handle update 3 after failover")
+
+            # A bot stopped for good gets a retryable error instead of a silent drop
+            assert await supervisor.stop("bot3")
+            assert await _post(ingress, "bot3", 4) == 503
+        finally:
+            await ingress.close()
+            await supervisor.close()
+            await controller.cleanup()
+            for agent in agents:
+                if agent.returncode is None:
+                    agent.terminate()
+                await agent.wait()
+
+    asyncio.run(scenario())
@@ -39,6 +39,35 @@ def format_uptime(seconds: float) -> str:
         logger.error(f"Error formatting uptime: {e}")
         return "N/A"
 
+def format_resources(usage: Optional[Dict[str, Any]]) -> str:
+    """
+    Format a bot's resource usage sample for status messages
+    
+    Args:
+        usage: Usage from the executor's resource monitor
+    
+    Returns:
+        Formatted usage (e.g., "RAM 85.2 MB (peak 90.1), CPU 3.2%, 12 files, 4 threads")
+    """
+    if not usage:
+        return "N/A"
+    try:
+        parts = [f"RAM {usage['rss_mb']} MB (peak {usage['rss_peak_mb']})"]
+        if usage.get('cpu_percent') is not None:
+            parts.append(f"CPU {usage['cpu_percent']}%")
+        if usage.get('fds') is not None:
+            parts.append(f"{usage['fds']} files")
+        parts.append(f"{usage['threads']} threads")
+        text = ", ".join(parts)
+        if usage.get('throttled'):
+            text += ", throttled"
+        if usage.get('shared'):
+            text += f" (shared by {usage['shared']} bots on one host)"
+        return text
+    except Exception as e:
+        logger.error(f"Error formatting resources: {e}")
+        return "N/A"
+
 def extract_function_names(code: str) -> list:
     """
     Extract function names from Python code
@@ -106,11 +135,14 @@ def sanitize_log_text(text: str, max_lines: int = 10) -> str:
         Sanitized text
     """
     try:
-        lines = text.split('\n')[:max_lines]
-        result = '\n'.join(lines)
-        if len(text.split('\n')) > max_lines:
-            result += f"\n... ({len(text.split(chr(10))) - max_lines} more lines)"
-        return result
+        # Walk to the end of line max_lines once instead of splitting the whole text
+        end = -1
+        for _ in range(max(max_lines, 0)):
+            end = text.find('\n', end + 1)
+            if end == -1:
+                return text
+        remaining = text.count('\n', end + 1) + 1
+        return f"{text[:max(end, 0)]}\n... ({remaining} more lines)"
     except Exception as e:
         logger.error(f"Error sanitizing log: {e}")
         return text[:500]
@@ -195,6 +227,9 @@ def create_status_message(bot_info: Dict[str, Any]) -> str:
         if bot_info.get('uptime_seconds'):
             message += f"Uptime: {format_uptime(bot_info['uptime_seconds'])}\n"
         
+        if bot_info.get('resources'):
+            message += f"Resources: {format_resources(bot_info['resources'])}\n"
+        
         if bot_info.get('error_message'):
             message += f"Error: {bot_info['error_message']}\n"
         
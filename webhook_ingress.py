@@ -0,0 +1,381 @@
+"""
+Shared webhook ingress for generated bots
+
+One asyncio HTTP server receives the updates of every hosted bot, instead
+of each bot holding a getUpdates long poll of its own. A bot launched in
+webhook mode registers
+
+    <BOT_WEBHOOK_URL>/webhook/<bot_id>/<secret>
+
+with Telegram, the secret being an HMAC of its id that Telegram also sends
+back in the X-Telegram-Bot-Api-Secret-Token header. Accepted updates go
+into a bounded queue per bot, and one delivery task per bot drains it in
+order, in batches of whatever piled up during the previous delivery, to
+wherever the bot runs: a bot host over its stdin pipe, or an executor
+agent over its connection. A full queue answers 429 and Telegram retries
+later, so a slow bot pushes back on its own sender without holding up
+anyone else. Updates for a bot that is hibernated or about to restart wait
+in its queue while it comes back; a bot that was stopped for good gets 503
+until its webhook is deleted, so Telegram keeps the update instead of us
+dropping it.
+
+Updates are acknowledged once queued; a generator crash loses what was
+still queued, as a bot crash loses what it had fetched but not handled.
+
+Synthetic updates can be posted locally for testing:
+
+    curl -H 'X-Telegram-Bot-Api-Secret-Token: <secret>' \
+        -d '{"update_id": 1, "message": {...}}' http://127.0.0.1:8000/webhook/<bot_id>/<secret>
+
+with the secret from ``WebhookIngress.secret_for()``; requests without the
+header are refused. A JSON array posts several updates in one request.
+tests/test_multi_node.py posts updates this way to bots on local agents.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import time
+from collections import deque
+from itertools import islice
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+
+import httpx
+
+from bot_executor import BotExecutor
+
+logger = logging.getLogger(__name__)
+
+# Largest request body accepted; Telegram updates are a few KB
+MAX_BODY = 1024 * 1024
+MAX_HEADERS = 64
+# Seconds an idle keep-alive connection stays open
+KEEP_ALIVE_TIMEOUT = 75
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+TELEGRAM_API_URL = "https://api.telegram.org"
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+    411: "Length Required", 413: "Payload Too Large", 429: "Too Many Requests", 503: "Service Unavailable"
+}
+
+# Wakes a bot that isn't running; whether it was waiting to be woken
+WakeCallback = Callable[[str], Awaitable[bool]]
+# Whether a bot that isn't running is coming back, i.e. hibernated or waiting to restart
+WantedCallback = Callable[[str], bool]
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class BotQueue:
+    """Updates accepted for one bot and not delivered yet"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.updates: Deque[Dict[str, Any]] = deque()
+        self.task: Optional[asyncio.Task] = None
+        self.received = 0
+        self.delivered = 0
+        # Turned away with 429 for Telegram to retry
+        self.rejected = 0
+        # Given up on after the bot stayed unreachable
+        self.dropped = 0
+
+    @property
+    def free(self) -> int:
+        return self.size - len(self.updates)
+
+class WebhookIngress:
+    """Receives webhook updates for many bots on one port and routes each to its bot"""
+
+    def __init__(
+        self,
+        executor: BotExecutor,
+        public_url: str,
+        secret: str,
+        host: str = '0.0.0.0',
+        port: int = 8000,
+        queue_size: int = 100,
+        batch_size: int = 20,
+        hold: float = 120,
+        wake: Optional[WakeCallback] = None,
+        wanted: Optional[WantedCallback] = None,
+        api_url: str = TELEGRAM_API_URL
+    ):
+        self.executor = executor
+        self.public_url = public_url.rstrip('/')
+        self._key = secret.encode('utf-8')
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.batch_size = max(1, batch_size)
+        self.hold = hold
+        self.wake = wake
+        self.wanted = wanted
+        self.api_url = api_url.rstrip('/')
+        self.queues: Dict[str, BotQueue] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+    def secret_for(self, bot_id: str) -> str:
+        return hmac.new(self._key, bot_id.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+    def path_for(self, bot_id: str) -> str:
+        return f"/webhook/{bot_id}/{self.secret_for(bot_id)}"
+
+    def endpoint(self, bot_id: str) -> Dict[str, str]:
+        """What a bot registers with setWebhook to get its updates through the ingress"""
+        return {"url": self.public_url + self.path_for(bot_id), "secret_token": self.secret_for(bot_id)}
+
+    def handles(self, bot_id: str) -> bool:
+        """Whether updates for the bot are pushed here rather than polled"""
+        bot = self.executor.bots.get(bot_id)
+        return bot is not None and bot.webhook
+
+    async def release(self, bot_id: str, token: str):
+        """
+        Delete the webhook of a bot stopped for good, so Telegram stops pushing
+        its updates here and keeps them for whenever it polls again
+        """
+        bot = self.executor.bots.get(bot_id)
+        if bot is not None and bot.status == "running":
+            # Launched again meanwhile and registered its webhook anew
+            return
+        queue = self.queues.pop(bot_id, None)
+        if queue is not None:
+            if queue.task is not None:
+                queue.task.cancel()
+            if queue.updates:
+                logger.warning(f"Dropping {len(queue.updates)} updates for stopped bot {bot_id}")
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(10))
+        try:
+            response = await self._client.post(
+                f"{self.api_url}/bot{token}/deleteWebhook", json={"drop_pending_updates": False}
+            )
+            data = response.json()
+            if not data.get("ok"):
+                logger.warning(f"Could not delete the webhook of bot {bot_id}: {data.get('description')}")
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning(f"Could not delete the webhook of bot {bot_id}: {e}")
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        logger.info(f"Webhook ingress listening on {self.host}:{self.port} for {self.public_url}")
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+        tasks = [queue.task for queue in self.queues.values() if queue.task is not None]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # --- HTTP -------------------------------------------------------------
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), KEEP_ALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                try:
+                    status, payload, extra = await self._dispatch(method, path, headers, body)
+                except HttpError as e:
+                    status, payload, extra = e.status, {"ok": False, "description": str(e)}, {}
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self._respond(writer, status, payload, keep_alive, extra)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except HttpError as e:
+            # The request itself was malformed; the connection can't be trusted further
+            self._respond(writer, e.status, {"ok": False, "description": str(e)}, False, {})
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except Exception as e:
+            logger.error(f"Error serving webhook request: {e}")
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        try:
+            method, path, _ = line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise HttpError(400, "Malformed request line")
+
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise HttpError(400, "Too many headers")
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HttpError(411, "Chunked bodies are not supported")
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HttpError(400, "Bad Content-Length")
+        if length > MAX_BODY:
+            raise HttpError(413, f"Body over {MAX_BODY} bytes")
+        body = await reader.readexactly(length) if length > 0 else b""
+        return method.upper(), path.split('?', 1)[0], headers, body
+
+    @staticmethod
+    def _respond(
+        writer: asyncio.StreamWriter,
+        status: int,
+        payload: Dict[str, Any],
+        keep_alive: bool,
+        extra: Dict[str, str]
+    ):
+        body = json.dumps(payload).encode('utf-8')
+        head = [
+            f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}"
+        ]
+        head.extend(f"{name}: {value}" for name, value in extra.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body)
+
+    async def _dispatch(
+        self,
+        method: str,
+        path: str,
+        headers: Dict[str, str],
+        body: bytes
+    ) -> Tuple[int, Dict[str, Any], Dict[str, str]]:
+        if path == "/healthz":
+            return 200, self.stats(), {}
+        parts = path.strip('/').split('/')
+        if len(parts) != 3 or parts[0] != "webhook":
+            raise HttpError(404, "Not found")
+        _, bot_id, secret = parts
+        # Request lines and headers are decoded as latin-1, which encodes back losslessly;
+        # compare_digest only takes str that is pure ASCII
+        if not hmac.compare_digest(secret.encode('latin-1'), self.secret_for(bot_id).encode('latin-1')):
+            raise HttpError(404, "Not found")
+        if method != "POST":
+            raise HttpError(405, "Use POST")
+        # Every webhook is set with a secret_token, so Telegram always sends it
+        token = headers.get(SECRET_HEADER)
+        if token is None or not hmac.compare_digest(token.encode('latin-1'), secret.encode('latin-1')):
+            raise HttpError(403, "Secret token mismatch")
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise HttpError(400, "Body is not JSON")
+        updates = data if isinstance(data, list) else [data]
+        if not updates or not all(isinstance(update, dict) and "update_id" in update for update in updates):
+            raise HttpError(400, "Expected an update or a list of updates")
+
+        if not await self._expected(bot_id):
+            # Not acknowledged, so Telegram keeps the update and retries
+            if bot_id in self.executor.bots:
+                raise HttpError(503, "Bot is not running")
+            raise HttpError(404, "No such bot")
+        queue = self.queues.get(bot_id)
+        if queue is None:
+            queue = self.queues[bot_id] = BotQueue(self.queue_size)
+        if queue.free < len(updates):
+            queue.rejected += len(updates)
+            return 429, {"ok": False, "description": "Bot is busy", "parameters": {"retry_after": 1}}, {"Retry-After": "1"}
+
+        queue.updates.extend(updates)
+        queue.received += len(updates)
+        if queue.task is None:
+            queue.task = asyncio.ensure_future(self._drain(bot_id, queue))
+        return 200, {"ok": True}, {}
+
+    async def _expected(self, bot_id: str) -> bool:
+        """Whether the bot is running, or will be soon enough to hold its updates for it"""
+        bot = self.executor.bots.get(bot_id)
+        if bot is not None and bot.status == "running":
+            return True
+        if self.wanted is not None:
+            return self.wanted(bot_id)
+        # Without a supervisor to ask, a hibernated bot is one we manage to wake
+        return self.wake is not None and await self.wake(bot_id)
+
+    # --- Delivery ---------------------------------------------------------
+
+    async def _drain(self, bot_id: str, queue: BotQueue):
+        """Deliver a bot's queued updates in order until the queue is empty"""
+        unreachable_since: Optional[float] = None
+        try:
+            while queue.updates:
+                batch = list(islice(queue.updates, self.batch_size))
+                try:
+                    taken = await self.executor.deliver_updates(bot_id, batch)
+                except Exception as e:
+                    logger.error(f"Error delivering updates to bot {bot_id}: {e}")
+                    taken = False
+                if taken:
+                    for _ in batch:
+                        queue.updates.popleft()
+                    queue.delivered += len(batch)
+                    unreachable_since = None
+                    continue
+
+                # Not running: hibernated, restarting or not loaded yet
+                if self.wanted is not None and not self.wanted(bot_id):
+                    logger.warning(f"Dropping {len(queue.updates)} updates for bot {bot_id}: stopped")
+                    queue.dropped += len(queue.updates)
+                    queue.updates.clear()
+                    break
+                now = time.monotonic()
+                if unreachable_since is None:
+                    unreachable_since = now
+                    if self.wake is not None:
+                        await self.wake(bot_id)
+                elif now - unreachable_since > self.hold:
+                    logger.warning(
+                        f"Dropping {len(queue.updates)} updates for bot {bot_id}: "
+                        f"not running for {self.hold:.0f}s"
+                    )
+                    queue.dropped += len(queue.updates)
+                    queue.updates.clear()
+                    break
+                await asyncio.sleep(0.5)
+        finally:
+            queue.task = None
+
+    def stats(self) -> Dict[str, Any]:
+        queues = self.queues.values()
+        return {
+            "bots": len(self.queues),
+            "queued": sum(len(queue.updates) for queue in queues),
+            "received": sum(queue.received for queue in queues),
+            "delivered": sum(queue.delivered for queue in queues),
+            "rejected": sum(queue.rejected for queue in queues),
+            "dropped": sum(queue.dropped for queue in queues)
+        }
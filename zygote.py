@@ -0,0 +1,459 @@
+"""
+Fork server that launches bot interpreters with the heavy imports already done
+
+The zygote imports the Telegram stack once and keeps a small pool of
+forked, idle children. A launch hands one of them the entry point, its
+environment and the pipe ends to use as stdio, and the zygote forks a
+replacement straight away. Children share the zygote's imported modules
+copy-on-write, so a launch costs a handoff instead of a cold interpreter
+start.
+
+Requests travel over a Unix datagram socket with the stdio descriptors
+attached as SCM_RIGHTS; the zygote reaps its children and reports their
+exit codes back. Only available where os.fork exists.
+
+Usage (started by ZygoteClient): python zygote.py <socket fd> <pool size> [module ...]
+"""
+
+import array
+import asyncio
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ZYGOTE_SCRIPT = os.path.abspath(__file__)
+# Largest request datagram (argv plus environment)
+_MAX_MESSAGE = 256 * 1024
+_FDS_PER_SPAWN = 2
+
+def available() -> bool:
+    return hasattr(os, "fork") and hasattr(socket, "AF_UNIX") and hasattr(socket.socket, "sendmsg")
+
+def _send_with_fds(sock: socket.socket, payload: Dict[str, Any], fds: List[int]):
+    sock.sendmsg(
+        [json.dumps(payload).encode("utf-8")],
+        [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))] if fds else []
+    )
+
+def _recv_with_fds(sock: socket.socket, max_fds: int) -> Tuple[bytes, List[int]]:
+    fds = array.array("i")
+    data, ancdata, _, _ = sock.recvmsg(_MAX_MESSAGE, socket.CMSG_SPACE(max_fds * fds.itemsize))
+    for level, kind, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - (len(cmsg_data) % fds.itemsize)])
+    return data, list(fds)
+
+def _exit_code(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+# --- Zygote side -------------------------------------------------------------
+
+def _run_child(job: Dict[str, Any], fds: List[int]):
+    """Become the requested program; never returns"""
+    import random
+    import runpy
+    import traceback
+
+    code = 1
+    try:
+        os.dup2(fds[0], 0)
+        os.dup2(fds[1], 1)
+        os.dup2(fds[1], 2)
+        for fd in fds:
+            if fd > 2:
+                os.close(fd)
+        os.chdir(job["cwd"])
+        os.environ.clear()
+        os.environ.update(job["env"])
+        sys.argv = list(job["argv"])
+        sys.path[0] = os.path.dirname(os.path.abspath(sys.argv[0]))
+        # Let the program configure logging as if it had just started
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.setLevel(logging.WARNING)
+        # Forked children would otherwise share the zygote's random state
+        random.seed()
+        runpy.run_path(sys.argv[0], run_name="__main__")
+        code = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            logging.shutdown()
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+class ZygoteServer:
+    """Keeps idle forked children ready and hands launches to them"""
+
+    def __init__(self, control: socket.socket, pool_size: int):
+        self.control = control
+        self.pool_size = max(1, pool_size)
+        # (pid, zygote end of the child's socket) of children waiting for a job
+        self.idle: Deque[Tuple[int, socket.socket]] = deque()
+        self.assigned: Dict[int, int] = {}
+        self._wakeup_r, self._wakeup_w = os.pipe()
+
+    def _fork_idle(self):
+        ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        pid = os.fork()
+        if pid == 0:
+            # Drop every descriptor that belongs to the zygote, so EOF on our
+            # socket reliably means the zygote is gone
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            ours.close()
+            self.control.close()
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            for _, sock in self.idle:
+                sock.close()
+            self._wait_for_job(theirs)
+        theirs.close()
+        self.idle.append((pid, ours))
+
+    @staticmethod
+    def _wait_for_job(sock: socket.socket):
+        data = b""
+        fds: List[int] = []
+        while True:
+            chunk, chunk_fds = _recv_with_fds(sock, _FDS_PER_SPAWN)
+            if not chunk:
+                break
+            data += chunk
+            fds.extend(chunk_fds)
+        sock.close()
+        if not data or len(fds) != _FDS_PER_SPAWN:
+            os._exit(0)
+        _run_child(json.loads(data), fds)
+
+    def refill(self):
+        while len(self.idle) < self.pool_size:
+            self._fork_idle()
+
+    def send(self, **event: Any):
+        try:
+            self.control.send(json.dumps(event).encode("utf-8"))
+        except OSError as e:
+            logger.error(f"Zygote could not report {event.get('event')}: {e}")
+
+    def spawn(self, job: Dict[str, Any], fds: List[int]):
+        try:
+            if len(fds) != _FDS_PER_SPAWN:
+                raise ValueError(f"expected {_FDS_PER_SPAWN} descriptors, got {len(fds)}")
+            while True:
+                if not self.idle:
+                    self.refill()
+                pid, sock = self.idle.popleft()
+                try:
+                    with sock:
+                        _send_with_fds(sock, job, fds)
+                    break
+                except OSError:
+                    # That idle child died before we reaped it; try the next one
+                    continue
+            self.assigned[pid] = job["id"]
+            self.send(event="spawned", id=job["id"], pid=pid)
+        except Exception as e:
+            self.send(event="failed", id=job.get("id"), error=f"{type(e).__name__}: {e}")
+        finally:
+            for fd in fds:
+                os.close(fd)
+        self.refill()
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self.assigned.pop(pid, None) is not None:
+                self.send(event="exit", pid=pid, code=_exit_code(status))
+            else:
+                # An idle child died before being used
+                for idle_pid, sock in list(self.idle):
+                    if idle_pid == pid:
+                        self.idle.remove((idle_pid, sock))
+                        sock.close()
+
+    def serve(self):
+        os.set_blocking(self._wakeup_w, False)
+        signal.set_wakeup_fd(self._wakeup_w)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        self.refill()
+        self.send(event="ready", pid=os.getpid())
+
+        while True:
+            try:
+                readable, _, _ = select.select([self.control, self._wakeup_r, sys.stdin], [], [])
+            except InterruptedError:
+                continue
+            if self._wakeup_r in readable:
+                os.read(self._wakeup_r, 4096)
+                self.reap()
+                self.refill()
+            if sys.stdin in readable and not os.read(sys.stdin.fileno(), 4096):
+                # Our parent closed the pipe or died
+                break
+            if self.control in readable:
+                data, fds = _recv_with_fds(self.control, _FDS_PER_SPAWN)
+                if data:
+                    self.spawn(json.loads(data), fds)
+
+        for _, sock in self.idle:
+            sock.close()
+
+def _warm_up_telegram():
+    """Build a throwaway Application so the imports it defers (httpcore and friends) happen here"""
+    try:
+        from telegram.ext import Application
+        Application.builder().token("0:warmup").build()
+    except Exception as e:
+        logger.warning(f"Zygote could not warm up telegram.ext: {e}")
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    control = socket.socket(fileno=int(sys.argv[1]))
+    pool_size = int(sys.argv[2])
+    for module in sys.argv[3:]:
+        try:
+            __import__(module)
+        except ImportError as e:
+            logger.warning(f"Zygote could not preload {module}: {e}")
+    if "telegram.ext" in sys.modules:
+        _warm_up_telegram()
+    ZygoteServer(control, pool_size).serve()
+
+# --- Parent side -------------------------------------------------------------
+
+class ForkedProcess:
+    """A zygote child, with the parts of asyncio.subprocess.Process the executor uses"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.returncode: Optional[int] = None
+        self.stdin: Optional[asyncio.StreamWriter] = None
+        self.stdout: Optional[asyncio.StreamReader] = None
+        self._exited = asyncio.get_running_loop().create_future()
+
+    async def wait(self) -> int:
+        return await asyncio.shield(self._exited)
+
+    def send_signal(self, signum: int):
+        if self.returncode is not None:
+            raise ProcessLookupError(self.pid)
+        os.kill(self.pid, signum)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def _set_exit(self, code: int):
+        if self.returncode is not None:
+            return
+        self.returncode = code
+        if self.stdin is not None:
+            self.stdin.close()
+        if not self._exited.done():
+            self._exited.set_result(code)
+
+    async def _poll_exit(self, interval: float = 1):
+        """Watch for the exit ourselves once the zygote can no longer report it"""
+        while self.returncode is None:
+            try:
+                os.kill(self.pid, 0)
+            except ProcessLookupError:
+                self._set_exit(-1)
+                return
+            except PermissionError:
+                pass
+            await asyncio.sleep(interval)
+
+class ZygoteClient:
+    """Starts the zygote and turns launch requests into ForkedProcess handles"""
+
+    def __init__(self, pool_size: int = 2, preload: Tuple[str, ...] = (), start_timeout: float = 60):
+        self.pool_size = pool_size
+        self.preload = preload
+        self.start_timeout = start_timeout
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._sock: Optional[socket.socket] = None
+        self._next_id = 0
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._children: Dict[int, ForkedProcess] = {}
+        self._ready: Optional[asyncio.Future] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def ensure_started(self):
+        """Start the zygote, or restart it after it died"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.alive:
+                return
+            loop = asyncio.get_running_loop()
+            ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._ready = loop.create_future()
+            try:
+                self.process = await asyncio.create_subprocess_exec(
+                    sys.executable, '-u', ZYGOTE_SCRIPT, str(theirs.fileno()), str(self.pool_size), *self.preload,
+                    stdin=asyncio.subprocess.PIPE,
+                    pass_fds=(theirs.fileno(),)
+                )
+            finally:
+                theirs.close()
+            ours.setblocking(False)
+            self._sock = ours
+            loop.add_reader(ours.fileno(), self._on_readable)
+            asyncio.ensure_future(self._watch(self.process, ours))
+            await asyncio.wait_for(asyncio.shield(self._ready), self.start_timeout)
+            logger.info(f"Zygote ready (PID: {self.process.pid}, pool of {self.pool_size})")
+
+    async def spawn(self, argv: List[str], env: Dict[str, str], stdin_pipe: bool = False) -> ForkedProcess:
+        """
+        Launch a program from a warm zygote child
+
+        stdout and stderr are merged into ForkedProcess.stdout; stdin is
+        /dev/null unless ``stdin_pipe`` asks for a writable ForkedProcess.stdin.
+        """
+        await self.ensure_started()
+        loop = asyncio.get_running_loop()
+        out_r, out_w = os.pipe()
+        if stdin_pipe:
+            in_r, in_w = os.pipe()
+        else:
+            in_r, in_w = os.open(os.devnull, os.O_RDONLY), None
+
+        self._next_id += 1
+        request_id = self._next_id
+        spawned = self._pending[request_id] = loop.create_future()
+        try:
+            job = {"id": request_id, "argv": argv, "env": env, "cwd": os.getcwd()}
+            _send_with_fds(self._sock, job, [in_r, out_w])
+        except OSError:
+            self._pending.pop(request_id, None)
+            for fd in (out_r, in_w):
+                if fd is not None:
+                    os.close(fd)
+            raise
+        finally:
+            # The message carries its own copies of the child's ends
+            os.close(in_r)
+            os.close(out_w)
+
+        try:
+            child = await asyncio.wait_for(spawned, self.start_timeout)
+        except BaseException:
+            self._pending.pop(request_id, None)
+            os.close(out_r)
+            if in_w is not None:
+                os.close(in_w)
+            raise
+
+        child.stdout = asyncio.StreamReader(limit=1024 * 1024)
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(child.stdout), os.fdopen(out_r, "rb", 0)
+        )
+        if in_w is not None:
+            transport, protocol = await loop.connect_write_pipe(
+                lambda: asyncio.StreamReaderProtocol(asyncio.StreamReader()), os.fdopen(in_w, "wb", 0)
+            )
+            child.stdin = asyncio.StreamWriter(transport, protocol, None, loop)
+        return child
+
+    def _on_readable(self):
+        while True:
+            try:
+                data = self._sock.recv(_MAX_MESSAGE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.error(f"Zygote socket error: {e}")
+                return
+            if not data:
+                return
+            try:
+                event = json.loads(data)
+            except ValueError:
+                logger.warning("Zygote sent an unreadable message")
+                continue
+
+            kind = event.get("event")
+            if kind == "ready":
+                if self._ready is not None and not self._ready.done():
+                    self._ready.set_result(True)
+            elif kind == "spawned":
+                # Registered right away: its exit may be in the very next message
+                child = self._children[event["pid"]] = ForkedProcess(event["pid"])
+                future = self._pending.pop(event.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(child)
+            elif kind == "failed":
+                future = self._pending.pop(event.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_exception(RuntimeError(f"Zygote launch failed: {event.get('error')}"))
+            elif kind == "exit":
+                child = self._children.pop(event.get("pid"), None)
+                if child is not None:
+                    child._set_exit(event.get("code", 1))
+
+    async def _watch(self, process: asyncio.subprocess.Process, sock: socket.socket):
+        """Clean up after the zygote exits; its running children are polled from then on"""
+        code = await process.wait()
+        asyncio.get_running_loop().remove_reader(sock.fileno())
+        sock.close()
+        if self._ready is not None and not self._ready.done():
+            self._ready.set_exception(RuntimeError(f"Zygote exited with code {code} during startup"))
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError(f"Zygote exited with code {code}"))
+        self._pending.clear()
+        orphans = list(self._children.values())
+        self._children.clear()
+        for child in orphans:
+            asyncio.ensure_future(child._poll_exit())
+        if orphans:
+            logger.warning(f"Zygote exited with code {code}; {len(orphans)} children are now polled")
+
+    async def close(self, timeout: float = 5):
+        """Stop the zygote; children already handed out keep running"""
+        if not self.alive:
+            return
+        self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+if __name__ == "__main__":
+    main()